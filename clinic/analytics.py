@@ -0,0 +1,152 @@
+"""
+Time series for the dashboard charts.
+
+/api/analytics/timeseries/?start=&end=&bucket=&doctor= returns, for every
+day, week (from Monday) or month between start and end:
+
+- prescriptions: visits in the bucket
+- new_patients / returning_patients: distinct patients seen in the bucket,
+  split by whether it holds their first visit (with that doctor when one
+  is given)
+- medicines: per-bucket counts of the most prescribed medicines
+
+The aggregation is vectorized. Prescription dates and patient ids come
+back as two column arrays from one values_list() read (covered by
+rx_date_patient_idx), medicine counts from the MedicineUsage day buckets
+(clinic/usage.py), and NumPy bins them. Five years of visits cost a few
+array operations, not a Python loop per row.
+
+Responses are cached per (range, bucket, doctor) and the range's revision:
+the sum of DailyStats.revision over its days, which every prescription or
+medicine row write bumps for the day it touches (clinic/stats.py). A visit
+saved today only expires the series that include today; closed historical
+ranges stay cached until their own days are edited. (A visit back-dated
+to before a range can move a patient from new to returning in it without
+touching its days; ANALYTICS_CACHE_TIMEOUT bounds that.)
+
+Settings:
+    ANALYTICS_CACHE_ALIAS    which entry of CACHES holds the bodies, default 'default'
+    ANALYTICS_CACHE_TIMEOUT  seconds a body is kept, default one hour
+"""
+import json
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Sum
+
+from .models import DailyStats, Medicine, MedicineUsage, Prescription
+
+
+BUCKETS = ('day', 'week', 'month')
+
+# About eleven years by day; wider ranges must use a coarser bucket
+MAX_BUCKETS = 4000
+
+DEFAULT_MEDICINES = 10
+MAX_MEDICINES = 50
+
+
+def range_revision(start, end):
+    """
+    Sum of the day revisions from `start` to `end`. Revisions only grow, so
+    it changes whenever any day in the range is written.
+    """
+    return DailyStats.objects.filter(day__range=(start, end)).aggregate(revision=Sum('revision'))['revision'] or 0
+
+
+def bucket_starts(start, end, bucket):
+    """First day of every `bucket` overlapping start..end, as a datetime64[D] array."""
+    if bucket == 'month':
+        months = np.arange(np.datetime64(start, 'M'), np.datetime64(end, 'M') + 1)
+        return months.astype('datetime64[D]')
+    if bucket == 'week':
+        start -= timedelta(days=start.weekday())
+    step = 7 if bucket == 'week' else 1
+    return np.arange(np.datetime64(start, 'D'), np.datetime64(end, 'D') + 1, step)
+
+
+def columns(rows, *dtypes):
+    """values_list() rows as one NumPy array per column."""
+    rows = list(rows)
+    if not rows:
+        return [np.empty(0, dtype=dtype) for dtype in dtypes]
+    return [np.array(column, dtype=dtype) for column, dtype in zip(zip(*rows), dtypes)]
+
+
+def timeseries(start, end, bucket='day', doctor=None, medicines=DEFAULT_MEDICINES):
+    """
+    Visit, new/returning patient and medicine counts per `bucket` from
+    `start` to `end` (inclusive), by `doctor` or clinic-wide, as a
+    JSON-ready dict.
+    """
+    starts = bucket_starts(start, end, bucket)
+    slot_count = len(starts)
+    visits = Prescription.objects.filter(date__range=(start, end))
+    usage = MedicineUsage.objects.filter(day__range=(start, end), count__gt=0)
+    if doctor is not None:
+        visits = visits.filter(doctor=doctor)
+        usage = usage.filter(doctor=doctor)
+    else:
+        usage = usage.filter(doctor__isnull=True)
+
+    dates, patients = columns(visits.values_list('date', 'patient_id').order_by(), 'datetime64[D]', np.int64)
+    slots = np.searchsorted(starts, dates, side='right') - 1
+    prescriptions = np.bincount(slots, minlength=slot_count)
+
+    # Distinct (patient, bucket) pairs, sorted by patient and then bucket,
+    # so each patient's first pair is their first bucket in the range
+    seen = np.unique(patients * slot_count + slots)
+    seen_patients, seen_slots = np.divmod(seen, slot_count)
+    first = np.ones(len(seen), dtype=bool)
+    first[1:] = seen_patients[1:] != seen_patients[:-1]
+    earlier = Prescription.objects.filter(date__lt=start, patient__in=visits.values('patient'))
+    if doctor is not None:
+        earlier = earlier.filter(doctor=doctor)
+    earlier = np.fromiter(earlier.values_list('patient_id', flat=True).order_by().distinct(), dtype=np.int64)
+    new = first & ~np.isin(seen_patients, earlier)
+    new_patients = np.bincount(seen_slots[new], minlength=slot_count)
+    returning_patients = np.bincount(seen_slots, minlength=slot_count) - new_patients
+
+    days, medicine_ids, counts = columns(
+        usage.values_list('day', 'medicine_id', 'count').order_by(), 'datetime64[D]', np.int64, np.int64,
+    )
+    ids, rows = np.unique(medicine_ids, return_inverse=True)
+    per_bucket = np.zeros((len(ids), slot_count), dtype=np.int64)
+    np.add.at(per_bucket, (rows, np.searchsorted(starts, days, side='right') - 1), counts)
+    totals = per_bucket.sum(axis=1)
+    top = np.argsort(-totals, kind='stable')[:medicines]
+    names = Medicine.objects.in_bulk(ids[top].tolist())
+
+    return {
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'bucket': bucket,
+        'doctor': getattr(doctor, 'pk', doctor),
+        'buckets': starts.astype(str).tolist(),
+        'prescriptions': prescriptions.tolist(),
+        'new_patients': new_patients.tolist(),
+        'returning_patients': returning_patients.tolist(),
+        'medicines': [
+            {
+                'id': medicine_id,
+                'name': str(names[medicine_id]),
+                'total': int(totals[row]),
+                'counts': per_bucket[row].tolist(),
+            }
+            for row, medicine_id in zip(top, ids[top].tolist())
+        ],
+    }
+
+
+def cached_timeseries(start, end, bucket='day', doctor_id=None, medicines=DEFAULT_MEDICINES):
+    """JSON body of timeseries(), from the cache or computed on a miss."""
+    cache = caches[getattr(settings, 'ANALYTICS_CACHE_ALIAS', 'default')]
+    revision = range_revision(start, end)
+    cache_key = f'analytics:{start}:{end}:{revision}:{bucket}:{doctor_id or "all"}:{medicines}'
+    body = cache.get(cache_key)
+    if body is None:
+        body = json.dumps(timeseries(start, end, bucket, doctor_id, medicines)).encode()
+        cache.set(cache_key, body, getattr(settings, 'ANALYTICS_CACHE_TIMEOUT', 60 * 60))
+    return body
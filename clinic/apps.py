@@ -1,5 +1,12 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class ClinicConfig(AppConfig):
     name = 'clinic'
+
+    def ready(self):
+        from . import signals  # noqa: F401  (connects the receivers)
+        from .search import ensure_search_index_after_migrate
+
+        post_migrate.connect(ensure_search_index_after_migrate, sender=self)
@@ -0,0 +1,136 @@
+"""
+Medicine catalog typeahead.
+
+The prescription form's medicine dropdowns query /api/medicines/search/
+as the user types instead of loading the whole catalog into every row.
+The first name word is answered as a range over the Lower(name) index
+(medicine_name_lower_idx) and other words narrow the matches by name, form
+or strength. The first page opens with the matches the requesting doctor
+prescribes most (one grouped query over the MedicineUsage buckets, see
+clinic/usage.py); all other matches follow alphabetically, keyset-paged
+(clinic/pagination.py) so deep pages cost the same as the first.
+
+Query examples: "amox", "amox 500", "syp amox" (a leading form narrows by
+form), "" (the doctor's most prescribed medicines).
+
+The catalog (medicines, lab tests and prescription templates) carries a version
+number in the Counter table, bumped by clinic/signals.py on every write.
+The JSON APIs use it as their ETag and cache their serialized bodies per
+version, so an unchanged catalog costs one indexed read per request.
+
+Settings:
+    CATALOG_CACHE_ALIAS    which entry of CACHES holds the bodies, default 'default'
+    CATALOG_CACHE_TIMEOUT  seconds a body is kept, default one day
+"""
+import json
+import re
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q, Sum
+from django.db.models.functions import Lower
+
+from .models import Counter, Medicine, MedicineUsage
+from .pagination import keyset_paginate
+
+
+CATALOG_VERSION_COUNTER = 'catalog_version'
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 50
+
+# Alphabetical order of the matches after the doctor's most used ones;
+# the first column is answered by medicine_name_lower_idx
+SEARCH_ORDER = ('name_lower', 'form', 'strength', 'id')
+
+_TOKEN_RE = re.compile(r'[\w./%+-]+', re.UNICODE)
+
+# 'tab', 'tablet', 'syp', 'syrup', ... -> form code
+FORM_ALIASES = {
+    alias.lower(): code
+    for code, label in Medicine.FORM_CHOICES
+    for alias in (code, label)
+}
+
+
+def most_used_medicines(doctor, medicines, limit):
+    """
+    Up to `limit` of `medicines` (a queryset) that `doctor` prescribed most,
+    most used first, in one grouped query over the MedicineUsage buckets.
+    """
+    if doctor is None:
+        return []
+    ranked = list(
+        MedicineUsage.objects.filter(doctor=doctor, medicine__in=medicines.values('pk'))
+        .values('medicine_id').annotate(uses=Sum('count')).filter(uses__gt=0)
+        .order_by('-uses', 'medicine_id').values_list('medicine_id', flat=True)[:limit]
+    )
+    found = Medicine.objects.in_bulk(ranked)
+    return [found[pk] for pk in ranked if pk in found]
+
+
+def _prefix_filter(prefix):
+    """Range form of Lower(name) LIKE 'prefix%' that an index can answer."""
+    return Q(name_lower__gte=prefix, name_lower__lt=prefix + '\uffff')
+
+
+def search_medicines(query, doctor=None, cursor=None, page_size=DEFAULT_PAGE_SIZE):
+    """
+    One page of active medicines matching `query`. The first page opens with
+    the matches `doctor` prescribes most (up to half a page); every other
+    match follows alphabetically, keyset-paged by `cursor`, so any match can
+    be reached however many there are. An empty query offers only the
+    doctor's usual medicines. Returns (medicines, next cursor or None).
+    """
+    page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+    tokens = _TOKEN_RE.findall((query or '').lower())
+    medicines = Medicine.objects.filter(is_active=True).annotate(name_lower=Lower('name'))
+
+    if tokens and len(tokens) > 1 and tokens[0] in FORM_ALIASES:
+        medicines = medicines.filter(form=FORM_ALIASES[tokens.pop(0)])
+
+    if not tokens:
+        # No text yet: offer the doctor's usual medicines
+        return most_used_medicines(doctor, medicines, page_size), None
+
+    medicines = medicines.filter(_prefix_filter(tokens[0]))
+    for token in tokens[1:]:
+        medicines = medicines.filter(
+            Q(name__icontains=token) | Q(form__istartswith=token) | Q(strength__istartswith=token)
+        )
+
+    # Up to half of the first page; re-read on every page so the
+    # alphabetical part never repeats them
+    used = most_used_medicines(doctor, medicines, page_size // 2)
+    rest = medicines.exclude(pk__in=[medicine.pk for medicine in used])
+    if cursor:
+        page = keyset_paginate(rest, SEARCH_ORDER, cursor, page_size, descending=False)
+        return page.items, page.next_cursor
+    page = keyset_paginate(rest, SEARCH_ORDER, page_size=page_size - len(used), descending=False)
+    return used + page.items, page.next_cursor
+
+
+def get_catalog_version():
+    """(version, last modified time or None) of the catalog, in one indexed read."""
+    row = Counter.objects.filter(name=CATALOG_VERSION_COUNTER).values_list('value', 'updated_at').first()
+    return row or (0, None)
+
+
+def bump_catalog_version():
+    """Mark the catalog as changed; rolled back with the surrounding transaction."""
+    return Counter.increment(CATALOG_VERSION_COUNTER)
+
+
+def cached_catalog_json(key, version, build):
+    """
+    JSON body for `key` at catalog `version`, from the cache or serialized
+    from build() on a miss. Older versions simply expire.
+    """
+    cache = caches[getattr(settings, 'CATALOG_CACHE_ALIAS', 'default')]
+    cache_key = f'catalog-json:{version}:{key}'
+    body = cache.get(cache_key)
+    if body is None:
+        body = json.dumps(build(), cls=DjangoJSONEncoder).encode()
+        cache.set(cache_key, body, getattr(settings, 'CATALOG_CACHE_TIMEOUT', 60 * 60 * 24))
+    return body
@@ -0,0 +1,154 @@
+"""
+Diagnosis tables derived from Prescription.diagnosis.
+
+Prescription.diagnosis holds Select2 tags as one comma-separated string,
+which can only be searched with a scan. Two derived tables fix that:
+
+- Diagnosis / PrescriptionDiagnosis: one row per distinct tag, plus one
+  link row per (prescription, tag) carrying the visit date, indexed on
+  (diagnosis, date) so "all COPD visits this year" is a range lookup.
+- DiagnosisStat: per-tag use_count and last_used, so the prescription form
+  can list recent diagnoses with an indexed top-N query.
+
+Both are updated incrementally by the signal handlers in clinic/signals.py.
+Migrations 0020 and 0021 fill them from existing prescriptions, and
+`python manage.py backfill_diagnoses` rebuilds them from scratch. The
+rebuild functions take the models to write, so the migrations can run them
+on their historical models.
+"""
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Diagnosis, DiagnosisStat, Prescription, PrescriptionDiagnosis
+from .normalization import normalize_diagnosis, split_diagnoses
+
+
+def get_or_create_diagnoses(diagnoses, model=Diagnosis):
+    """Map {key: display text} to {key: Diagnosis}, creating missing rows in bulk."""
+    if not diagnoses:
+        return {}
+    model.objects.bulk_create(
+        [model(key=key, name=name) for key, name in diagnoses.items()],
+        ignore_conflicts=True,
+    )
+    return {d.key: d for d in model.objects.filter(key__in=diagnoses)}
+
+
+def index_prescription_diagnoses(prescription):
+    """Replace a prescription's PrescriptionDiagnosis rows to match its diagnosis field."""
+    diagnoses = get_or_create_diagnoses(split_diagnoses(prescription.diagnosis))
+    PrescriptionDiagnosis.objects.filter(prescription=prescription).delete()
+    PrescriptionDiagnosis.objects.bulk_create([
+        PrescriptionDiagnosis(prescription=prescription, diagnosis=diagnosis, date=prescription.date)
+        for diagnosis in diagnoses.values()
+    ])
+
+
+def prescriptions_with_diagnosis(text, date_from=None, date_to=None):
+    """Prescriptions tagged with diagnosis `text`, optionally within a date range."""
+    links = PrescriptionDiagnosis.objects.filter(diagnosis__key=normalize_diagnosis(text))
+    if date_from:
+        links = links.filter(date__gte=date_from)
+    if date_to:
+        links = links.filter(date__lte=date_to)
+    return Prescription.objects.filter(pk__in=links.values('prescription_id'))
+
+
+def update_diagnosis_stats(old_text, new_text, when=None):
+    """
+    Apply the change of one prescription's diagnosis from `old_text` to
+    `new_text`: tags that were added count one more use, removed ones one
+    fewer, and every current tag is marked as used at `when`.
+    """
+    old = split_diagnoses(old_text)
+    new = split_diagnoses(new_text)
+    added = new.keys() - old.keys()
+    removed = old.keys() - new.keys()
+    kept = new.keys() & old.keys()
+    when = when or timezone.now()
+
+    if added:
+        DiagnosisStat.objects.bulk_create(
+            [DiagnosisStat(key=key, text=new[key], use_count=0, last_used=when) for key in added],
+            ignore_conflicts=True,
+        )
+        DiagnosisStat.objects.filter(key__in=added).update(use_count=F('use_count') + 1, last_used=when)
+    if kept:
+        DiagnosisStat.objects.filter(key__in=kept).update(last_used=when)
+    if removed:
+        DiagnosisStat.objects.filter(key__in=removed, use_count__gt=0).update(use_count=F('use_count') - 1)
+
+
+def recent_diagnoses(limit=20):
+    """Display text of the `limit` most recently used diagnoses still in use."""
+    return list(
+        DiagnosisStat.objects.filter(use_count__gt=0)
+        .order_by('-last_used')
+        .values_list('text', flat=True)[:limit]
+    )
+
+
+def _tagged_prescriptions(prescriptions, chunk_size):
+    """(pk, date, {key: text}, updated_at) of every prescription with a diagnosis."""
+    rows = prescriptions.exclude(diagnosis='').values_list('pk', 'date', 'diagnosis', 'updated_at').order_by('pk')
+    for pk, visit_date, diagnosis, updated_at in rows.iterator(chunk_size=chunk_size):
+        yield pk, visit_date, split_diagnoses(diagnosis), updated_at
+
+
+def rebuild_diagnosis_stats(prescriptions, model=DiagnosisStat, chunk_size=2000):
+    """Replace every `model` row with the use counts over `prescriptions`. Returns the rows written."""
+    stats = {}
+    for _, _, diagnoses, updated_at in _tagged_prescriptions(prescriptions, chunk_size):
+        for key, text in diagnoses.items():
+            stat = stats.get(key)
+            if stat is None:
+                stats[key] = model(key=key, text=text, use_count=1, last_used=updated_at)
+                continue
+            stat.use_count += 1
+            if updated_at > stat.last_used:
+                stat.last_used = updated_at
+    model.objects.all().delete()
+    return len(model.objects.bulk_create(stats.values(), batch_size=1000))
+
+
+def rebuild_diagnosis_index(prescriptions, model=Diagnosis, link_model=PrescriptionDiagnosis, chunk_size=2000):
+    """
+    Replace every `link_model` row with the tags of `prescriptions`,
+    creating the `model` diagnoses they need, `chunk_size` prescriptions
+    at a time. Returns the links written.
+    """
+    link_model.objects.all().delete()
+    written = 0
+    pending = []
+
+    def flush():
+        diagnoses = get_or_create_diagnoses(
+            {key: text for _, _, tags in pending for key, text in tags.items()}, model,
+        )
+        links = link_model.objects.bulk_create(
+            [
+                link_model(prescription_id=pk, diagnosis=diagnoses[key], date=visit_date)
+                for pk, visit_date, tags in pending for key in tags
+            ],
+            batch_size=1000,
+        )
+        pending.clear()
+        return len(links)
+
+    for pk, visit_date, tags, _ in _tagged_prescriptions(prescriptions, chunk_size):
+        pending.append((pk, visit_date, tags))
+        if len(pending) >= chunk_size:
+            written += flush()
+    return written + flush()
+
+
+def rebuild_diagnosis_tables(chunk_size=2000):
+    """
+    Recompute Diagnosis, PrescriptionDiagnosis and DiagnosisStat from every
+    prescription. Returns (distinct diagnoses, prescription links).
+    """
+    with transaction.atomic():
+        links = rebuild_diagnosis_index(Prescription.objects.all(), chunk_size=chunk_size)
+        diagnoses = rebuild_diagnosis_stats(Prescription.objects.all(), chunk_size=chunk_size)
+    return diagnoses, links
@@ -0,0 +1,68 @@
+"""
+Duplicate-patient detection.
+
+Candidates are fetched with index lookups on Patient.name_key (a phonetic
+blocking key, see clinic.normalization.phonetic_name_key) and Patient.phone,
+then scored in Python. Only the handful of rows sharing a key or a phone
+number are ever read, however large the registry is.
+"""
+from collections import namedtuple
+from difflib import SequenceMatcher
+
+from django.db.models import Q
+
+from .models import Patient
+from .normalization import normalize_name, phonetic_name_key
+
+
+DuplicateCandidate = namedtuple('DuplicateCandidate', ['patient', 'score'])
+
+# Weight of each signal in the final 0..1 score
+NAME_WEIGHT = 0.6
+PHONE_WEIGHT = 0.4
+
+# Safety cap on rows read for a very common name such as "Muhammad Ali"
+MAX_BLOCK_SIZE = 200
+
+
+def score_candidate(patient, name, name_key, phone=''):
+    """Score how likely `patient` is the same person as (name, phone)."""
+    score = 0.0
+    if name_key and patient.name_key == name_key:
+        similarity = SequenceMatcher(
+            None, normalize_name(name), normalize_name(patient.name)
+        ).ratio()
+        score += NAME_WEIGHT * similarity
+    if phone and patient.phone == phone:
+        score += PHONE_WEIGHT
+    return round(score, 3)
+
+
+def find_duplicate_candidates(name, phone='', limit=5, exclude_pk=None):
+    """
+    Return up to `limit` DuplicateCandidate(patient, score), best first.
+
+    A patient is a candidate if its phonetic name key equals that of `name`
+    (so "Mohammad" finds "Muhammad") or it has exactly the same phone.
+    """
+    name_key = phonetic_name_key(name)
+    phone = (phone or '').strip()
+
+    query = Q()
+    if name_key:
+        query |= Q(name_key=name_key)
+    if phone:
+        query |= Q(phone=phone)
+    if not query:
+        return []
+
+    patients = Patient.objects.filter(query)
+    if exclude_pk is not None:
+        patients = patients.exclude(pk=exclude_pk)
+
+    candidates = [
+        DuplicateCandidate(patient, score_candidate(patient, name, name_key, phone))
+        for patient in patients[:MAX_BLOCK_SIZE]
+    ]
+    candidates.sort(key=lambda c: (-c.score, -c.patient.pk))
+    return candidates[:limit]
@@ -1,5 +1,11 @@
+from functools import cached_property
+
 from django import forms
+from django.core.exceptions import ValidationError
+from django.forms.utils import flatatt
+from django.utils.html import format_html
 from .models import Patient, Medicine, Prescription, PrescriptionMedicine, LabTest
+from .refdata import get_reference_data
 
 
 class PatientForm(forms.ModelForm):
@@ -77,6 +83,107 @@ class PrescriptionForm(forms.ModelForm):
             'follow_up': forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'Follow-up date/notes'}),
         }
 
+    def __init__(self, *args, reference_data=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Lab test options from the per-process cache; POSTed ids are still validated by query
+        reference_data = reference_data or get_reference_data()
+        self.fields['tests_ordered'].choices = reference_data.lab_test_choices
+
+
+class SharedMedicineChoices:
+    """
+    Medicine lookups shared by every row of a prescription formset.
+
+    The dropdowns load their options from the typeahead API, so the page
+    only needs the medicines already chosen: those of existing rows come
+    with the formset queryset (select_related), and all submitted ids are
+    validated together with one IN query instead of once per row.
+    """
+
+    def __init__(self, queryset=None):
+        self.queryset = Medicine.objects.all() if queryset is None else queryset
+        self.known = {}
+        self._submitted_loaded = False
+
+    def remember(self, medicine):
+        if medicine is not None:
+            self.known[medicine.pk] = medicine
+
+    def load_submitted(self, values):
+        """Fetch every submitted medicine id in one query."""
+        pks = set()
+        for value in values:
+            try:
+                pks.add(int(value))
+            except (TypeError, ValueError):
+                continue
+        self.known.update(self.queryset.in_bulk(pks - self.known.keys()))
+        self._submitted_loaded = True
+
+    def get(self, pk):
+        if pk not in self.known and not self._submitted_loaded:
+            # Form used outside a formset
+            self.remember(self.queryset.filter(pk=pk).first())
+        return self.known.get(pk)
+
+    def label(self, pk):
+        medicine = self.get(pk)
+        return None if medicine is None else str(medicine)
+
+    @cached_property
+    def matcher(self):
+        """Catalog name matcher for typed medicine names, looked up once per formset."""
+        return get_reference_data().medicine_matcher
+
+
+class SharedOptionsSelect(forms.Select):
+    """
+    A <select> that renders only the blank and the selected option; the
+    page script fills in the rest from the typeahead API, so the HTML
+    doesn't grow with rows x catalog size.
+    """
+
+    def __init__(self, shared, attrs=None):
+        super().__init__(attrs)
+        self.shared = shared
+
+    def render(self, name, value, attrs=None, renderer=None):
+        final_attrs = self.build_attrs(self.attrs, attrs)
+        final_attrs['name'] = name
+        options = format_html('<option value="">{}</option>', '---------')
+        try:
+            label = self.shared.label(int(value))
+        except (TypeError, ValueError):
+            label = None
+        if label is not None:
+            options += format_html('<option value="{}" selected>{}</option>', value, label)
+        return format_html('<select{}>{}</select>', flatatt(final_attrs), options)
+
+
+class SharedMedicineChoiceField(forms.ModelChoiceField):
+    """ModelChoiceField that looks choices up in a SharedMedicineChoices."""
+
+    def __init__(self, shared, attrs=None, **kwargs):
+        self.shared = shared
+        super().__init__(queryset=shared.queryset, widget=SharedOptionsSelect(shared, attrs), **kwargs)
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        if isinstance(value, Medicine):
+            return value
+        try:
+            medicine = self.shared.get(int(value))
+        except (TypeError, ValueError):
+            medicine = None
+        if medicine is None:
+            raise ValidationError(
+                self.error_messages['invalid_choice'],
+                code='invalid_choice',
+                params={'value': value},
+            )
+        return medicine
+
 
 class PrescriptionMedicineForm(forms.ModelForm):
     """Form for adding medicines to a prescription"""
@@ -126,6 +233,8 @@ class PrescriptionMedicineForm(forms.ModelForm):
             }
         ),
     )
+    # Ticked to save a typed name that resembles a catalog medicine as written
+    keep_typed_name = forms.BooleanField(required=False)
 
     class Meta:
         model = PrescriptionMedicine
@@ -144,8 +253,15 @@ class PrescriptionMedicineForm(forms.ModelForm):
             'instructions': forms.HiddenInput(),
         }
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, medicine_choices=None, **kwargs):
         super().__init__(*args, **kwargs)
+        self.medicine_choices = medicine_choices
+        self.medicine_suggestions = []
+
+        if medicine_choices is not None:
+            self.fields['medicine'] = SharedMedicineChoiceField(
+                medicine_choices, attrs=self.fields['medicine'].widget.attrs,
+            )
 
         existing_instruction = (self.initial.get('instructions') or '').strip()
         if not existing_instruction and self.instance and self.instance.pk:
@@ -185,14 +301,75 @@ class PrescriptionMedicineForm(forms.ModelForm):
         else:
             cleaned_data['instructions'] = ''
 
+        self.check_typed_medicine(cleaned_data)
         return cleaned_data
 
+    def check_typed_medicine(self, cleaned_data):
+        """
+        A typed name that is not in the catalog but close to catalog names
+        ("Prednisone" vs "Prednisolone") must be confirmed: the doctor picks
+        the intended medicine from the list or ticks keep_typed_name.
+        Saved rows are only checked when their typed name was edited.
+        """
+        typed = (cleaned_data.get('custom_medicine') or '').strip()
+        if not typed or cleaned_data.get('medicine') or cleaned_data.get('keep_typed_name'):
+            return
+        if self.instance.pk and 'custom_medicine' not in self.changed_data:
+            return
+        matcher = self.medicine_choices.matcher if self.medicine_choices else get_reference_data().medicine_matcher
+        if matcher.exact_match(typed) is not None:
+            return
+        self.medicine_suggestions = [
+            medicine for match in matcher.suggest(typed, limit=3) for medicine in match.medicines
+        ]
+        if self.medicine_suggestions:
+            self.add_error('custom_medicine', ValidationError(
+                '"%(typed)s" is not in the catalog. Did you mean %(suggestions)s? '
+                'Pick it from the list, or tick "Keep as typed" to save the name as written.',
+                code='unconfirmed_medicine',
+                params={
+                    'typed': typed,
+                    'suggestions': ', '.join(str(medicine) for medicine in self.medicine_suggestions),
+                },
+            ))
+
+    def _get_validation_exclusions(self):
+        exclude = super()._get_validation_exclusions()
+        if isinstance(self.fields['medicine'], SharedMedicineChoiceField):
+            # Already checked against the batch lookup; skip the per-row FK query
+            exclude.add('medicine')
+        return exclude
+
+
+class BasePrescriptionMedicineFormSet(forms.BaseInlineFormSet):
+    """Shares one set of medicine lookups between all rows and empty_form."""
+
+    def __init__(self, *args, **kwargs):
+        kwargs.setdefault('queryset', PrescriptionMedicine.objects.select_related('medicine'))
+        super().__init__(*args, **kwargs)
+        self.medicine_choices = SharedMedicineChoices()
+
+    def get_form_kwargs(self, index):
+        kwargs = super().get_form_kwargs(index)
+        kwargs['medicine_choices'] = self.medicine_choices
+        if index is not None and index < self.initial_form_count():
+            self.medicine_choices.remember(self.get_queryset()[index].medicine)
+        return kwargs
+
+    def full_clean(self):
+        if self.is_bound:
+            self.medicine_choices.load_submitted(
+                self.data.get(form.add_prefix('medicine')) for form in self.forms
+            )
+        super().full_clean()
+
 
 # Formset for multiple medicines in a prescription
 PrescriptionMedicineFormSet = forms.inlineformset_factory(
     Prescription,
     PrescriptionMedicine,
     form=PrescriptionMedicineForm,
+    formset=BasePrescriptionMedicineFormSet,
     extra=3,
     can_delete=True
 )
@@ -202,6 +379,7 @@ PrescriptionMedicineEditFormSet = forms.inlineformset_factory(
     Prescription,
     PrescriptionMedicine,
     form=PrescriptionMedicineForm,
+    formset=BasePrescriptionMedicineFormSet,
     extra=0,
     can_delete=True
 )
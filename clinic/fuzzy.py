@@ -0,0 +1,120 @@
+"""
+Fuzzy matching of typed medicine names against the catalog.
+
+A medicine typed into the free-text box used to become a new catalog entry
+unless it matched an existing name exactly, so every typo ("Azithromicin")
+added one more near-duplicate to the dropdowns. MedicineMatcher finds the
+catalog names it may have meant:
+
+1. candidates are the catalog names sharing the most character trigrams
+   with the typed name (an inverted index held in memory), then
+2. the best few are re-ranked by Levenshtein distance.
+
+Only names equal after normalization (case, accents, punctuation) are
+linked automatically. A close spelling is often a different drug
+("Prednisone" / "Prednisolone"), so near matches are only ever offered as
+suggestions the doctor has to pick (see PrescriptionMedicineForm).
+
+One matcher is built per catalog version as part of the reference data
+snapshot (clinic/refdata.py), so it is rebuilt lazily after any catalog
+edit. A lookup touches only the posting lists of the typed name's trigrams
+and costs well under a millisecond on a 20k-name formulary.
+"""
+from collections import Counter, defaultdict, namedtuple
+
+from .normalization import normalize_medicine_name
+
+
+MedicineMatch = namedtuple('MedicineMatch', ['name', 'medicines', 'distance'])
+
+# Names re-ranked by edit distance per lookup
+CANDIDATES = 20
+
+
+def trigrams(text):
+    """Character trigrams of `text`, padded so short names and word starts count."""
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def levenshtein(a, b, limit):
+    """
+    Edit distance between `a` and `b`, giving up as soon as it is known to
+    exceed `limit` (and returning limit + 1 then).
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (ca != cb),
+            ))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+class MedicineMatcher:
+    """Trigram index over the normalized names of a list of medicines."""
+
+    def __init__(self, medicines):
+        by_name = defaultdict(list)
+        for medicine in sorted(medicines, key=lambda m: m.pk):
+            name = normalize_medicine_name(medicine.name)
+            if name:
+                by_name[name].append(medicine)
+
+        self.names = list(by_name)
+        self.medicines = [by_name[name] for name in self.names]
+        self.positions = {name: position for position, name in enumerate(self.names)}
+        self.name_trigrams = [len(trigrams(name)) for name in self.names]
+        self.index = defaultdict(list)
+        for position, name in enumerate(self.names):
+            for gram in trigrams(name):
+                self.index[gram].append(position)
+
+    def suggest(self, name, limit=5, max_distance=None):
+        """
+        Up to `limit` MedicineMatch(name, medicines, distance) for the
+        catalog names within `max_distance` edits of `name` (default a
+        third of its length), best first. Each match carries every
+        medicine (form/strength) sharing that name, oldest first.
+        """
+        key = normalize_medicine_name(name)
+        if not key:
+            return []
+        if max_distance is None:
+            max_distance = max(1, len(key) // 3)
+        grams = trigrams(key)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.index.get(gram, ()))
+
+        # Dice coefficient picks the candidates, edit distance orders them
+        candidates = sorted(
+            shared,
+            key=lambda position: -2 * shared[position] / (len(grams) + self.name_trigrams[position]),
+        )[:CANDIDATES]
+        matches = []
+        for position in candidates:
+            distance = levenshtein(key, self.names[position], max_distance)
+            if distance <= max_distance:
+                matches.append(MedicineMatch(self.names[position], self.medicines[position], distance))
+        matches.sort(key=lambda match: (match.distance, match.name))
+        return matches[:limit]
+
+    def exact_match(self, name):
+        """
+        The oldest medicine whose name equals `name` once both are
+        normalized ("co-amoxiclav" and "Co Amoxiclav"), or None. Never a
+        merely similar name: those can be different drugs.
+        """
+        position = self.positions.get(normalize_medicine_name(name))
+        return None if position is None else self.medicines[position][0]
@@ -0,0 +1,126 @@
+"""
+Sequential, collision-free patient ID allocation.
+
+IDs come from the 'patient_id' row of the Counter table. Each process
+reserves a block of numbers with one UPDATE (Counter.increment) and hands
+them out from memory, so a new patient costs one database write per block
+instead of a random-guess-and-check loop. Two workers can never receive the
+same number because the reservation happens under the counter's row lock.
+
+Settings:
+    PATIENT_ID_PREFIX      default 'PT-'
+    PATIENT_ID_WIDTH       zero-padding width of the number, default 5
+                           (numbers past 99999 simply grow wider)
+    PATIENT_ID_BLOCK_SIZE  numbers reserved per round-trip, default 20
+
+Numbers from a block that is dropped (worker restart, rolled-back
+transaction) are never reused, so IDs may have gaps.
+"""
+import os
+import threading
+
+from django.conf import settings
+from django.db import transaction
+
+
+PATIENT_ID_COUNTER = 'patient_id'
+
+
+class BlockAllocator:
+    """Hands out numbers from blocks reserved on a named Counter."""
+
+    def __init__(self, counter_name, block_size):
+        self.counter_name = counter_name
+        self.block_size = block_size
+        self.reservations = 0
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._next = 0
+        self._end = 0
+        self._confirmed = True
+        self._commit_hook = None
+
+    def _block_is_live(self):
+        """
+        A block reserved inside a transaction is only safe to keep using
+        until that transaction ends: if it rolls back, the reservation is
+        undone and another process may be given the same numbers. The
+        on_commit hook confirms the block; while unconfirmed it stays usable
+        only as long as the hook is still pending on this connection.
+        """
+        if self._confirmed:
+            return True
+        connection = transaction.get_connection()
+        return connection.in_atomic_block and any(
+            func is self._commit_hook for _sids, func, _robust in connection.run_on_commit
+        )
+
+    def _reserve(self, count):
+        from .models import Counter
+
+        size = max(self.block_size, count)
+        end = Counter.increment(self.counter_name, size)
+        self.reservations += 1
+        self._next = end - size + 1
+        self._end = end + 1
+
+        connection = transaction.get_connection()
+        if connection.in_atomic_block:
+            self._confirmed = False
+
+            def confirm():
+                if self._commit_hook is confirm:
+                    self._confirmed = True
+
+            self._commit_hook = confirm
+            transaction.on_commit(confirm)
+        else:
+            self._confirmed = True
+            self._commit_hook = None
+
+    def allocate(self, count=1):
+        """Return a list of `count` unused numbers, in increasing order."""
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked worker: the parent's block is not ours to use
+                self._reset()
+            if not self._block_is_live():
+                self._reset()
+
+            numbers = []
+            while len(numbers) < count:
+                if self._next >= self._end:
+                    self._reserve(count - len(numbers))
+                take = min(count - len(numbers), self._end - self._next)
+                numbers.extend(range(self._next, self._next + take))
+                self._next += take
+            return numbers
+
+
+_patient_id_allocator = None
+_allocator_lock = threading.Lock()
+
+
+def get_patient_id_allocator():
+    global _patient_id_allocator
+    with _allocator_lock:
+        if _patient_id_allocator is None:
+            _patient_id_allocator = BlockAllocator(
+                PATIENT_ID_COUNTER,
+                getattr(settings, 'PATIENT_ID_BLOCK_SIZE', 20),
+            )
+        return _patient_id_allocator
+
+
+def format_patient_id(number):
+    prefix = getattr(settings, 'PATIENT_ID_PREFIX', 'PT-')
+    width = getattr(settings, 'PATIENT_ID_WIDTH', 5)
+    return f'{prefix}{number:0{width}d}'
+
+
+def allocate_patient_ids(count=1):
+    """Allocate `count` new patient IDs (e.g. ['PT-00041', 'PT-00042'])."""
+    return [format_patient_id(n) for n in get_patient_id_allocator().allocate(count)]
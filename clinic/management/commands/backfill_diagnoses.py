@@ -0,0 +1,28 @@
+"""
+Management command to rebuild the diagnosis tables from existing prescriptions.
+Run with: python manage.py backfill_diagnoses
+
+Migrations 0020 and 0021 fill the tables on upgrade; this is needed after
+bulk writes that bypass signals and safe to re-run at any time: the tables
+are recomputed from Prescription.diagnosis, not patched.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+
+from clinic.diagnoses import rebuild_diagnosis_tables
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the diagnosis index and usage statistics from existing prescriptions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Prescriptions read per query')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        diagnoses, links = rebuild_diagnosis_tables(chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {diagnoses} diagnoses across {links} prescription links '
+            f'in {time.perf_counter() - started:.2f}s'
+        ))
@@ -0,0 +1,98 @@
+"""
+Management command to benchmark patient ID allocation under concurrent inserts.
+Run with: python manage.py benchmark_patient_ids --workers 8 --per-worker 250
+
+Every worker thread inserts patients through Patient.save() on its own
+database connection. The benchmark patients are deleted again at the end.
+"""
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+
+from clinic.ids import get_patient_id_allocator
+from clinic.models import Patient
+
+
+BENCHMARK_NAME = '__id_benchmark__'
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks patient ID allocation with concurrent inserts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Concurrent inserting threads')
+        parser.add_argument('--per-worker', type=int, default=250, help='Patients inserted per thread')
+        parser.add_argument('--block-size', type=int, help='Override PATIENT_ID_BLOCK_SIZE for this run')
+        parser.add_argument('--keep', action='store_true', help='Keep the benchmark patients')
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        per_worker = options['per_worker']
+        if workers < 1 or per_worker < 1:
+            raise CommandError('--workers and --per-worker must be positive.')
+
+        allocator = get_patient_id_allocator()
+        if options['block_size']:
+            allocator.block_size = options['block_size']
+        reservations_before = allocator.reservations
+
+        errors = []
+        latencies = []
+        latencies_lock = threading.Lock()
+        start_barrier = threading.Barrier(workers)
+
+        def worker():
+            local = []
+            try:
+                start_barrier.wait()
+                for _ in range(per_worker):
+                    started = time.perf_counter()
+                    Patient.objects.create(name=BENCHMARK_NAME, gender='M')
+                    local.append(time.perf_counter() - started)
+            except Exception as e:  # reported below, the run keeps going
+                errors.append(e)
+            finally:
+                with latencies_lock:
+                    latencies.extend(local)
+                connections.close_all()
+
+        self.stdout.write(f'Inserting {workers} x {per_worker} patients...')
+        threads = [threading.Thread(target=worker) for _ in range(workers)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        ids = list(Patient.objects.filter(name=BENCHMARK_NAME).values_list('patient_id', flat=True))
+        inserted = len(ids)
+        duplicates = inserted - len(set(ids))
+        reservations = allocator.reservations - reservations_before
+
+        latencies.sort()
+        if latencies:
+            p50 = latencies[len(latencies) // 2] * 1000
+            p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+            self.stdout.write(f'Insert latency: p50 {p50:.2f} ms, p99 {p99:.2f} ms')
+        self.stdout.write(
+            f'Inserted {inserted} patients in {elapsed:.2f}s '
+            f'({inserted / elapsed:,.0f} rows/s) on {connection.vendor}'
+        )
+        self.stdout.write(
+            f'Counter writes: {reservations} '
+            f'({inserted / reservations if reservations else 0:.1f} IDs per write)'
+        )
+
+        if not options['keep']:
+            Patient.objects.filter(name=BENCHMARK_NAME).delete()
+
+        for error in errors[:5]:
+            self.stdout.write(self.style.ERROR(f'Worker error: {error}'))
+        if duplicates:
+            raise CommandError(f'{duplicates} duplicate patient IDs were allocated!')
+        if errors:
+            raise CommandError(f'{len(errors)} workers failed.')
+        self.stdout.write(self.style.SUCCESS('No duplicate IDs allocated.'))
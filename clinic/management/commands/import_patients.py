@@ -0,0 +1,176 @@
+"""
+Management command to bulk import legacy patient records from CSV or JSONL.
+Run with: python manage.py import_patients patients.csv [--batch-size 1000]
+
+Recognised columns/keys: name (required), gender (M/F/Male/Female), age,
+weight, phone, address. The file is streamed and processed in batches:
+each batch is validated, checked for duplicates against existing patients
+with a single query, given patient IDs from one sequence reservation and
+written with bulk_create inside its own transaction.
+"""
+import csv
+import json
+import time
+from itertools import islice
+from pathlib import Path
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from clinic.ids import allocate_patient_ids
+from clinic.models import Patient
+from clinic.normalization import phonetic_name_key
+from clinic.stats import count_new_patient
+
+
+IMPORT_FIELDS = ['name', 'gender', 'age', 'weight', 'phone', 'address']
+
+GENDER_ALIASES = {
+    'm': 'M', 'male': 'M',
+    'f': 'F', 'female': 'F',
+}
+
+
+def read_csv(path):
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        for line_no, row in enumerate(csv.DictReader(f), start=2):
+            yield line_no, row
+
+
+def read_jsonl(path):
+    with open(path, encoding='utf-8') as f:
+        for line_no, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield line_no, json.loads(line)
+            except json.JSONDecodeError as e:
+                yield line_no, e
+
+
+def duplicate_key(name_key, phone, age):
+    """Identity used for duplicate checks: name key plus phone, or age if no phone."""
+    if phone:
+        return (name_key, phone)
+    return (name_key, '', age)
+
+
+class Command(BaseCommand):
+    help = 'Bulk imports patients from a CSV or JSONL file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or JSONL file to import')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Defaults to the file extension')
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--on-duplicate', choices=['skip', 'create'], default='skip',
+            help='What to do with rows matching an existing patient (default: skip)',
+        )
+        parser.add_argument('--dry-run', action='store_true', help='Validate only, write nothing')
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        if not path.exists():
+            raise CommandError(f'File not found: {path}')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive.')
+
+        file_format = options['format'] or path.suffix.lstrip('.').lower()
+        readers = {'csv': read_csv, 'jsonl': read_jsonl, 'json': read_jsonl}
+        if file_format not in readers:
+            raise CommandError('Unknown file format; pass --format csv or --format jsonl.')
+
+        self.skip_duplicates = options['on_duplicate'] == 'skip'
+        self.dry_run = options['dry_run']
+        self.seen = set()
+        self.totals = {'read': 0, 'imported': 0, 'duplicates': 0, 'invalid': 0}
+
+        rows = readers[file_format](path)
+        started = time.perf_counter()
+        while True:
+            batch = list(islice(rows, options['batch_size']))
+            if not batch:
+                break
+            self.import_batch(batch)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f"  {self.totals['read']} rows read, {self.totals['imported']} imported "
+                f"({self.totals['read'] / elapsed:,.0f} rows/s)"
+            )
+
+        elapsed = time.perf_counter() - started
+        verb = 'Validated' if self.dry_run else 'Imported'
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {self.totals['imported']} patients from {self.totals['read']} rows in "
+            f"{elapsed:.2f}s ({self.totals['read'] / elapsed if elapsed else 0:,.0f} rows/s); "
+            f"skipped {self.totals['duplicates']} duplicates and {self.totals['invalid']} invalid rows"
+        ))
+
+    def clean_row(self, row):
+        """Validate one raw row against the Patient model fields."""
+        if not isinstance(row, dict):
+            raise ValidationError(str(row))
+
+        values = {}
+        for field_name in IMPORT_FIELDS:
+            raw = row.get(field_name)
+            raw = '' if raw is None else str(raw).strip()
+            if field_name == 'gender':
+                raw = GENDER_ALIASES.get(raw.lower(), raw)
+            field = Patient._meta.get_field(field_name)
+            if raw == '' and field.null:
+                raw = None
+            try:
+                values[field_name] = field.clean(raw, None)
+            except ValidationError as e:
+                raise ValidationError(f"{field_name}: {'; '.join(e.messages)}")
+        return values
+
+    def import_batch(self, batch):
+        self.totals['read'] += len(batch)
+
+        valid = []
+        for line_no, row in batch:
+            try:
+                values = self.clean_row(row)
+            except ValidationError as e:
+                self.totals['invalid'] += 1
+                self.stderr.write(f"Line {line_no}: {'; '.join(e.messages)}")
+                continue
+            values['name_key'] = phonetic_name_key(values['name'])
+            valid.append(values)
+
+        if self.skip_duplicates and valid:
+            # One set-based lookup for the whole batch
+            existing = {
+                duplicate_key(*fields)
+                for fields in Patient.objects.filter(
+                    name_key__in={v['name_key'] for v in valid}
+                ).values_list('name_key', 'phone', 'age')
+            }
+            unique = []
+            for values in valid:
+                key = duplicate_key(values['name_key'], values['phone'], values['age'])
+                if key in existing or key in self.seen:
+                    self.totals['duplicates'] += 1
+                    continue
+                self.seen.add(key)
+                unique.append(values)
+            valid = unique
+
+        if not valid or self.dry_run:
+            self.totals['imported'] += len(valid)
+            return
+
+        patient_ids = allocate_patient_ids(len(valid))
+        patients = [
+            Patient(patient_id=patient_id, **values)
+            for patient_id, values in zip(patient_ids, valid)
+        ]
+        with transaction.atomic():
+            Patient.objects.bulk_create(patients)
+            count_new_patient(timezone.now(), len(patients))  # bulk_create sends no signals
+        self.totals['imported'] += len(patients)
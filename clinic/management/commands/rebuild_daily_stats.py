@@ -0,0 +1,35 @@
+"""
+Management command to rebuild the dashboard's DailyStats rows.
+Run with: python manage.py rebuild_daily_stats [--since YYYY-MM-DD]
+
+Needed after bulk writes that bypass signals (migration 0024 fills the
+table on upgrade). Safe to re-run at any time: the rows are recomputed from
+the prescriptions and patients, not patched.
+"""
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from clinic.stats import rebuild_daily_stats
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the per-day dashboard totals from prescriptions and patients'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='Only rebuild days from this date on (YYYY-MM-DD)')
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            try:
+                since = date.fromisoformat(options['since'])
+            except ValueError:
+                raise CommandError(f"--since must be a date like 2024-01-31, got {options['since']!r}")
+
+        started = time.perf_counter()
+        days = rebuild_daily_stats(since=since)
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {days} days of dashboard stats in {time.perf_counter() - started:.2f}s'
+        ))
@@ -0,0 +1,35 @@
+"""
+Management command to check the medicine usage buckets against the prescriptions.
+Run with: python manage.py reconcile_medicine_usage [--since YYYY-MM-DD]
+
+Needed after any bulk write that bypassed the usage hooks (migration 0023
+fills the buckets on upgrade). Safe to re-run at any time: only buckets
+whose count differs from the prescriptions are rewritten.
+"""
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from clinic.usage import reconcile_medicine_usage
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the per-day medicine usage counters and fixes the ones that drifted'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='Only check days from this date on (YYYY-MM-DD)')
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            try:
+                since = date.fromisoformat(options['since'])
+            except ValueError:
+                raise CommandError(f"--since must be a date like 2024-01-31, got {options['since']!r}")
+
+        started = time.perf_counter()
+        corrected = reconcile_medicine_usage(since=since)
+        self.stdout.write(self.style.SUCCESS(
+            f'Corrected {corrected} medicine usage buckets in {time.perf_counter() - started:.2f}s'
+        ))
@@ -1,15 +1,131 @@
 """
 Management command to seed the database with initial data for medicines and lab tests.
 Run with: python manage.py seed_data
+     or: python manage.py seed_data --from-file formulary.csv [--batch-size 1000] [--update]
+
+Without --from-file the built-in pulmonology list is loaded. With it, a CSV
+formulary (columns: name, form, strength, default_dosage, is_active; only
+name is required) is streamed in batches. Every batch is written with one
+bulk insert that skips, or with --update overwrites, medicines already in
+the catalog under the same (name, form, strength), so re-running either
+mode is safe.
 """
-from django.core.management.base import BaseCommand
+import csv
+import time
+from itertools import islice
+from pathlib import Path
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from clinic.catalog import FORM_ALIASES, bump_catalog_version
 from clinic.models import Medicine, LabTest
 
 
+MEDICINE_FIELDS = ['name', 'form', 'strength', 'default_dosage', 'is_active']
+
+# Columns refreshed on existing medicines with --update
+UPDATE_FIELDS = ['default_dosage', 'is_active']
+
+FALSE_VALUES = {'0', 'false', 'no', 'n', 'inactive'}
+
+
+def read_csv(path):
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        for line_no, row in enumerate(csv.DictReader(f), start=2):
+            yield line_no, row
+
+
+def clean_medicine_row(row):
+    """Validate one formulary row against the Medicine fields; forms may be written out ('Tablet')."""
+    values = {}
+    for field_name in MEDICINE_FIELDS:
+        raw = (row.get(field_name) or '').strip()
+        if field_name == 'form':
+            raw = FORM_ALIASES.get(raw.lower(), raw) or 'Tab'
+        elif field_name == 'is_active':
+            raw = raw.lower() not in FALSE_VALUES
+        try:
+            values[field_name] = Medicine._meta.get_field(field_name).clean(raw, None)
+        except ValidationError as e:
+            raise ValidationError(f"{field_name}: {'; '.join(e.messages)}")
+    return values
+
+
+def upsert_medicines(rows, update=False):
+    """
+    Write medicine field dicts with one bulk insert. Medicines already in
+    the catalog are left alone, or with `update` get UPDATE_FIELDS from the
+    row. Rows repeating a (name, form, strength) keep the last one.
+    """
+    by_key = {(row['name'], row['form'], row['strength']): row for row in rows}
+    medicines = [Medicine(**row) for row in by_key.values()]
+    if update:
+        Medicine.objects.bulk_create(
+            medicines,
+            update_conflicts=True,
+            unique_fields=['name', 'form', 'strength'],
+            update_fields=UPDATE_FIELDS,
+        )
+    else:
+        Medicine.objects.bulk_create(medicines, ignore_conflicts=True)
+
+
 class Command(BaseCommand):
-    help = 'Seeds the database with initial medicines and lab tests'
+    help = 'Seeds the database with initial medicines and lab tests, or bulk loads a formulary CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from-file', help='CSV formulary to load instead of the built-in list')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows written per bulk insert')
+        parser.add_argument(
+            '--update', action='store_true',
+            help='Overwrite default dosage and active flag of medicines already in the catalog',
+        )
 
     def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive.')
+
+        if options['from_file']:
+            path = Path(options['from_file'])
+            if not path.exists():
+                raise CommandError(f'File not found: {path}')
+            self.load_formulary(path, options['batch_size'], options['update'])
+        else:
+            self.seed_defaults()
+        bump_catalog_version()  # bulk_create sends no signals
+
+    def load_formulary(self, path, batch_size, update):
+        before = Medicine.objects.count()
+        totals = {'read': 0, 'invalid': 0}
+        rows = read_csv(path)
+        started = time.perf_counter()
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            totals['read'] += len(batch)
+            valid = []
+            for line_no, row in batch:
+                try:
+                    valid.append(clean_medicine_row(row))
+                except ValidationError as e:
+                    totals['invalid'] += 1
+                    self.stderr.write(f"Line {line_no}: {'; '.join(e.messages)}")
+            with transaction.atomic():
+                upsert_medicines(valid, update=update)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f"  {totals['read']} rows read ({totals['read'] / elapsed:,.0f} rows/s)")
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Loaded {totals['read']} rows in {elapsed:.2f}s "
+            f"({totals['read'] / elapsed if elapsed else 0:,.0f} rows/s): "
+            f"{Medicine.objects.count() - before} new medicines, {totals['invalid']} invalid rows"
+        ))
+
+    def seed_defaults(self):
         self.stdout.write('Seeding medicines...')
         
         # Comprehensive medicines list for pulmonology/chest specialist
@@ -306,16 +422,12 @@ class Command(BaseCommand):
             {'name': 'ORS (Oral Rehydration Salts)', 'form': 'Sachet', 'strength': ''},
         ]
         
-        created_count = 0
-        for med_data in medicines_data:
-            obj, created = Medicine.objects.get_or_create(
-                name=med_data['name'],
-                form=med_data['form'],
-                strength=med_data.get('strength', ''),
-                defaults={'is_active': True}
-            )
-            if created:
-                created_count += 1
+        before = Medicine.objects.count()
+        upsert_medicines([
+            {'name': med_data['name'], 'form': med_data['form'], 'strength': med_data.get('strength', ''), 'is_active': True}
+            for med_data in medicines_data
+        ])
+        created_count = Medicine.objects.count() - before
         
         self.stdout.write(self.style.SUCCESS(f'Created {created_count} medicines'))
         
@@ -407,18 +519,19 @@ class Command(BaseCommand):
             {'name': 'Stool Routine Examination', 'abbreviation': 'Stool R/E', 'category': 'Other'},
         ]
         
-        created_count = 0
+        # LabTest.name has no unique constraint, so existing names are read once
+        existing = set(LabTest.objects.values_list('name', flat=True))
+        new_tests = {}
         for test_data in lab_tests_data:
-            obj, created = LabTest.objects.get_or_create(
-                name=test_data['name'],
-                defaults={
-                    'abbreviation': test_data.get('abbreviation', ''),
-                    'category': test_data.get('category', 'Other'),
-                    'is_active': True
-                }
-            )
-            if created:
-                created_count += 1
+            if test_data['name'] not in existing:
+                new_tests.setdefault(test_data['name'], LabTest(
+                    name=test_data['name'],
+                    abbreviation=test_data.get('abbreviation', ''),
+                    category=test_data.get('category', 'Other'),
+                    is_active=True,
+                ))
+        LabTest.objects.bulk_create(new_tests.values())
+        created_count = len(new_tests)
         
         self.stdout.write(self.style.SUCCESS(f'Created {created_count} lab tests'))
         self.stdout.write(self.style.SUCCESS('Database seeding completed!'))
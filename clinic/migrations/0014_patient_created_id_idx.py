@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-18 02:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0013_prescription_refer_to_alter_prescription_diagnosis'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='prescription',
+            name='refer_to',
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['-created_at', '-id'], name='patient_created_id_idx'),
+        ),
+    ]
@@ -0,0 +1,91 @@
+from django.db import migrations
+
+
+FTS_TABLE = 'clinic_patient_fts'
+
+
+def phone_digits_sql(column):
+    """SQL expression that strips common separators from a phone column."""
+    expression = column
+    for char in ('-', ' ', '+', '(', ')', '.'):
+        expression = f"replace({expression}, '{char}', '')"
+    return expression
+
+
+SQLITE_FORWARD = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        patient_id, name, phone, phone_digits,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '1 2 3 4'
+    )
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS clinic_patient_fts_ai AFTER INSERT ON clinic_patient BEGIN
+        INSERT INTO {FTS_TABLE} (rowid, patient_id, name, phone, phone_digits)
+        VALUES (new.id, new.patient_id, new.name, new.phone, {phone_digits_sql('new.phone')});
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS clinic_patient_fts_au
+    AFTER UPDATE OF patient_id, name, phone ON clinic_patient BEGIN
+        UPDATE {FTS_TABLE}
+        SET patient_id = new.patient_id, name = new.name,
+            phone = new.phone, phone_digits = {phone_digits_sql('new.phone')}
+        WHERE rowid = old.id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS clinic_patient_fts_ad AFTER DELETE ON clinic_patient BEGIN
+        DELETE FROM {FTS_TABLE} WHERE rowid = old.id;
+    END
+    """,
+    f"""
+    INSERT INTO {FTS_TABLE} (rowid, patient_id, name, phone, phone_digits)
+    SELECT id, patient_id, name, phone, {phone_digits_sql('phone')} FROM clinic_patient
+    """,
+]
+
+SQLITE_REVERSE = [
+    "DROP TRIGGER IF EXISTS clinic_patient_fts_ai",
+    "DROP TRIGGER IF EXISTS clinic_patient_fts_au",
+    "DROP TRIGGER IF EXISTS clinic_patient_fts_ad",
+    f"DROP TABLE IF EXISTS {FTS_TABLE}",
+]
+
+POSTGRES_FORWARD = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS clinic_patient_name_trgm "
+    "ON clinic_patient USING gin (UPPER(name) gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS clinic_patient_pid_prefix "
+    "ON clinic_patient (UPPER(patient_id) varchar_pattern_ops)",
+    "CREATE INDEX IF NOT EXISTS clinic_patient_phone_prefix "
+    "ON clinic_patient (phone varchar_pattern_ops)",
+]
+
+POSTGRES_REVERSE = [
+    "DROP INDEX IF EXISTS clinic_patient_name_trgm",
+    "DROP INDEX IF EXISTS clinic_patient_pid_prefix",
+    "DROP INDEX IF EXISTS clinic_patient_phone_prefix",
+]
+
+
+def run_statements(statements_by_vendor):
+    def run(apps, schema_editor):
+        for statement in statements_by_vendor.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0014_patient_created_id_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_statements({'sqlite': SQLITE_FORWARD, 'postgresql': POSTGRES_FORWARD}),
+            run_statements({'sqlite': SQLITE_REVERSE, 'postgresql': POSTGRES_REVERSE}),
+        ),
+    ]
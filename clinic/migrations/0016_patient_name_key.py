@@ -0,0 +1,42 @@
+# Generated by Django 4.2.30 on 2026-10-18 02:38
+
+from django.db import migrations, models
+
+from clinic.normalization import phonetic_name_key
+
+
+def backfill_name_keys(apps, schema_editor):
+    Patient = apps.get_model('clinic', 'Patient')
+    batch = []
+    for patient in Patient.objects.only('id', 'name').iterator(chunk_size=2000):
+        patient.name_key = phonetic_name_key(patient.name)
+        batch.append(patient)
+        if len(batch) >= 2000:
+            Patient.objects.bulk_update(batch, ['name_key'])
+            batch = []
+    if batch:
+        Patient.objects.bulk_update(batch, ['name_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0015_patient_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patient',
+            name='name_key',
+            field=models.CharField(blank=True, editable=False, max_length=100),
+        ),
+        migrations.RunPython(backfill_name_keys, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['name_key', 'phone'], name='patient_name_key_phone_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['phone'], name='patient_phone_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.30 on 2026-10-18 02:40
+
+import re
+
+from django.db import migrations, models
+
+
+def seed_patient_id_counter(apps, schema_editor):
+    """Start the sequence after the highest existing (randomly picked) ID."""
+    Counter = apps.get_model('clinic', 'Counter')
+    Patient = apps.get_model('clinic', 'Patient')
+    highest = 0
+    for patient_id in Patient.objects.values_list('patient_id', flat=True).iterator():
+        match = re.search(r'(\d+)$', patient_id or '')
+        if match:
+            highest = max(highest, int(match.group(1)))
+    Counter.objects.update_or_create(name='patient_id', defaults={'value': highest})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0016_patient_name_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Counter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(seed_patient_id_counter, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 02:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0017_counter_patient_id_sequence'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='prescription',
+            index=models.Index(fields=['patient', '-date', '-created_at', '-id'], name='rx_patient_history_idx'),
+        ),
+    ]
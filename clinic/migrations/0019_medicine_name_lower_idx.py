@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 02:43
+
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0018_prescription_patient_history_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='medicine',
+            index=models.Index(django.db.models.functions.text.Lower('name'), name='medicine_name_lower_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.30 on 2026-10-18 02:53
+
+from django.db import migrations, models
+import django.utils.timezone
+
+from clinic.diagnoses import rebuild_diagnosis_stats
+
+
+def backfill_diagnosis_stats(apps, schema_editor):
+    """Count the diagnoses of the existing prescriptions, as backfill_diagnoses does."""
+    Prescription = apps.get_model('clinic', 'Prescription')
+    rebuild_diagnosis_stats(Prescription.objects.all(), apps.get_model('clinic', 'DiagnosisStat'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0019_medicine_name_lower_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DiagnosisStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(help_text='Normalized diagnosis', max_length=255, unique=True)),
+                ('text', models.CharField(help_text='Diagnosis as first written', max_length=255)),
+                ('use_count', models.PositiveIntegerField(default=0)),
+                ('last_used', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-last_used'], name='diagnosis_stat_recent_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_diagnosis_stats, migrations.RunPython.noop),
+    ]
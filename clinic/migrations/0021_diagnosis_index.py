@@ -0,0 +1,51 @@
+# Generated by Django 4.2.30 on 2026-10-18 02:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from clinic.diagnoses import rebuild_diagnosis_index
+
+
+def backfill_diagnosis_index(apps, schema_editor):
+    """Index the diagnoses of the existing prescriptions, as backfill_diagnoses does."""
+    rebuild_diagnosis_index(
+        apps.get_model('clinic', 'Prescription').objects.all(),
+        apps.get_model('clinic', 'Diagnosis'),
+        apps.get_model('clinic', 'PrescriptionDiagnosis'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0020_diagnosisstat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Diagnosis',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(help_text='Normalized diagnosis', max_length=255, unique=True)),
+                ('name', models.CharField(max_length=255)),
+            ],
+            options={
+                'verbose_name_plural': 'Diagnoses',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.CreateModel(
+            name='PrescriptionDiagnosis',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(help_text='Copy of prescription.date')),
+                ('diagnosis', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='prescription_links', to='clinic.diagnosis')),
+                ('prescription', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='diagnosis_links', to='clinic.prescription')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['diagnosis', 'date'], name='rx_diagnosis_date_idx')],
+                'unique_together': {('prescription', 'diagnosis')},
+            },
+        ),
+        migrations.RunPython(backfill_diagnosis_index, migrations.RunPython.noop),
+    ]
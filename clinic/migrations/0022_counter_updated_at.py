@@ -0,0 +1,25 @@
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def seed_catalog_version(apps, schema_editor):
+    """Start the catalog version at 1 so the first catalog write is a plain UPDATE."""
+    Counter = apps.get_model('clinic', 'Counter')
+    Counter.objects.get_or_create(name='catalog_version', defaults={'value': 1})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0021_diagnosis_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='counter',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.RunPython(seed_catalog_version, migrations.RunPython.noop),
+    ]
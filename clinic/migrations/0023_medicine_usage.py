@@ -0,0 +1,60 @@
+# Generated by Django 4.2.30 on 2026-10-18 03:02
+
+from collections import Counter
+
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.deletion
+
+
+def backfill_medicine_usage(apps, schema_editor):
+    """Fill the usage buckets from the existing prescriptions, as reconcile_medicine_usage does."""
+    MedicineUsage = apps.get_model('clinic', 'MedicineUsage')
+    PrescriptionMedicine = apps.get_model('clinic', 'PrescriptionMedicine')
+    buckets = Counter()
+    for medicine_id, doctor_id, day, uses in (
+        PrescriptionMedicine.objects.filter(medicine__isnull=False)
+        .values('medicine_id', 'prescription__doctor_id', 'prescription__date')
+        .annotate(uses=Count('id'))
+        .values_list('medicine_id', 'prescription__doctor_id', 'prescription__date', 'uses')
+        .order_by()
+    ):
+        buckets[(medicine_id, None, day)] += uses
+        if doctor_id is not None:
+            buckets[(medicine_id, doctor_id, day)] += uses
+    MedicineUsage.objects.bulk_create(
+        [
+            MedicineUsage(medicine_id=medicine_id, doctor_id=doctor_id, day=day, count=count)
+            for (medicine_id, doctor_id, day), count in buckets.items()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0022_counter_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MedicineUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('doctor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='medicine_usage', to='clinic.doctor')),
+                ('medicine', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='usage', to='clinic.medicine')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='medicineusage',
+            constraint=models.UniqueConstraint(condition=models.Q(('doctor__isnull', False)), fields=('doctor', 'day', 'medicine'), name='medicine_usage_doctor_day_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='medicineusage',
+            constraint=models.UniqueConstraint(condition=models.Q(('doctor__isnull', True)), fields=('day', 'medicine'), name='medicine_usage_global_day_uniq'),
+        ),
+        migrations.RunPython(backfill_medicine_usage, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.30 on 2026-10-18 03:11
+
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+
+def backfill_daily_stats(apps, schema_editor):
+    """Fill DailyStats from the existing prescriptions and patients, as rebuild_daily_stats does."""
+    DailyStats = apps.get_model('clinic', 'DailyStats')
+    Patient = apps.get_model('clinic', 'Patient')
+    Prescription = apps.get_model('clinic', 'Prescription')
+    days = {}
+    for day, count, seen in (
+        Prescription.objects.values('date')
+        .annotate(count=Count('id'), seen=Count('patient', distinct=True))
+        .values_list('date', 'count', 'seen').order_by()
+    ):
+        days[day] = DailyStats(day=day, prescriptions=count, patients_seen=seen)
+    registrations = Patient.objects.annotate(day=TruncDate('created_at', tzinfo=timezone.get_current_timezone()))
+    for day, count in registrations.values('day').annotate(count=Count('id')).values_list('day', 'count').order_by():
+        days.setdefault(day, DailyStats(day=day)).new_patients = count
+    DailyStats.objects.bulk_create(days.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0023_medicine_usage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(unique=True)),
+                ('prescriptions', models.PositiveIntegerField(default=0)),
+                ('patients_seen', models.PositiveIntegerField(default=0, help_text='Distinct patients with a prescription')),
+                ('new_patients', models.PositiveIntegerField(default=0, help_text='Patients registered that day')),
+            ],
+            options={
+                'verbose_name_plural': 'Daily stats',
+                'ordering': ['-day'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='prescription',
+            index=models.Index(fields=['date', 'patient'], name='rx_date_patient_idx'),
+        ),
+        migrations.RunPython(backfill_daily_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 4.2.30 on 2026-10-18 03:13
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from clinic.rollups import count_doctor_days, count_lab_test_usage
+
+
+def backfill_rollups(apps, schema_editor):
+    """Fill the doctor rollups and lab test buckets from the existing prescriptions, as rebuild_rollups does."""
+    DoctorDailyRollup = apps.get_model('clinic', 'DoctorDailyRollup')
+    LabTestUsage = apps.get_model('clinic', 'LabTestUsage')
+    Prescription = apps.get_model('clinic', 'Prescription')
+    DoctorDailyRollup.objects.bulk_create(
+        count_doctor_days(Prescription.objects.all(), DoctorDailyRollup), batch_size=1000,
+    )
+    LabTestUsage.objects.bulk_create(
+        count_lab_test_usage(Prescription.tests_ordered.through.objects.all(), LabTestUsage), batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0024_daily_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LabTestUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('doctor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='lab_test_usage', to='clinic.doctor')),
+                ('lab_test', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='usage', to='clinic.labtest')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DoctorDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('prescriptions', models.PositiveIntegerField(default=0)),
+                ('patients', models.PositiveIntegerField(default=0, help_text='Distinct patients')),
+                ('first_visits', models.PositiveIntegerField(default=0)),
+                ('follow_ups', models.PositiveIntegerField(default=0)),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_rollups', to='clinic.doctor')),
+            ],
+            options={
+                'ordering': ['-day'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='labtestusage',
+            constraint=models.UniqueConstraint(condition=models.Q(('doctor__isnull', False)), fields=('doctor', 'day', 'lab_test'), name='lab_test_usage_doctor_day_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='labtestusage',
+            constraint=models.UniqueConstraint(condition=models.Q(('doctor__isnull', True)), fields=('day', 'lab_test'), name='lab_test_usage_global_day_uniq'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='doctordailyrollup',
+            unique_together={('doctor', 'day')},
+        ),
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 03:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinic', '0025_doctor_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dailystats',
+            name='revision',
+            field=models.PositiveIntegerField(default=0, help_text="Bumped on every write to the day's prescriptions"),
+        ),
+    ]
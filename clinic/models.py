@@ -1,8 +1,10 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
+from django.db.models.functions import Lower
 from django.contrib.auth.models import User
 from django.utils import timezone
-import random
-import string
+
+from .normalization import phonetic_name_key
 
 def get_current_local_date():
     return timezone.localtime(timezone.now()).date()
@@ -10,6 +12,36 @@ def get_current_local_date():
 def get_current_local_time():
     return timezone.localtime(timezone.now()).time()
 
+class Counter(models.Model):
+    """Named, monotonically increasing counter (id sequences, cache versions)"""
+    name = models.CharField(max_length=50, unique=True)
+    value = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    @classmethod
+    def increment(cls, name, by=1):
+        """
+        Atomically add `by` to the counter and return the new value.
+        
+        The UPDATE takes the row lock before the value is read back, so two
+        processes can never observe the same result. This is one write.
+        """
+        with transaction.atomic():
+            updated = cls.objects.filter(name=name).update(value=F('value') + by, updated_at=timezone.now())
+            if not updated:
+                try:
+                    with transaction.atomic():
+                        cls.objects.create(name=name, value=by)
+                    return by
+                except IntegrityError:
+                    # Another process created it first
+                    cls.objects.filter(name=name).update(value=F('value') + by, updated_at=timezone.now())
+            return cls.objects.values_list('value', flat=True).get(name=name)
+    
+    def __str__(self):
+        return f"{self.name} = {self.value}"
+
+
 class Doctor(models.Model):
     """Doctor profile linked to Django User"""
     user = models.OneToOneField(User, on_delete=models.CASCADE)
@@ -42,17 +74,19 @@ class Patient(models.Model):
     weight = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
     phone = models.CharField(max_length=20, blank=True)
     address = models.TextField(blank=True)
+    # Phonetic blocking key used by duplicate detection (see clinic.duplicates)
+    name_key = models.CharField(max_length=100, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     
     def save(self, *args, **kwargs):
+        self.name_key = phonetic_name_key(self.name)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'name' in update_fields:
+            kwargs['update_fields'] = set(update_fields) | {'name_key'}
         if not self.patient_id:
-            # Generate unique patient ID: PT-XXXXX
-            while True:
-                random_id = ''.join(random.choices(string.digits, k=5))
-                patient_id = f'PT-{random_id}'
-                if not Patient.objects.filter(patient_id=patient_id).exists():
-                    self.patient_id = patient_id
-                    break
+            # Sequential patient ID: PT-XXXXX (see clinic.ids)
+            from .ids import allocate_patient_ids
+            self.patient_id = allocate_patient_ids(1)[0]
         super().save(*args, **kwargs)
     
     def __str__(self):
@@ -60,6 +94,13 @@ class Patient(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Keyset pagination on the patient list walks (created_at, id)
+            models.Index(fields=['-created_at', '-id'], name='patient_created_id_idx'),
+            # Duplicate detection looks patients up by name key and/or phone
+            models.Index(fields=['name_key', 'phone'], name='patient_name_key_phone_idx'),
+            models.Index(fields=['phone'], name='patient_phone_idx'),
+        ]
 
 
 class Medicine(models.Model):
@@ -98,6 +139,10 @@ class Medicine(models.Model):
     class Meta:
         ordering = ['name']
         unique_together = ['name', 'form', 'strength']
+        indexes = [
+            # Case-insensitive lookups of typed medicine names
+            models.Index(Lower('name'), name='medicine_name_lower_idx'),
+        ]
 
 
 class LabTest(models.Model):
@@ -189,6 +234,78 @@ class Prescription(models.Model):
     
     class Meta:
         ordering = ['-date', '-created_at']
+        indexes = [
+            # Keyset pagination of a patient's visit history
+            models.Index(fields=['patient', '-date', '-created_at', '-id'], name='rx_patient_history_idx'),
+            # Per-day counts (DailyStats refresh) and date-range batch printing
+            models.Index(fields=['date', 'patient'], name='rx_date_patient_idx'),
+        ]
+
+
+class Diagnosis(models.Model):
+    """One distinct diagnosis tag; see PrescriptionDiagnosis"""
+    key = models.CharField(max_length=255, unique=True, help_text="Normalized diagnosis")
+    name = models.CharField(max_length=255)
+    
+    def __str__(self):
+        return self.name
+    
+    class Meta:
+        ordering = ['name']
+        verbose_name_plural = 'Diagnoses'
+
+
+class PrescriptionDiagnosis(models.Model):
+    """
+    Index row linking a prescription to each tag in its comma-separated
+    `diagnosis` field, maintained by clinic/diagnoses.py.
+    """
+    prescription = models.ForeignKey(Prescription, on_delete=models.CASCADE, related_name='diagnosis_links')
+    diagnosis = models.ForeignKey(Diagnosis, on_delete=models.CASCADE, related_name='prescription_links')
+    date = models.DateField(help_text="Copy of prescription.date")
+    
+    def __str__(self):
+        return f"{self.diagnosis} on {self.date}"
+    
+    class Meta:
+        unique_together = ['prescription', 'diagnosis']
+        indexes = [
+            # "All COPD visits this year" and per-diagnosis counts
+            models.Index(fields=['diagnosis', 'date'], name='rx_diagnosis_date_idx'),
+        ]
+
+
+class DailyStats(models.Model):
+    """Per-day totals behind the dashboard, kept current by clinic/stats.py"""
+    day = models.DateField(unique=True)
+    prescriptions = models.PositiveIntegerField(default=0)
+    patients_seen = models.PositiveIntegerField(default=0, help_text="Distinct patients with a prescription")
+    new_patients = models.PositiveIntegerField(default=0, help_text="Patients registered that day")
+    revision = models.PositiveIntegerField(default=0, help_text="Bumped on every write to the day's prescriptions")
+    
+    def __str__(self):
+        return f"{self.day}: {self.prescriptions} prescriptions"
+    
+    class Meta:
+        ordering = ['-day']
+        verbose_name_plural = 'Daily stats'
+
+
+class DiagnosisStat(models.Model):
+    """Usage of each diagnosis tag, kept current by clinic/diagnoses.py"""
+    key = models.CharField(max_length=255, unique=True, help_text="Normalized diagnosis")
+    text = models.CharField(max_length=255, help_text="Diagnosis as first written")
+    use_count = models.PositiveIntegerField(default=0)
+    last_used = models.DateTimeField(default=timezone.now)
+    
+    def __str__(self):
+        return f"{self.text} ({self.use_count})"
+    
+    class Meta:
+        indexes = [
+            # Most recently used diagnoses for the prescription form
+            models.Index(fields=['-last_used'], name='diagnosis_stat_recent_idx'),
+        ]
 
 
 class PrescriptionMedicine(models.Model):
@@ -260,6 +377,80 @@ class PrescriptionMedicine(models.Model):
         ordering = ['id']
 
 
+class MedicineUsage(models.Model):
+    """
+    How many times a medicine was prescribed on one day, by one doctor or
+    (doctor empty) by everyone. Maintained by clinic/usage.py.
+    """
+    medicine = models.ForeignKey(Medicine, on_delete=models.CASCADE, related_name='usage')
+    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, null=True, blank=True, related_name='medicine_usage')
+    day = models.DateField()
+    count = models.PositiveIntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.medicine} on {self.day}: {self.count}"
+    
+    class Meta:
+        constraints = [
+            # One bucket per key; they double as the indexes for top-N over a day range
+            models.UniqueConstraint(
+                fields=['doctor', 'day', 'medicine'],
+                condition=models.Q(doctor__isnull=False),
+                name='medicine_usage_doctor_day_uniq',
+            ),
+            models.UniqueConstraint(
+                fields=['day', 'medicine'],
+                condition=models.Q(doctor__isnull=True),
+                name='medicine_usage_global_day_uniq',
+            ),
+        ]
+
+
+class LabTestUsage(models.Model):
+    """
+    How many times a lab test was ordered on one day, by one doctor or
+    (doctor empty) by everyone. Maintained by clinic/usage.py.
+    """
+    lab_test = models.ForeignKey(LabTest, on_delete=models.CASCADE, related_name='usage')
+    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, null=True, blank=True, related_name='lab_test_usage')
+    day = models.DateField()
+    count = models.PositiveIntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.lab_test} on {self.day}: {self.count}"
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['doctor', 'day', 'lab_test'],
+                condition=models.Q(doctor__isnull=False),
+                name='lab_test_usage_doctor_day_uniq',
+            ),
+            models.UniqueConstraint(
+                fields=['day', 'lab_test'],
+                condition=models.Q(doctor__isnull=True),
+                name='lab_test_usage_global_day_uniq',
+            ),
+        ]
+
+
+class DoctorDailyRollup(models.Model):
+    """One doctor's visits on one day, kept current by clinic/rollups.py"""
+    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, related_name='daily_rollups')
+    day = models.DateField()
+    prescriptions = models.PositiveIntegerField(default=0)
+    patients = models.PositiveIntegerField(default=0, help_text="Distinct patients")
+    first_visits = models.PositiveIntegerField(default=0)
+    follow_ups = models.PositiveIntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.doctor} on {self.day}: {self.prescriptions} prescriptions"
+    
+    class Meta:
+        ordering = ['-day']
+        unique_together = ['doctor', 'day']
+
+
 class PrescriptionTemplate(models.Model):
     """Reusable prescription template for common conditions"""
     name = models.CharField(max_length=200, help_text="e.g., Asthma Standard Treatment")
@@ -0,0 +1,96 @@
+"""
+Pure text normalization helpers shared by models, indexes and importers.
+
+Nothing in here touches the database, so these functions are safe to call
+from model save() methods and data migrations.
+"""
+import re
+import unicodedata
+
+
+# Honorifics that say nothing about who the patient is
+NAME_TITLES = {'mr', 'mrs', 'ms', 'miss', 'dr', 'prof', 'master', 'baby'}
+
+# Spelling variants that sound the same in transliterated names
+# (applied in order, before vowels are dropped)
+PHONETIC_REPLACEMENTS = [
+    ('ph', 'f'),
+    ('kh', 'k'),
+    ('gh', 'g'),
+    ('ck', 'k'),
+    ('q', 'k'),
+    ('c', 'k'),
+    ('w', 'v'),
+    ('x', 'ks'),
+]
+
+VOWELS = set('aeiouy')
+
+_WORD_RE = re.compile(r'[a-z]+')
+_MEDICINE_WORD_RE = re.compile(r'[a-z0-9]+')
+
+
+def ascii_fold(text):
+    """Lowercase and strip accents, e.g. 'Zoë' -> 'zoe'."""
+    text = unicodedata.normalize('NFKD', text or '')
+    return text.encode('ascii', 'ignore').decode('ascii').lower()
+
+
+def normalize_name(name):
+    """Lowercase a name and collapse punctuation/whitespace to single spaces."""
+    words = [w for w in _WORD_RE.findall(ascii_fold(name)) if w not in NAME_TITLES]
+    return ' '.join(words)
+
+
+def _phonetic_word(word):
+    for old, new in PHONETIC_REPLACEMENTS:
+        word = word.replace(old, new)
+
+    # A leading vowel is kept but folded, so Usman/Osman agree
+    head = 'a' if word[0] in VOWELS else word[0]
+    tail = [ch for ch in word[1:] if ch not in VOWELS]
+
+    # A trailing 'h' after a vowel is silent (Fatimah -> Fatima)
+    if tail and tail[-1] == 'h' and word[-2:-1] in VOWELS:
+        tail.pop()
+
+    key = head
+    for ch in tail:
+        if ch != key[-1]:
+            key += ch
+    return key
+
+
+def phonetic_name_key(name, max_length=100):
+    """
+    Blocking key under which spelling variants of a name collide.
+
+    Each word is reduced to its consonant skeleton (so Muhammad, Mohammad and
+    Mohammed all become 'mhmd'), and words are sorted so 'Khan Ali' and
+    'Ali Khan' agree as well.
+    """
+    words = normalize_name(name).split()
+    return ' '.join(sorted(_phonetic_word(w) for w in words))[:max_length]
+
+
+def normalize_medicine_name(name):
+    """Lowercase a medicine name, strip accents and collapse punctuation, e.g. 'Co-Amoxiclav' -> 'co amoxiclav'."""
+    return ' '.join(_MEDICINE_WORD_RE.findall(ascii_fold(name)))
+
+
+def normalize_diagnosis(text):
+    """Case- and whitespace-insensitive key for a diagnosis tag."""
+    return ' '.join((text or '').split()).casefold()
+
+
+def split_diagnoses(text):
+    """
+    Split a comma-separated Prescription.diagnosis into {key: display text},
+    in the order written and without repeats.
+    """
+    diagnoses = {}
+    for part in (text or '').split(','):
+        display = ' '.join(part.split())
+        if display:
+            diagnoses.setdefault(normalize_diagnosis(display), display)
+    return diagnoses
@@ -0,0 +1,151 @@
+"""
+Keyset (cursor) pagination helpers.
+
+OFFSET pagination gets slower the deeper you page because the database still
+has to walk every skipped row. Keyset pagination remembers the sort key of the
+last row shown and asks for rows strictly "after" it, which an index on the
+sort columns answers directly no matter how large the table grows.
+"""
+import base64
+import json
+from datetime import date, datetime
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.utils.dateparse import parse_date, parse_datetime
+
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def _encode_value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, str):
+        # Dates first: parse_datetime() would also accept a bare date
+        parsed = parse_date(value)
+        if parsed is not None:
+            return parsed
+        parsed = parse_datetime(value)
+        if parsed is not None:
+            return parsed
+    return value
+
+
+def encode_cursor(values):
+    """Encode a tuple of sort-key values as an opaque URL-safe token."""
+    payload = json.dumps([_encode_value(v) for v in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token, length):
+    """Decode a cursor token; returns None if it is missing or malformed."""
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (ValueError, UnicodeDecodeError):
+        return None
+    if not isinstance(values, list) or len(values) != length:
+        return None
+    return [_decode_value(v) for v in values]
+
+
+def _ordering_field(queryset, name):
+    """Model field (or annotation output field) that `name` orders by."""
+    annotation = queryset.query.annotations.get(name)
+    if annotation is not None:
+        return annotation.output_field
+    return queryset.model._meta.get_field(name)
+
+
+def clean_cursor_values(queryset, fields, values):
+    """
+    Convert decoded cursor values to the types of the ordering `fields`;
+    returns None if any of them does not fit (e.g. an edited cursor).
+    """
+    if values is None:
+        return None
+    cleaned = []
+    for name, value in zip(fields, values):
+        if value is None:
+            return None
+        try:
+            cleaned.append(_ordering_field(queryset, name).to_python(value))
+        except (ValidationError, TypeError, ValueError):
+            return None
+    return cleaned
+
+
+def parse_page_size(value, default=DEFAULT_PAGE_SIZE):
+    """Parse a ?page_size= value, clamped to 1..MAX_PAGE_SIZE."""
+    try:
+        size = int(value)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(size, MAX_PAGE_SIZE))
+
+
+def _after_filter(fields, values, descending=True):
+    """
+    Build the "row comes after the cursor" filter for the sort.
+
+    For fields (a, b, c) sorted descending this is:
+        a < va OR (a = va AND b < vb) OR (a = va AND b = vb AND c < vc)
+    and the same with > for an ascending sort.
+    """
+    lookup = 'lt' if descending else 'gt'
+    condition = Q()
+    for i, field in enumerate(fields):
+        clause = Q(**{f'{field}__{lookup}': values[i]})
+        for prev_field, prev_value in zip(fields[:i], values[:i]):
+            clause &= Q(**{prev_field: prev_value})
+        condition |= clause
+    return condition
+
+
+class KeysetPage:
+    """One page of results plus the cursor for the next page (None at the end)."""
+
+    def __init__(self, items, next_cursor):
+        self.items = items
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def keyset_paginate(queryset, fields, cursor=None, page_size=DEFAULT_PAGE_SIZE, descending=True):
+    """
+    Return a KeysetPage of `queryset` ordered by `fields` (descending unless
+    `descending` is False).
+
+    `fields` must end with a unique column (normally 'id') so the ordering is
+    total, and should match an index for the query to stay constant-time.
+    A missing, malformed or mistyped cursor starts from the first page.
+    """
+    values = clean_cursor_values(queryset, fields, decode_cursor(cursor, len(fields)))
+    queryset = queryset.order_by(*[f'-{field}' if descending else field for field in fields])
+    if values is not None:
+        queryset = queryset.filter(_after_filter(fields, values, descending))
+
+    items = list(queryset[:page_size + 1])
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        last = items[-1]
+        next_cursor = encode_cursor([getattr(last, field) for field in fields])
+    return KeysetPage(items, next_cursor)
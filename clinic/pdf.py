@@ -0,0 +1,180 @@
+"""
+Server-side PDF rendering of prescription slips.
+
+The print slip HTML (from clinic/print_cache.py) is converted with
+WeasyPrint in a small local process pool, so a slow render never holds the
+web worker's GIL and a crash in the renderer cannot take the worker down:
+a render that outlives PRESCRIPTION_PDF_TIMEOUT raises PdfTimeout, and a
+crashed pool raises PdfUnavailable. Either way the pool's processes are
+killed and the next render starts a fresh pool, so stuck renders cannot
+hold on to every worker.
+Finished PDFs are written to a content-addressed disk cache named after
+the SHA-256 of the input HTML: the HTML already reflects the prescription
+version and the template, so a repeat download is a plain file read and
+an edited prescription naturally gets a new file.
+
+Settings:
+    PRESCRIPTION_PDF_DIR        cache directory, default BASE_DIR/'pdf_cache'
+    PRESCRIPTION_PDF_WORKERS    renderer processes, default 2
+    PRESCRIPTION_PDF_TIMEOUT    seconds to wait for one render, default 30
+    PRESCRIPTION_PDF_URDU_FONT  path to a Nastaliq .ttf/.otf to embed when
+                                "Noto Nastaliq Urdu" is not installed system-wide
+
+WeasyPrint is optional: without it (or without its system libraries)
+render_prescription_pdf() raises PdfUnavailable.
+
+Superseded versions stay on disk until the directory is cleared; every
+file in it can be regenerated.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from urllib.parse import unquote, urlsplit
+
+from django.conf import settings
+
+from .print_cache import render_prescription_print
+
+
+# Resolves the slip's relative URLs (static images) without any network access
+PDF_BASE_URL = 'http://prescripto.local/'
+
+
+class PdfUnavailable(Exception):
+    """Raised when the PDF renderer cannot be used on this server."""
+
+
+class PdfTimeout(Exception):
+    """Raised when a render takes longer than PRESCRIPTION_PDF_TIMEOUT."""
+
+
+def _load_weasyprint():
+    try:
+        import weasyprint
+    except (ImportError, OSError) as e:  # OSError: missing Pango/Cairo libraries
+        raise PdfUnavailable(f'WeasyPrint is not available: {e}')
+    return weasyprint
+
+
+def _static_url_fetcher(static_url, static_root, allowed_uris=()):
+    """URL fetcher that serves STATIC_URL paths from STATIC_ROOT plus `allowed_uris`, nothing else."""
+    weasyprint = _load_weasyprint()
+    prefix = PDF_BASE_URL.rstrip('/') + static_url
+
+    def fetch(url):
+        if url.startswith(prefix):
+            root = Path(static_root).resolve()
+            path = (root / unquote(urlsplit(url).path)[len(static_url):]).resolve()
+            if root not in path.parents:
+                raise ValueError(f'{url} is outside STATIC_ROOT')
+            return weasyprint.default_url_fetcher(path.as_uri())
+        if url.startswith('data:') or url in allowed_uris:
+            return weasyprint.default_url_fetcher(url)
+        raise ValueError(f'Refusing to fetch {url} while rendering a PDF')
+
+    return fetch
+
+
+def html_to_pdf(html, static_url, static_root, font_path=None):
+    """Convert HTML to PDF bytes. Runs inside a pool worker process."""
+    weasyprint = _load_weasyprint()
+    stylesheets = []
+    allowed_uris = ()
+    if font_path:
+        font_uri = Path(font_path).resolve().as_uri()
+        allowed_uris = (font_uri,)
+        stylesheets.append(weasyprint.CSS(string=(
+            f'@font-face {{ font-family: "Noto Nastaliq Urdu"; src: url("{font_uri}"); }}'
+        )))
+    document = weasyprint.HTML(
+        string=html,
+        base_url=PDF_BASE_URL,
+        url_fetcher=_static_url_fetcher(static_url, static_root, allowed_uris),
+    )
+    return document.write_pdf(stylesheets=stylesheets)
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pdf_pool():
+    """The renderer process pool, recreated after a fork."""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ProcessPoolExecutor(max_workers=getattr(settings, 'PRESCRIPTION_PDF_WORKERS', 2))
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def discard_pdf_pool(pool):
+    """Forget a stuck or broken pool and kill its workers, so the next render starts a fresh one."""
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    # shutdown() lets running renders finish and forgets the processes, so
+    # take them first (ProcessPoolExecutor.kill_workers() needs Python 3.14)
+    processes = list((getattr(pool, '_processes', None) or {}).values())
+    pool.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        process.kill()
+
+
+def pdf_cache_path(html, font_path=None):
+    """Content address of the PDF rendered from `html` (and the embedded font)."""
+    digest = hashlib.sha256(f'{html}\0{font_path or ""}'.encode()).hexdigest()
+    cache_dir = Path(getattr(settings, 'PRESCRIPTION_PDF_DIR', settings.BASE_DIR / 'pdf_cache'))
+    return cache_dir / digest[:2] / f'{digest}.pdf'
+
+
+def _write_atomically(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def render_pdf(html):
+    """
+    Path of the PDF rendered from `html`, converting it in the worker pool
+    first if it is not on disk yet. Raises PdfTimeout when the render takes
+    too long and PdfUnavailable when the renderer cannot run or crashed.
+    """
+    font_path = getattr(settings, 'PRESCRIPTION_PDF_URDU_FONT', None)
+    path = pdf_cache_path(html, font_path)
+    if path.exists():
+        return path
+
+    _load_weasyprint()  # fail fast instead of inside the pool
+    pool = get_pdf_pool()
+    timeout = getattr(settings, 'PRESCRIPTION_PDF_TIMEOUT', 30)
+    try:
+        future = pool.submit(html_to_pdf, html, settings.STATIC_URL, str(settings.STATIC_ROOT), font_path)
+        data = future.result(timeout=timeout)
+    except FutureTimeoutError:
+        # cancel() cannot stop a render that has started; kill the workers
+        discard_pdf_pool(pool)
+        raise PdfTimeout(f'Rendering the PDF took longer than {timeout}s')
+    except BrokenProcessPool as e:
+        # A renderer process died (e.g. out of memory); replace the pool
+        discard_pdf_pool(pool)
+        raise PdfUnavailable(f'The PDF renderer stopped unexpectedly, please try again ({e})')
+    _write_atomically(path, data)
+    return path
+
+
+def render_prescription_pdf(prescription_pk):
+    """Path of the PDF for a prescription's current version."""
+    return render_pdf(render_prescription_print(prescription_pk))
@@ -0,0 +1,121 @@
+"""
+Cache of rendered prescription print slips.
+
+Reception reprints the same slips many times, and each render walks a
+large template plus the patient, medicine and lab test rows. The rendered
+HTML is stored under the prescription's pk together with the version it
+was rendered from: (pk, updated_at, template version). A cached slip is
+only served while that version still matches, and clinic/signals.py
+deletes the entry whenever the prescription, one of its medicine rows,
+its lab tests or its patient is written.
+
+Settings:
+    PRINT_CACHE_ALIAS    which entry of CACHES to use, default 'default'
+                         (point it at Redis/Memcached to share the cache
+                         between workers)
+    PRINT_CACHE_TIMEOUT  seconds a slip is kept, default one day; this
+                         also bounds how long a renamed catalog medicine
+                         or lab test can show its old name on a reprint
+"""
+import hashlib
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.template.loader import get_template, render_to_string
+
+
+PRINT_TEMPLATE = 'clinic/prescription_print.html'
+PRINT_SLIP_TEMPLATE = 'clinic/prescription_print_slip.html'
+PRINT_STYLES_TEMPLATE = 'clinic/prescription_print_styles.html'
+PRINT_TEMPLATES = (PRINT_TEMPLATE, PRINT_SLIP_TEMPLATE, PRINT_STYLES_TEMPLATE)
+
+
+def template_version(*template_names):
+    """Short hash of the templates' source, so editing any of them busts the cache."""
+    digest = hashlib.sha1()
+    for name in template_names:
+        digest.update(getattr(get_template(name).template, 'source', '').encode())
+    return digest.hexdigest()[:12]
+
+
+class RenderCache:
+    """Stores rendered HTML per object, tagged with the version it was rendered from."""
+
+    def __init__(self, alias, timeout, prefix):
+        self.alias = alias
+        self.timeout = timeout
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def backend(self):
+        return caches[self.alias]
+
+    def make_key(self, pk):
+        return f'{self.prefix}:{pk}'
+
+    def get_or_render(self, pk, version, render):
+        """Return the cached HTML for `pk` if it was rendered at `version`, else call render()."""
+        key = self.make_key(pk)
+        entry = self.backend.get(key)
+        if entry is not None and entry[0] == version:
+            with self._lock:
+                self.hits += 1
+            return entry[1]
+
+        with self._lock:
+            self.misses += 1
+        html = render()
+        self.backend.set(key, (version, html), self.timeout)
+        return html
+
+    def invalidate(self, *pks):
+        if pks:
+            self.backend.delete_many([self.make_key(pk) for pk in pks])
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+_print_cache = None
+_print_cache_lock = threading.Lock()
+
+
+def get_print_cache():
+    global _print_cache
+    with _print_cache_lock:
+        if _print_cache is None:
+            _print_cache = RenderCache(
+                alias=getattr(settings, 'PRINT_CACHE_ALIAS', 'default'),
+                timeout=getattr(settings, 'PRINT_CACHE_TIMEOUT', 60 * 60 * 24),
+                prefix='prescription-print',
+            )
+        return _print_cache
+
+
+def render_prescription_print(prescription_pk):
+    """
+    Rendered print slip for a prescription. Costs one small query on a cache
+    hit; a miss loads everything the template needs in four queries.
+    """
+    from .models import Prescription
+
+    updated_at = Prescription.objects.filter(pk=prescription_pk).values_list(
+        'updated_at', flat=True
+    ).get()
+    version = (updated_at.isoformat(), template_version(*PRINT_TEMPLATES))
+
+    def render():
+        prescription = (
+            Prescription.objects
+            .select_related('patient')
+            .prefetch_related('medicines__medicine', 'tests_ordered')
+            .get(pk=prescription_pk)
+        )
+        # No request: the slip must not depend on who is printing it
+        return render_to_string(PRINT_TEMPLATE, {'prescription': prescription})
+
+    return get_print_cache().get_or_render(prescription_pk, version, render)
@@ -0,0 +1,78 @@
+"""
+Per-process cache of reference data: medicines, lab tests and templates,
+plus the fuzzy medicine name index built from them.
+
+These catalogs change a few times a week but are read on every prescription
+form. Each worker process keeps one ReferenceData snapshot and reuses it
+for as long as the catalog version (the 'catalog_version' Counter row, see
+clinic/catalog.py) is unchanged. Checking costs one indexed read, so an edit
+made through any worker is picked up by every worker on its next request.
+
+The version includes the Counter's updated_at as well as its value, so a
+snapshot loaded inside a transaction that is later rolled back can never
+be mistaken for the one that ends up committed under the same number.
+
+Snapshot contents are shared between requests and threads: treat them as
+read-only.
+"""
+import threading
+
+from django.db.models import Prefetch
+from django.utils.functional import cached_property
+
+from .catalog import get_catalog_version
+from .fuzzy import MedicineMatcher
+from .models import LabTest, Medicine, PrescriptionTemplate, TemplateMedicine
+
+
+def template_medicines():
+    """Prefetch of PrescriptionTemplate.medicines that also loads each row's Medicine."""
+    return Prefetch('medicines', queryset=TemplateMedicine.objects.select_related('medicine'))
+
+
+class ReferenceData:
+    """One version of the reference catalogs, each loaded on first use."""
+
+    def __init__(self, version):
+        self.version = version
+
+    @cached_property
+    def medicines(self):
+        return list(Medicine.objects.filter(is_active=True))
+
+    @cached_property
+    def lab_tests(self):
+        """Every lab test, including inactive ones still on old prescriptions."""
+        return list(LabTest.objects.all())
+
+    @cached_property
+    def active_lab_tests(self):
+        return [test for test in self.lab_tests if test.is_active]
+
+    @cached_property
+    def lab_test_choices(self):
+        return [(test.pk, str(test)) for test in self.lab_tests]
+
+    @cached_property
+    def templates(self):
+        """Active templates with their medicine rows (and medicines) prefetched."""
+        return list(PrescriptionTemplate.objects.filter(is_active=True).prefetch_related(template_medicines()))
+
+    @cached_property
+    def medicine_matcher(self):
+        """Fuzzy name index over the active medicines, see clinic/fuzzy.py."""
+        return MedicineMatcher(self.medicines)
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def get_reference_data():
+    """The current snapshot, replaced when the catalog version has moved."""
+    global _snapshot
+    version = get_catalog_version()
+    with _snapshot_lock:
+        if _snapshot is None or _snapshot.version != version:
+            _snapshot = ReferenceData(version)
+        return _snapshot
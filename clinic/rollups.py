@@ -0,0 +1,115 @@
+"""
+Per-doctor daily rollups for reporting.
+
+Reports over months or years of visits used to scan Prescription,
+PrescriptionMedicine and the lab test join table directly. They can read
+the rollups instead, a few thousand rows after years of use:
+
+- DoctorDailyRollup: one row per (doctor, day) with the prescriptions,
+  distinct patients, first visits and follow-ups. Recounted for a
+  doctor-day whenever one of its prescriptions is written, from that
+  doctor's prescriptions of the day (a handful of rows).
+- MedicineUsage / LabTestUsage (clinic/usage.py): how often each medicine
+  and lab test was prescribed per doctor and day.
+
+The signal handlers in clinic/signals.py keep all three current, and
+migrations 0023 and 0025 fill them from existing data. Run
+`python manage.py rebuild_rollups` after bulk writes that bypass signals.
+
+Rebuilds count in SQL, one row per doctor-day or lab test bucket, so their
+memory grows with the number of rollup rows, not of visits. The counting
+functions take the querysets and model to build, so migration 0025 can
+run them on its historical models.
+"""
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count, Q
+
+from .models import DoctorDailyRollup, LabTestUsage, Prescription
+from .usage import reconcile_medicine_usage
+
+
+def refresh_doctor_day(doctor_id, day):
+    """Recount the rollup of `doctor_id` on `day` (prescriptions without a doctor have none)."""
+    if doctor_id is None:
+        return
+    rollups = list(count_doctor_days(Prescription.objects.filter(doctor_id=doctor_id, date=day)))
+    if not rollups:
+        DoctorDailyRollup.objects.filter(doctor_id=doctor_id, day=day).delete()
+        return
+    DoctorDailyRollup.objects.bulk_create(
+        rollups,
+        update_conflicts=True,
+        unique_fields=['doctor', 'day'],
+        update_fields=['prescriptions', 'patients', 'first_visits', 'follow_ups'],
+    )
+
+
+def count_doctor_days(prescriptions, model=DoctorDailyRollup, chunk_size=2000):
+    """Unsaved `model` rollups for `prescriptions` with a doctor, one per doctor-day, counted in SQL."""
+    rows = (
+        prescriptions.filter(doctor__isnull=False).values('doctor_id', 'date')
+        .annotate(
+            count=Count('id'),
+            patients=Count('patient', distinct=True),
+            first_visits=Count('id', filter=Q(is_first_visit=True)),
+        )
+        .values_list('doctor_id', 'date', 'count', 'patients', 'first_visits').order_by()
+    )
+    for doctor_id, day, count, patients, first_visits in rows.iterator(chunk_size=chunk_size):
+        yield model(
+            doctor_id=doctor_id, day=day, prescriptions=count, patients=patients,
+            first_visits=first_visits, follow_ups=count - first_visits,
+        )
+
+
+def count_lab_test_usage(lab_tests, model=LabTestUsage, chunk_size=2000):
+    """
+    Unsaved `model` buckets for `lab_tests` (rows of the Prescription to
+    LabTest through table), per doctor and clinic-wide, counted in SQL.
+    """
+    buckets = Counter()
+    rows = (
+        lab_tests.values('labtest_id', 'prescription__doctor_id', 'prescription__date')
+        .annotate(uses=Count('id'))
+        .values_list('labtest_id', 'prescription__doctor_id', 'prescription__date', 'uses').order_by()
+    )
+    for lab_test_id, doctor_id, day, uses in rows.iterator(chunk_size=chunk_size):
+        buckets[(lab_test_id, None, day)] += uses
+        if doctor_id is not None:
+            buckets[(lab_test_id, doctor_id, day)] += uses
+    return [
+        model(lab_test_id=lab_test_id, doctor_id=doctor_id, day=day, count=count)
+        for (lab_test_id, doctor_id, day), count in buckets.items()
+    ]
+
+
+def rebuild_rollups(since=None, chunk_size=2000):
+    """
+    Recompute the doctor rollups and the medicine and lab test usage buckets
+    (from day `since` on, or all of them), reading the counts in chunks of
+    `chunk_size` rows. Returns (doctor-days, lab test buckets, medicine
+    buckets corrected).
+    """
+    prescriptions = Prescription.objects.all()
+    lab_tests = Prescription.tests_ordered.through.objects.all()
+    stale_rollups = DoctorDailyRollup.objects.all()
+    stale_lab_usage = LabTestUsage.objects.all()
+    if since:
+        prescriptions = prescriptions.filter(date__gte=since)
+        lab_tests = lab_tests.filter(prescription__date__gte=since)
+        stale_rollups = stale_rollups.filter(day__gte=since)
+        stale_lab_usage = stale_lab_usage.filter(day__gte=since)
+
+    with transaction.atomic():
+        stale_rollups.delete()
+        rollups = DoctorDailyRollup.objects.bulk_create(
+            count_doctor_days(prescriptions, chunk_size=chunk_size), batch_size=1000,
+        )
+        stale_lab_usage.delete()
+        lab_usage = LabTestUsage.objects.bulk_create(
+            count_lab_test_usage(lab_tests, chunk_size=chunk_size), batch_size=1000,
+        )
+        medicines_fixed = reconcile_medicine_usage(since)
+    return len(rollups), len(lab_usage), medicines_fixed
@@ -0,0 +1,228 @@
+"""
+Indexed patient search used by the search page and the AJAX search box.
+
+On SQLite the patient_id, name and phone columns are mirrored into an FTS5
+table (clinic_patient_fts) that triggers on clinic_patient keep in sync, so
+every Patient save/delete - including bulk inserts and queryset updates - is
+reflected immediately. Every query term is matched as a token prefix and
+the matches are ranked with bm25, weighting patient_id and phone above name.
+
+Only the newest RANK_WINDOW (500) matches are ranked, so a one-letter query
+that matches half the registry costs the same as a precise one. The price
+is that a broad query ("a", "khan") never returns a patient registered
+before its newest 500 matches, however good the match; typing more of the
+name narrows the match set until they fit in the window.
+
+Patient ID queries ("PT-00123", "pt123", or just "123") are answered from
+the unique patient_id index instead: the FTS tokenizer splits "PT-00123"
+into "pt" and "00123", so the digits a receptionist types would not match.
+The number is compared at every zero-padding, so "12" finds PT-00012,
+then PT-00120..PT-00129 and so on. A digits-only query may also be a phone
+prefix, so the ID matches are followed by the full-text ones.
+
+SQLite rebuilds clinic_patient (dropping its triggers) whenever a migration
+alters the Patient table, so ensure_sqlite_search_index() runs after every
+migrate to put the triggers back and resync the index if they were missing.
+
+On PostgreSQL the same lookups are served by pg_trgm / pattern-ops indexes
+created in migration 0015, so the plain ORM filters below are index-backed.
+"""
+import re
+
+from django.conf import settings
+from django.db import connection, connections
+from django.db.models import Case, IntegerField, Q, Value, When
+
+from .models import Patient
+
+
+FTS_TABLE = 'clinic_patient_fts'
+
+DEFAULT_LIMIT = 10
+
+# Upper bound on how many matching rows are scored per query
+RANK_WINDOW = 500
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+_DIGITS_RE = re.compile(r'\d+')
+
+
+SYNC_TRIGGERS = {
+    'clinic_patient_fts_ai': """
+        CREATE TRIGGER clinic_patient_fts_ai AFTER INSERT ON clinic_patient BEGIN
+            INSERT INTO {fts} (rowid, patient_id, name, phone, phone_digits)
+            VALUES (new.id, new.patient_id, new.name, new.phone, {new_digits});
+        END
+    """,
+    'clinic_patient_fts_au': """
+        CREATE TRIGGER clinic_patient_fts_au
+        AFTER UPDATE OF patient_id, name, phone ON clinic_patient BEGIN
+            UPDATE {fts}
+            SET patient_id = new.patient_id, name = new.name,
+                phone = new.phone, phone_digits = {new_digits}
+            WHERE rowid = old.id;
+        END
+    """,
+    'clinic_patient_fts_ad': """
+        CREATE TRIGGER clinic_patient_fts_ad AFTER DELETE ON clinic_patient BEGIN
+            DELETE FROM {fts} WHERE rowid = old.id;
+        END
+    """,
+}
+
+
+def _phone_digits_sql(column):
+    """SQL expression that strips common separators from a phone column."""
+    expression = column
+    for char in ('-', ' ', '+', '(', ')', '.'):
+        expression = f"replace({expression}, '{char}', '')"
+    return expression
+
+
+def ensure_sqlite_search_index(using='default'):
+    """Recreate any missing sync triggers and, if some were missing, resync."""
+    conn = connections[using]
+    if conn.vendor != 'sqlite':
+        return
+
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger') AND name LIKE %s",
+            ['clinic_patient_fts%'],
+        )
+        existing = {row[0] for row in cursor.fetchall()}
+        if FTS_TABLE not in existing:
+            # Migration 0015 has not been applied to this database yet
+            return
+
+        missing = [name for name in SYNC_TRIGGERS if name not in existing]
+        if not missing:
+            return
+
+        for name in missing:
+            cursor.execute(SYNC_TRIGGERS[name].format(
+                fts=FTS_TABLE, new_digits=_phone_digits_sql('new.phone'),
+            ))
+        cursor.execute(f"DELETE FROM {FTS_TABLE}")
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE} (rowid, patient_id, name, phone, phone_digits) "
+            f"SELECT id, patient_id, name, phone, {_phone_digits_sql('phone')} FROM clinic_patient"
+        )
+
+
+def ensure_search_index_after_migrate(sender, using='default', **kwargs):
+    """post_migrate receiver, connected in ClinicConfig.ready()."""
+    ensure_sqlite_search_index(using)
+
+
+def tokenize(query):
+    """Split a search string into lowercase word tokens."""
+    return _TOKEN_RE.findall((query or '').lower())
+
+
+def _patient_id_prefixes(query):
+    """
+    patient_id prefixes to look up for an ID-like `query`, closest numbers
+    first, and whether the query was digits only. (None, False) otherwise.
+    """
+    prefix = getattr(settings, 'PATIENT_ID_PREFIX', 'PT-')
+    width = getattr(settings, 'PATIENT_ID_WIDTH', 5)
+    query = query.strip().upper()
+    letters = prefix.rstrip('-').upper()
+    digits_only = _DIGITS_RE.fullmatch(query) is not None
+    if digits_only:
+        digits = query
+    else:
+        match = re.fullmatch(rf'{re.escape(letters)}-?(\d+)', query) if letters else None
+        if not match:
+            return None, False
+        digits = match.group(1)
+    pads = range(max(width - len(digits), 0), -1, -1)
+    return [f'{prefix}{"0" * pad}{digits}' for pad in pads], digits_only
+
+
+def _search_patient_id_prefix(query, limit):
+    """
+    Answer "PT-123", "pt123" and "123" style queries from the unique
+    patient_id index, or None if `query` does not look like an ID.
+
+    The range form (>= prefix, < prefix + max char) lets SQLite use the
+    B-tree directly, which LIKE/istartswith cannot do.
+    """
+    prefixes, digits_only = _patient_id_prefixes(query)
+    if prefixes is None:
+        return None, False
+    patients = []
+    for prefix in prefixes:
+        if len(patients) >= limit:
+            break
+        patients += Patient.objects.filter(
+            patient_id__gte=prefix, patient_id__lt=prefix + '\uffff',
+        ).order_by('patient_id')[:limit - len(patients)]
+    return patients, digits_only
+
+
+def _search_sqlite(query, limit):
+    tokens = tokenize(query)
+    if not tokens:
+        return []
+
+    # Each token is a quoted prefix term; FTS5 ANDs adjacent terms
+    match = ' '.join(f'"{token}"*' for token in tokens)
+
+    # Only the newest RANK_WINDOW matches are scored (see the module docstring)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT rowid FROM (
+                SELECT rowid, bm25({FTS_TABLE}, 10.0, 1.0, 5.0, 5.0) AS score
+                FROM {FTS_TABLE}
+                WHERE {FTS_TABLE} MATCH %s
+                ORDER BY rowid DESC
+                LIMIT %s
+            )
+            ORDER BY score, rowid DESC
+            LIMIT %s
+            """,
+            [match, RANK_WINDOW, limit],
+        )
+        ids = [row[0] for row in cursor.fetchall()]
+
+    patients = Patient.objects.in_bulk(ids)
+    return [patients[pk] for pk in ids if pk in patients]
+
+
+def _search_orm(query, limit):
+    query = query.strip()
+    if not query:
+        return []
+
+    patients = Patient.objects.filter(
+        Q(patient_id__istartswith=query) |
+        Q(phone__startswith=query) |
+        Q(name__icontains=query)
+    ).annotate(
+        search_rank=Case(
+            When(patient_id__iexact=query, then=Value(0)),
+            When(patient_id__istartswith=query, then=Value(1)),
+            When(phone__startswith=query, then=Value(2)),
+            When(name__istartswith=query, then=Value(3)),
+            default=Value(4),
+            output_field=IntegerField(),
+        )
+    ).order_by('search_rank', 'name')
+    return list(patients[:limit])
+
+
+def search_patients(query, limit=DEFAULT_LIMIT):
+    """Return up to `limit` patients matching `query`, best matches first."""
+    by_id, digits_only = _search_patient_id_prefix(query, limit)
+    if by_id is not None and (not digits_only or len(by_id) >= limit):
+        return by_id
+    by_id = by_id or []
+    search = _search_sqlite if connection.vendor == 'sqlite' else _search_orm
+    # A digits-only query may be a phone prefix too: fill up with text
+    # matches, `limit` of them so any already found by ID can be dropped
+    seen = {patient.pk for patient in by_id}
+    by_text = [patient for patient in search(query, limit) if patient.pk not in seen]
+    return by_id + by_text[:limit - len(by_id)]
@@ -0,0 +1,204 @@
+"""
+Write-side operations on prescriptions that touch several tables at once.
+
+Each function here does its work with a fixed number of set-based queries
+(one lookup, one bulk insert) instead of a query per row. Functions that
+write several tables either open their own transaction.atomic() block or
+expect to run inside the caller's.
+"""
+from django.db import transaction
+from django.db.models.functions import Lower
+
+from .catalog import bump_catalog_version
+from .refdata import get_reference_data
+from .usage import ordered_lab_tests, record_lab_test_usage, record_medicine_usage
+from .models import (
+    Medicine, Prescription, PrescriptionMedicine, TemplateMedicine, get_current_local_date,
+    get_current_local_time,
+)
+
+
+def resolve_medicines_by_name(names):
+    """
+    Map each typed medicine name (case-insensitively) to a Medicine,
+    linking names that only differ from a catalog name in case, accents
+    or punctuation to it (see clinic/fuzzy.py) and creating the rest, as
+    typed, as tablets. Similar but different names are never linked.
+
+    Uses one lookup query, plus one bulk insert and one re-select when
+    some names are new. Returns {lowercased name: Medicine}.
+    """
+    wanted = {}
+    for name in names:
+        name = (name or '').strip()
+        if name:
+            wanted.setdefault(name.lower(), name)
+    if not wanted:
+        return {}
+
+    def by_key(medicines):
+        # Keyed with Python's lower() like `wanted`: SQLite's LOWER() only
+        # folds ASCII, so the SQL lowercase of "Ölmesartan" differs
+        found = {}
+        for medicine in medicines.order_by('pk'):
+            found.setdefault(medicine.name.lower(), medicine)
+        return found
+
+    resolved = by_key(Medicine.objects.annotate(name_lower=Lower('name')).filter(name_lower__in=list(wanted)))
+
+    # Spelling variants of a catalog name ("Co Amoxiclav") link to it
+    unmatched = [key for key in wanted if key not in resolved]
+    if unmatched:
+        matcher = get_reference_data().medicine_matcher
+        for key in unmatched:
+            medicine = matcher.exact_match(wanted[key])
+            if medicine is not None:
+                resolved[key] = medicine
+
+    missing = [key for key in wanted if key not in resolved]
+    if missing:
+        # ignore_conflicts: a concurrent request may have just created one
+        Medicine.objects.bulk_create(
+            [Medicine(name=wanted[key], form='Tab', is_active=True) for key in missing],
+            ignore_conflicts=True,
+        )
+        bump_catalog_version()  # bulk_create sends no signals
+        created = by_key(Medicine.objects.filter(name__in=[wanted[key] for key in missing]))
+        resolved.update((key, created[key]) for key in missing)
+    return resolved
+
+
+def link_custom_medicines(rows):
+    """
+    Point unsaved PrescriptionMedicine rows that only have a typed
+    `custom_medicine` at its catalog Medicine (created if needed), so the
+    name is available in the dropdown next time.
+    """
+    custom_rows = [
+        row for row in rows
+        if row.custom_medicine.strip() and not row.medicine_id
+    ]
+    medicines = resolve_medicines_by_name(row.custom_medicine for row in custom_rows)
+    for row in custom_rows:
+        row.medicine = medicines[row.custom_medicine.strip().lower()]
+        row.custom_medicine = ''  # Linked to the catalog instead
+
+
+def save_medicine_formset(formset, prescription):
+    """
+    Save the medicine rows of a new prescription with one bulk insert,
+    linking typed names to the catalog (link_custom_medicines()).
+    """
+    formset.instance = prescription
+    rows = formset.save(commit=False)
+    link_custom_medicines(rows)
+    for row in rows:
+        row.prescription = prescription
+    rows = PrescriptionMedicine.objects.bulk_create(rows)
+    record_medicine_usage(prescription, rows)  # bulk_create sends no signals
+    return rows
+
+
+def copy_field_values(instance, exclude=()):
+    """
+    Values of every concrete field on `instance`, keyed by attname, ready to
+    pass to the model constructor. The primary key and auto_now /
+    auto_now_add timestamps are left out so the copy gets fresh ones.
+    """
+    values = {}
+    for field in instance._meta.concrete_fields:
+        if field.primary_key or field.name in exclude:
+            continue
+        if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False):
+            continue
+        values[field.attname] = getattr(instance, field.attname)
+    return values
+
+
+def copy_many_to_many(source, target):
+    """
+    Copy every plain (auto-created through table) many-to-many relation of
+    `source` onto `target`: one read and one bulk insert per relation.
+    """
+    for field in source._meta.many_to_many:
+        through = field.remote_field.through
+        if not through._meta.auto_created:
+            continue
+        source_column = field.m2m_field_name() + '_id'
+        target_column = field.m2m_reverse_field_name() + '_id'
+        related_ids = through.objects.filter(**{source_column: source.pk}).values_list(
+            target_column, flat=True
+        )
+        through.objects.bulk_create([
+            through(**{source_column: target.pk, target_column: related_id})
+            for related_id in related_ids
+        ])
+
+
+def clone_prescription(original, **overrides):
+    """
+    Copy a prescription with all of its fields, lab tests and medicine rows
+    as a new follow-up visit dated now, in one transaction and a bounded
+    number of queries regardless of how many medicines it has.
+    """
+    values = copy_field_values(original)
+    values.update(
+        date=get_current_local_date(),
+        time=get_current_local_time(),
+        is_first_visit=False,
+    )
+    values.update(overrides)
+
+    with transaction.atomic():
+        clone = Prescription.objects.create(**values)
+        copy_many_to_many(original, clone)
+        record_lab_test_usage(ordered_lab_tests([clone.pk]))
+        rows = PrescriptionMedicine.objects.bulk_create([
+            PrescriptionMedicine(**copy_field_values(row, exclude=('prescription',)), prescription=clone)
+            for row in PrescriptionMedicine.objects.filter(prescription=original)
+        ])
+        record_medicine_usage(clone, rows)
+    return clone
+
+
+def prescription_medicine_from_template(row, prescription):
+    """Unsaved PrescriptionMedicine for one TemplateMedicine row (ticked times become one dose)."""
+    return PrescriptionMedicine(
+        prescription=prescription,
+        medicine_id=row.medicine_id,
+        custom_medicine=row.custom_medicine,
+        dosage=row.dosage,
+        morning=int(row.morning),
+        afternoon=int(row.afternoon),
+        evening=int(row.evening),
+        night=int(row.night),
+        days=row.days,
+        duration_choice='custom' if row.custom_duration else '',
+        custom_duration=row.custom_duration,
+        instructions=row.instructions,
+    )
+
+
+def create_prescription_from_template(template, patient, doctor=None):
+    """
+    Start a visit for `patient` from a prescription template: its notes and
+    instructions plus a copy of every medicine row, in one transaction with
+    one bulk insert for the rows. Typed medicine names are linked to the
+    catalog as on the prescription form.
+    """
+    with transaction.atomic():
+        prescription = Prescription.objects.create(
+            patient=patient,
+            doctor=doctor,
+            clinical_record=template.clinical_record,
+            other_instructions=template.special_instructions,
+            is_first_visit=not patient.prescriptions.exists(),
+        )
+        rows = [
+            prescription_medicine_from_template(row, prescription)
+            for row in TemplateMedicine.objects.filter(template=template)
+        ]
+        link_custom_medicines(rows)
+        rows = PrescriptionMedicine.objects.bulk_create(rows)
+        record_medicine_usage(prescription, rows)
+    return prescription
@@ -0,0 +1,268 @@
+"""
+Signal handlers that keep derived data in step with prescription writes.
+
+Connected in ClinicConfig.ready().
+"""
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .catalog import bump_catalog_version
+from .diagnoses import index_prescription_diagnoses, update_diagnosis_stats
+from .models import (
+    LabTest, Medicine, Patient, Prescription, PrescriptionMedicine, PrescriptionTemplate, TemplateMedicine,
+)
+from .print_cache import get_print_cache
+from .rollups import refresh_doctor_day
+from .stats import count_new_patient, refresh_prescription_day, touch_days
+from .usage import (
+    apply_usage_delta, move_prescription_usage, ordered_lab_tests, record_lab_test_usage, usage_delta,
+)
+
+
+# ============ Previous Values ============
+
+@receiver(pre_save, sender=Prescription)
+def remember_previous_prescription(sender, instance, raw, update_fields, **kwargs):
+    """Keep the stored diagnosis, date, doctor, patient and visit type on the instance so post_save can diff against them."""
+    instance._previous_diagnosis = ''
+    instance._previous_date = None
+    instance._previous_usage_key = None
+    instance._previous_patient_id = None
+    instance._previous_visit = None
+    tracked = {'diagnosis', 'date', 'doctor', 'patient', 'is_first_visit'}
+    if instance.pk and not raw and (update_fields is None or tracked & set(update_fields)):
+        previous = Prescription.objects.filter(pk=instance.pk).values_list(
+            'diagnosis', 'date', 'doctor_id', 'patient_id', 'is_first_visit'
+        ).first()
+        if previous:
+            instance._previous_diagnosis, instance._previous_date, doctor_id, instance._previous_patient_id, _ = previous
+            instance._previous_usage_key = (doctor_id, instance._previous_date)
+            instance._previous_visit = previous[1:]
+
+
+@receiver(pre_save, sender=PrescriptionMedicine)
+def remember_previous_medicine_row(sender, instance, raw, **kwargs):
+    """Keep the usage bucket the stored row counts in, as (medicine_id, doctor_id, day)."""
+    instance._previous_usage = None
+    if instance.pk and not raw:
+        instance._previous_usage = PrescriptionMedicine.objects.filter(pk=instance.pk).values_list(
+            'medicine_id', 'prescription__doctor_id', 'prescription__date'
+        ).first()
+
+
+# ============ Print Cache Invalidation ============
+
+@receiver(post_save, sender=Prescription)
+@receiver(post_delete, sender=Prescription)
+def invalidate_prescription_print(sender, instance, **kwargs):
+    get_print_cache().invalidate(instance.pk)
+
+
+@receiver(post_save, sender=PrescriptionMedicine)
+@receiver(post_delete, sender=PrescriptionMedicine)
+def invalidate_print_for_medicine_row(sender, instance, **kwargs):
+    get_print_cache().invalidate(instance.prescription_id)
+
+
+@receiver(m2m_changed, sender=Prescription.tests_ordered.through)
+def invalidate_print_for_tests(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if reverse:
+        # instance is a LabTest; pk_set holds prescription pks (None on clear)
+        get_print_cache().invalidate(*(pk_set or ()))
+    else:
+        get_print_cache().invalidate(instance.pk)
+
+
+@receiver(post_save, sender=Patient)
+def invalidate_print_for_patient(sender, instance, created, **kwargs):
+    if created:
+        return
+    get_print_cache().invalidate(
+        *Prescription.objects.filter(patient=instance).values_list('pk', flat=True)
+    )
+
+
+# ============ Diagnosis Index and Statistics ============
+
+@receiver(post_save, sender=Prescription)
+def update_diagnoses_on_save(sender, instance, created, raw, update_fields, **kwargs):
+    if raw or (update_fields is not None and not {'diagnosis', 'date'} & set(update_fields)):
+        return
+    previous_diagnosis = getattr(instance, '_previous_diagnosis', '')
+    if created:
+        changed = bool(instance.diagnosis)
+    else:
+        changed = (previous_diagnosis, getattr(instance, '_previous_date', None)) != (instance.diagnosis, instance.date)
+    if changed:
+        index_prescription_diagnoses(instance)
+    update_diagnosis_stats(previous_diagnosis, instance.diagnosis)
+
+
+@receiver(post_delete, sender=Prescription)
+def update_diagnoses_on_delete(sender, instance, **kwargs):
+    update_diagnosis_stats(instance.diagnosis, '')
+
+
+# ============ Catalog Version ============
+
+@receiver(post_save, sender=Medicine)
+@receiver(post_delete, sender=Medicine)
+@receiver(post_save, sender=LabTest)
+@receiver(post_delete, sender=LabTest)
+@receiver(post_save, sender=PrescriptionTemplate)
+@receiver(post_delete, sender=PrescriptionTemplate)
+@receiver(post_save, sender=TemplateMedicine)
+@receiver(post_delete, sender=TemplateMedicine)
+def catalog_changed(sender, raw=False, **kwargs):
+    if not raw:
+        bump_catalog_version()
+
+
+# ============ Medicine Usage ============
+
+@receiver(post_save, sender=PrescriptionMedicine)
+def update_usage_on_row_save(sender, instance, raw, **kwargs):
+    if raw:
+        return
+    prescription = instance.prescription
+    current = (instance.medicine_id, prescription.doctor_id, prescription.date)
+    previous = getattr(instance, '_previous_usage', None)
+    if previous == current:
+        return
+    delta = usage_delta([current])
+    if previous:
+        delta.update(usage_delta([previous], -1))
+    apply_usage_delta(delta)
+
+
+@receiver(post_delete, sender=PrescriptionMedicine)
+def update_usage_on_row_delete(sender, instance, origin=None, **kwargs):
+    # Rows deleted along with their prescription are handled by update_usage_on_prescription_delete
+    if origin is not instance and getattr(origin, 'model', None) is not PrescriptionMedicine:
+        return
+    prescription = Prescription.objects.filter(pk=instance.prescription_id).values_list('doctor_id', 'date').first()
+    if prescription:
+        apply_usage_delta(usage_delta([(instance.medicine_id, *prescription)], -1))
+
+
+@receiver(post_save, sender=Prescription)
+def update_usage_on_prescription_save(sender, instance, created, raw, **kwargs):
+    previous = getattr(instance, '_previous_usage_key', None)
+    if created or raw or previous is None:
+        return
+    move_prescription_usage(instance.pk, previous, (instance.doctor_id, instance.date))
+
+
+@receiver(pre_delete, sender=Prescription)
+def update_usage_on_prescription_delete(sender, instance, **kwargs):
+    # Before the delete, so the medicine rows and lab tests can still be read back
+    rows = PrescriptionMedicine.objects.filter(prescription_id=instance.pk).values_list(
+        'medicine_id', 'prescription__doctor_id', 'prescription__date'
+    )
+    apply_usage_delta(usage_delta(rows, -1))
+    record_lab_test_usage(ordered_lab_tests([instance.pk]), -1)
+
+
+@receiver(m2m_changed, sender=Prescription.tests_ordered.through)
+def update_lab_test_usage(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'pre_clear':
+        # Remember what is about to be cleared; post_clear gets no pk_set
+        if reverse:
+            instance._cleared_lab_tests = list(
+                sender.objects.filter(labtest_id=instance.pk).values_list(
+                    'labtest_id', 'prescription__doctor_id', 'prescription__date'
+                )
+            )
+        else:
+            instance._cleared_lab_tests = list(ordered_lab_tests([instance.pk]))
+        return
+    if action == 'post_clear':
+        record_lab_test_usage(getattr(instance, '_cleared_lab_tests', ()), -1)
+        return
+    if action not in ('post_add', 'post_remove') or not pk_set:
+        return
+    sign = 1 if action == 'post_add' else -1
+    if reverse:
+        # instance is a LabTest; pk_set holds prescription pks
+        visits = Prescription.objects.filter(pk__in=pk_set).values_list('doctor_id', 'date')
+        record_lab_test_usage(((instance.pk, doctor_id, day) for doctor_id, day in visits), sign)
+    else:
+        record_lab_test_usage(((lab_test_id, instance.doctor_id, instance.date) for lab_test_id in pk_set), sign)
+
+
+# ============ Daily Stats ============
+
+@receiver(post_save, sender=Prescription)
+def update_daily_stats_on_save(sender, instance, created, raw, **kwargs):
+    if raw:
+        return
+    previous_date = getattr(instance, '_previous_date', None)
+    previous_patient_id = getattr(instance, '_previous_patient_id', None)
+    if created or (previous_date, previous_patient_id) not in ((None, None), (instance.date, instance.patient_id)):
+        refresh_prescription_day(instance.date)
+        if previous_date and previous_date != instance.date:
+            refresh_prescription_day(previous_date)
+
+
+@receiver(post_delete, sender=Prescription)
+def update_daily_stats_on_delete(sender, instance, **kwargs):
+    refresh_prescription_day(instance.date)
+
+
+@receiver(post_save, sender=Prescription)
+def touch_prescription_days(sender, instance, raw, **kwargs):
+    if not raw:
+        touch_days(instance.date, getattr(instance, '_previous_date', None))
+
+
+@receiver(post_delete, sender=Prescription)
+def touch_deleted_prescription_day(sender, instance, **kwargs):
+    touch_days(instance.date)
+
+
+@receiver(post_save, sender=PrescriptionMedicine)
+def touch_medicine_row_days(sender, instance, raw, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_previous_usage', None)
+    touch_days(instance.prescription.date, previous[2] if previous else None)
+
+
+@receiver(post_delete, sender=PrescriptionMedicine)
+def touch_deleted_medicine_row_day(sender, instance, origin=None, **kwargs):
+    # Rows deleted along with their prescription are covered by touch_deleted_prescription_day
+    if origin is not instance and getattr(origin, 'model', None) is not PrescriptionMedicine:
+        return
+    touch_days(Prescription.objects.filter(pk=instance.prescription_id).values_list('date', flat=True).first())
+
+
+@receiver(post_save, sender=Patient)
+def count_registration(sender, instance, created, raw, **kwargs):
+    if created and not raw:
+        count_new_patient(instance.created_at)
+
+
+@receiver(post_delete, sender=Patient)
+def uncount_registration(sender, instance, **kwargs):
+    count_new_patient(instance.created_at, -1)
+
+
+# ============ Doctor Rollups ============
+
+@receiver(post_save, sender=Prescription)
+def update_doctor_rollup_on_save(sender, instance, created, raw, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_previous_visit', None)
+    current = (instance.date, instance.doctor_id, instance.patient_id, instance.is_first_visit)
+    if created or (previous is not None and previous != current):
+        refresh_doctor_day(instance.doctor_id, instance.date)
+        if previous and previous[:2] != current[:2]:
+            refresh_doctor_day(previous[1], previous[0])
+
+
+@receiver(post_delete, sender=Prescription)
+def update_doctor_rollup_on_delete(sender, instance, **kwargs):
+    refresh_doctor_day(instance.doctor_id, instance.date)
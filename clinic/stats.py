@@ -0,0 +1,107 @@
+"""
+Daily summary counts behind the dashboard.
+
+The dashboard used to run a separate COUNT for every figure on each load.
+DailyStats keeps one row per day instead, so all of them come from one
+aggregate over the table (a few thousand rows after years of use):
+
+- prescriptions and patients_seen are recomputed for a day whenever a
+  prescription on that day is written, from one aggregate over that day's
+  rows (rx_date_patient_idx). Recounting keeps the distinct patient count
+  exact, which a +1/-1 could not.
+- new_patients is moved when patients are registered or deleted.
+- revision is bumped by every write to the day's prescriptions or their
+  medicines, so caches over a date range (clinic/analytics.py) can tell
+  whether any day in it changed.
+
+The signal handlers in clinic/signals.py drive both. Migration 0024 fills
+the table from existing data; run `python manage.py rebuild_daily_stats`
+after bulk writes that bypass signals.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import DailyStats, Patient, Prescription
+
+
+def refresh_prescription_day(day):
+    """Recount the prescriptions and distinct patients of `day`."""
+    counts = Prescription.objects.filter(date=day).aggregate(
+        prescriptions=Count('id'), patients_seen=Count('patient', distinct=True),
+    )
+    DailyStats.objects.bulk_create(
+        [DailyStats(day=day, **counts)],
+        update_conflicts=True,
+        unique_fields=['day'],
+        update_fields=['prescriptions', 'patients_seen'],
+    )
+
+
+def touch_days(*days):
+    """Bump the revision of each of `days` (None is skipped) after a write to its prescriptions."""
+    days = {day for day in days if day is not None}
+    if not days:
+        return
+    DailyStats.objects.bulk_create([DailyStats(day=day) for day in days], ignore_conflicts=True)
+    DailyStats.objects.filter(day__in=days).update(revision=F('revision') + 1)
+
+
+def count_new_patient(created_at, by=1):
+    """Add `by` registrations (negative to remove) on the local day of `created_at`."""
+    day = timezone.localdate(created_at)
+    if by > 0:
+        DailyStats.objects.bulk_create([DailyStats(day=day)], ignore_conflicts=True)
+        DailyStats.objects.filter(day=day).update(new_patients=F('new_patients') + by)
+    elif by < 0:
+        DailyStats.objects.filter(day=day, new_patients__gte=-by).update(new_patients=F('new_patients') + by)
+
+
+def dashboard_stats(today):
+    """Totals plus today/week/month figures for the dashboard, in one query."""
+    week_ago = today - timedelta(days=7)
+    month_ago = today - timedelta(days=30)
+    totals = DailyStats.objects.aggregate(
+        total_patients=Sum('new_patients'),
+        total_prescriptions=Sum('prescriptions'),
+        today_patients=Sum('patients_seen', filter=Q(day=today)),
+        today_prescriptions=Sum('prescriptions', filter=Q(day=today)),
+        week_prescriptions=Sum('prescriptions', filter=Q(day__gte=week_ago)),
+        month_prescriptions=Sum('prescriptions', filter=Q(day__gte=month_ago)),
+    )
+    return {name: value or 0 for name, value in totals.items()}
+
+
+def rebuild_daily_stats(since=None):
+    """
+    Recompute DailyStats (from day `since` on, or all of it) from the
+    prescriptions and patients. Revisions carry over, bumped, so cached
+    series over rebuilt days expire. Returns the number of days written.
+    """
+    prescriptions = Prescription.objects.all()
+    patients = Patient.objects.annotate(day=TruncDate('created_at', tzinfo=timezone.get_current_timezone()))
+    stale = DailyStats.objects.all()
+    if since:
+        prescriptions = prescriptions.filter(date__gte=since)
+        patients = patients.filter(day__gte=since)
+        stale = stale.filter(day__gte=since)
+
+    days = {}
+    for day, count, seen in (
+        prescriptions.values('date')
+        .annotate(count=Count('id'), seen=Count('patient', distinct=True))
+        .values_list('date', 'count', 'seen').order_by()
+    ):
+        days[day] = DailyStats(day=day, prescriptions=count, patients_seen=seen)
+    for day, count in patients.values('day').annotate(count=Count('id')).values_list('day', 'count').order_by():
+        days.setdefault(day, DailyStats(day=day)).new_patients = count
+
+    with transaction.atomic():
+        for day, revision in stale.values_list('day', 'revision'):
+            days.setdefault(day, DailyStats(day=day)).revision = revision + 1
+        stale.delete()
+        DailyStats.objects.bulk_create(days.values(), batch_size=1000)
+    return len(days)
@@ -1,9 +1,43 @@
+import json
+import os
+import tempfile
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, timedelta
+from importlib import import_module
+from io import StringIO
+from unittest import mock
+
+from django.apps import apps as django_apps
 from django.contrib.auth.models import User
-from django.test import TestCase
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
-from .forms import MedicineForm, PrescriptionMedicineForm
-from .models import Patient, Prescription, PrescriptionMedicine
+from . import pdf, views
+from .diagnoses import prescriptions_with_diagnosis, recent_diagnoses
+from .duplicates import find_duplicate_candidates
+from .forms import (
+    MedicineForm, PrescriptionForm, PrescriptionMedicineEditFormSet, PrescriptionMedicineForm, PrescriptionMedicineFormSet,
+)
+from .ids import BlockAllocator
+from .models import (
+    Counter, DailyStats, DiagnosisStat, Doctor, DoctorDailyRollup, LabTest, LabTestUsage, Medicine, MedicineUsage, Patient,
+    Prescription, PrescriptionDiagnosis, PrescriptionMedicine, PrescriptionTemplate, TemplateMedicine,
+)
+from .normalization import phonetic_name_key
+from .pagination import encode_cursor
+from .pdf import pdf_cache_path
+from .print_cache import get_print_cache
+from .refdata import get_reference_data
+from .search import ensure_sqlite_search_index, search_patients
+from .services import clone_prescription, resolve_medicines_by_name
+from .stats import dashboard_stats
+from .usage import reconcile_medicine_usage, top_medicines
 
 
 class PrescriptionPrintViewTests(TestCase):
@@ -64,6 +98,1352 @@ class PrescriptionPrintViewTests(TestCase):
         self.assertNotContains(response, "Other:")
 
 
+class PatientListPaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testdoctor", password="testpass123")
+        self.client.force_login(self.user)
+        for i in range(5):
+            Patient.objects.create(name=f"Patient {i}", gender="M", age=30 + i)
+
+    def test_patient_list_renders_first_page_with_cursor(self):
+        response = self.client.get(reverse("patient_list"), {"page_size": 2})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [p.name for p in response.context["patients"]], ["Patient 4", "Patient 3"]
+        )
+        self.assertIsNotNone(response.context["next_cursor"])
+
+    def test_api_patient_list_walks_all_pages_without_gaps(self):
+        names = []
+        cursor = ""
+        while True:
+            response = self.client.get(
+                reverse("api_patient_list"), {"page_size": 2, "cursor": cursor}
+            )
+            data = response.json()
+            names.extend(item["name"] for item in data["results"])
+            cursor = data["next_cursor"]
+            if not cursor:
+                break
+
+        self.assertEqual(names, [f"Patient {i}" for i in range(4, -1, -1)])
+
+    def test_edited_cursor_falls_back_to_the_first_page(self):
+        for values in (["x", 1], ["2024-01-01T00:00:00", "x"], [None, 1], [[], {}]):
+            cursor = encode_cursor(values)
+            response = self.client.get(reverse("api_patient_list"), {"page_size": 2, "cursor": cursor})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([item["name"] for item in response.json()["results"]], ["Patient 4", "Patient 3"])
+
+        response = self.client.get(reverse("patient_list"), {"cursor": encode_cursor(["x", 1])})
+        self.assertEqual(response.status_code, 200)
+
+        search = self.client.get(reverse("api_medicine_search"), {"q": "a", "cursor": encode_cursor([1, 2, 3, "x"])})
+        self.assertEqual(search.status_code, 200)
+
+    def test_patient_list_query_count_is_independent_of_table_size(self):
+        for i in range(20):
+            Patient.objects.create(name=f"Extra {i}", gender="F")
+
+        # session + user + one page query
+        with self.assertNumQueries(3):
+            self.client.get(reverse("patient_list"), {"page_size": 10})
+
+
+class PatientSearchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testdoctor", password="testpass123")
+        self.client.force_login(self.user)
+        self.ali = Patient.objects.create(name="Ali Raza", gender="M", phone="0300-1234567")
+        self.alia = Patient.objects.create(name="Alia Khan", gender="F", phone="0321-7654321")
+
+    def test_search_matches_name_prefix(self):
+        results = search_patients("ali")
+        self.assertCountEqual(results, [self.ali, self.alia])
+
+        results = search_patients("ali raz")
+        self.assertEqual(results, [self.ali])
+
+    def test_search_matches_patient_id_and_phone_prefixes(self):
+        self.assertEqual(search_patients(self.alia.patient_id), [self.alia])
+        self.assertEqual(search_patients("0321"), [self.alia])
+        self.assertEqual(search_patients("030012"), [self.ali])
+
+    def test_digits_find_the_zero_padded_patient_id(self):
+        Patient.objects.filter(pk=self.ali.pk).update(patient_id="PT-00123")
+        Patient.objects.filter(pk=self.alia.pk).update(patient_id="PT-01234", phone="0123-4567890")
+        self.ali.refresh_from_db()
+        self.alia.refresh_from_db()
+
+        self.assertEqual(search_patients("123"), [self.ali, self.alia])
+        self.assertEqual(search_patients("pt123"), [self.ali, self.alia])
+        self.assertEqual(search_patients("pt-01234"), [self.alia])
+        self.assertEqual(search_patients("PT-00123"), [self.ali])
+        # ID matches first, then the phone ones
+        self.assertEqual(search_patients("1234"), [self.alia, self.ali])
+        self.assertEqual(search_patients("0123"), [self.ali, self.alia])
+        self.assertEqual(search_patients("pt-999"), [])
+
+    def test_search_index_follows_updates_and_deletes(self):
+        self.ali.name = "Bilal Ahmed"
+        self.ali.save()
+        self.assertEqual(search_patients("bilal"), [self.ali])
+        self.assertEqual(search_patients("raza"), [])
+
+        self.ali.delete()
+        self.assertEqual(search_patients("bilal"), [])
+
+    def test_missing_sync_triggers_are_restored_after_migrate(self):
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TRIGGER clinic_patient_fts_ai")
+        Patient.objects.create(name="Zara Sheikh", gender="F")
+
+        ensure_sqlite_search_index()
+
+        self.assertEqual([p.name for p in search_patients("zara")], ["Zara Sheikh"])
+        Patient.objects.create(name="Zara Malik", gender="F")
+        self.assertEqual(len(search_patients("zara")), 2)
+
+    def test_api_patient_search_returns_ranked_json(self):
+        response = self.client.get(reverse("api_patient_search"), {"q": "alia"})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([p["name"] for p in response.json()], ["Alia Khan"])
+
+
+class DuplicatePatientDetectionTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testdoctor", password="testpass123")
+        self.client.force_login(self.user)
+        self.patient = Patient.objects.create(
+            name="Muhammad Ali", gender="M", phone="03001234567"
+        )
+
+    def test_spelling_variants_share_a_name_key(self):
+        self.assertEqual(self.patient.name_key, phonetic_name_key("Mohammed ALI"))
+
+        candidates = find_duplicate_candidates("Mohammad Ali")
+
+        self.assertEqual([c.patient for c in candidates], [self.patient])
+        self.assertGreater(candidates[0].score, 0.4)
+
+    def test_phone_match_is_a_candidate_and_exact_match_scores_highest(self):
+        other = Patient.objects.create(name="Muhamad Ali", gender="M")
+
+        candidates = find_duplicate_candidates("Muhammad Ali", phone="03001234567")
+
+        self.assertEqual([c.patient for c in candidates], [self.patient, other])
+        self.assertEqual(candidates[0].score, 1.0)
+        self.assertEqual(find_duplicate_candidates("Someone Else", "03001234567")[0].score, 0.4)
+
+    def test_lookup_is_a_single_query(self):
+        with self.assertNumQueries(1):
+            find_duplicate_candidates("Mohammad Ali", phone="0300")
+
+    def test_patient_create_warns_about_spelling_variant(self):
+        response = self.client.post(
+            reverse("patient_create"), {"name": "Mohammed Ali", "gender": "M"}
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context["show_duplicate_warning"])
+        self.assertContains(response, self.patient.patient_id)
+        self.assertEqual(Patient.objects.count(), 1)
+
+
+class PatientIdAllocationTests(TestCase):
+    def setUp(self):
+        self.allocator = BlockAllocator("test_sequence", block_size=10)
+
+    def test_patient_ids_are_sequential_and_unique(self):
+        first = Patient.objects.create(name="First", gender="M")
+        second = Patient.objects.create(name="Second", gender="F")
+
+        self.assertRegex(first.patient_id, r"^PT-\d{5,}$")
+        self.assertEqual(
+            int(second.patient_id[3:]), int(first.patient_id[3:]) + 1
+        )
+
+    def test_one_counter_write_per_block(self):
+        self.assertEqual(self.allocator.allocate(3), [1, 2, 3])
+        self.assertEqual(Counter.objects.get(name="test_sequence").value, 10)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.allocator.allocate(7), list(range(4, 11)))
+
+        # A request larger than a block is reserved in one write
+        self.assertEqual(self.allocator.allocate(25), list(range(11, 36)))
+        self.assertEqual(self.allocator.reservations, 2)
+
+    def test_block_reserved_in_rolled_back_transaction_is_discarded(self):
+        try:
+            with transaction.atomic():
+                self.assertEqual(self.allocator.allocate(1), [1])
+                raise RuntimeError("rollback")
+        except RuntimeError:
+            pass
+
+        # The reservation was rolled back, so the numbers are handed out
+        # afresh from the counter rather than from the stale in-memory block
+        self.assertEqual(self.allocator.allocate(2), [1, 2])
+        self.assertEqual(Counter.objects.get(name="test_sequence").value, 10)
+
+
+class ImportPatientsCommandTests(TestCase):
+    def write_file(self, suffix, content):
+        handle = tempfile.NamedTemporaryFile("w", suffix=suffix, delete=False, encoding="utf-8")
+        handle.write(content)
+        handle.close()
+        self.addCleanup(os.remove, handle.name)
+        return handle.name
+
+    def test_imports_csv_skipping_invalid_rows_and_duplicates(self):
+        Patient.objects.create(name="Muhammad Ali", gender="M", phone="03001234567")
+        path = self.write_file(".csv", (
+            "name,gender,age,phone\n"
+            "Mohammad Ali,Male,40,03001234567\n"
+            "Sana Khan,F,31,03219999999\n"
+            "Sana Khan,female,31,03219999999\n"
+            ",M,20,\n"
+        ))
+
+        call_command("import_patients", path, stdout=StringIO(), stderr=StringIO())
+
+        imported = Patient.objects.get(name="Sana Khan")
+        self.assertEqual(Patient.objects.count(), 2)
+        self.assertEqual(imported.name_key, phonetic_name_key("Sana Khan"))
+        self.assertEqual(imported.age, 31)
+        self.assertEqual(search_patients("sana"), [imported])
+
+    def test_imports_jsonl_in_batches_with_unique_ids(self):
+        path = self.write_file(".jsonl", "".join(
+            json.dumps({"name": f"Patient {i}", "gender": "M", "phone": f"0300{i:07d}"}) + "\n"
+            for i in range(25)
+        ))
+        out = StringIO()
+
+        call_command("import_patients", path, batch_size=10, stdout=out, stderr=StringIO())
+
+        ids = list(Patient.objects.values_list("patient_id", flat=True))
+        self.assertEqual(len(ids), 25)
+        self.assertEqual(len(set(ids)), 25)
+        self.assertIn("rows/s", out.getvalue())
+
+
+class SeedDataCommandTests(TestCase):
+    def test_default_seed_is_bulk_and_idempotent(self):
+        with CaptureQueriesContext(connection) as queries:
+            call_command("seed_data", stdout=StringIO())
+        medicines = Medicine.objects.count()
+        tests = LabTest.objects.count()
+
+        call_command("seed_data", stdout=StringIO())
+
+        self.assertGreater(medicines, 100)
+        self.assertLess(len(queries), 20)
+        self.assertEqual((Medicine.objects.count(), LabTest.objects.count()), (medicines, tests))
+
+    def test_from_file_upserts_in_batches(self):
+        Medicine.objects.create(name="Azithromycin", form="Tab", strength="500mg", default_dosage="1 OD")
+        handle = tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False, encoding="utf-8")
+        handle.write(
+            "name,form,strength,default_dosage,is_active\n"
+            "Azithromycin,Tablet,500mg,1 OD x 3 days,\n"
+            "Montelukast,tab,10mg,,yes\n"
+            "Budesonide,Inhaler,200mcg,,no\n"
+            "Mystery,Lozenge,,,\n"
+        )
+        handle.close()
+        self.addCleanup(os.remove, handle.name)
+        out, err = StringIO(), StringIO()
+
+        call_command("seed_data", from_file=handle.name, batch_size=2, update=True, stdout=out, stderr=err)
+
+        self.assertEqual(Medicine.objects.count(), 3)
+        self.assertEqual(Medicine.objects.get(name="Azithromycin").default_dosage, "1 OD x 3 days")
+        self.assertFalse(Medicine.objects.get(name="Budesonide").is_active)
+        self.assertIn("Line 5: form", err.getvalue())
+        self.assertIn("2 new medicines", out.getvalue())
+        self.assertIn("rows/s", out.getvalue())
+
+
+class PatientDetailHistoryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testdoctor", password="testpass123")
+        self.client.force_login(self.user)
+        self.patient = Patient.objects.create(name="Chronic Patient", gender="M")
+
+    def add_visits(self, count, start_day=1):
+        for day in range(start_day, start_day + count):
+            prescription = Prescription.objects.create(
+                patient=self.patient, date=date(2025, 1, 1) + timedelta(days=day)
+            )
+            for i in range(2):
+                PrescriptionMedicine.objects.create(
+                    prescription=prescription, custom_medicine=f"Med {i}"
+                )
+
+    def test_query_count_is_constant_regardless_of_visit_count(self):
+        self.add_visits(3)
+        # session, user, patient, visit count, one history page with medicine counts,
+        # catalog version for the cached template list
+        with self.assertNumQueries(6):
+            response = self.client.get(reverse("patient_detail", args=[self.patient.pk]))
+        self.assertEqual(response.context["total_visits"], 3)
+
+        self.add_visits(30, start_day=10)
+        with self.assertNumQueries(6):
+            response = self.client.get(reverse("patient_detail", args=[self.patient.pk]))
+        self.assertContains(response, "2 medicine(s) prescribed")
+
+    def test_history_pages_follow_the_cursor(self):
+        self.add_visits(25)
+        url = reverse("patient_detail", args=[self.patient.pk])
+
+        first = self.client.get(url)
+        second = self.client.get(url, {"cursor": first.context["next_cursor"]})
+
+        dates = [p.date for p in first.context["prescriptions"]]
+        dates += [p.date for p in second.context["prescriptions"]]
+        self.assertEqual(len(first.context["prescriptions"]), 20)
+        self.assertEqual(dates, sorted(dates, reverse=True))
+        self.assertEqual(len(set(dates)), 25)
+        self.assertIsNone(second.context["next_cursor"])
+
+
+def prescription_post_data(rows, **extra):
+    """POST payload for the prescription form with one formset row per dict."""
+    data = {
+        "date": "2025-03-01",
+        "medicines-TOTAL_FORMS": str(len(rows)),
+        "medicines-INITIAL_FORMS": "0",
+        "medicines-MIN_NUM_FORMS": "0",
+        "medicines-MAX_NUM_FORMS": "1000",
+    }
+    for i, row in enumerate(rows):
+        data[f"medicines-{i}-days"] = "5"
+        for key, value in row.items():
+            data[f"medicines-{i}-{key}"] = value
+    data.update(extra)
+    return data
+
+
+class PrescriptionCreateBulkSaveTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testdoctor", password="testpass123")
+        self.client.force_login(self.user)
+        self.patient = Patient.objects.create(name="Test Patient", gender="M")
+        self.url = reverse("prescription_create", args=[self.patient.pk])
+
+    def post_custom_medicines(self, names):
+        rows = [{"custom_medicine": name} for name in names]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.url, prescription_post_data(rows))
+        self.assertEqual(response.status_code, 302)
+        return len(queries)
+
+    def test_custom_medicines_are_linked_case_insensitively_or_created(self):
+        existing = Medicine.objects.create(name="Azithromycin", form="Tab", strength="500mg")
+
+        self.post_custom_medicines(["azithromycin", "New Drug", "new drug"])
+
+        prescription = Prescription.objects.get()
+        rows = list(prescription.medicines.all())
+        self.assertEqual(rows[0].medicine, existing)
+        self.assertEqual(rows[1].medicine, rows[2].medicine)
+        self.assertEqual(rows[1].medicine.name, "New Drug")
+        self.assertEqual(rows[1].custom_medicine, "")
+        self.assertEqual(Medicine.objects.count(), 2)
+
+    def test_non_ascii_custom_medicine_names_are_created_and_linked(self):
+        resolved = resolve_medicines_by_name(["Ölmesartan Plus"])
+        self.assertEqual(resolved["ölmesartan plus"].name, "Ölmesartan Plus")
+
+        self.post_custom_medicines(["Ölmesartan Plus", "Émulsion Ä"])
+
+        rows = list(Prescription.objects.get().medicines.all())
+        self.assertEqual(rows[0].medicine, resolved["ölmesartan plus"])
+        self.assertEqual(rows[1].medicine.name, "Émulsion Ä")
+
+    def test_form_page_leaves_the_catalog_to_the_search_api(self):
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("medicines", response.context)
+
+    def test_query_count_does_not_grow_with_medicine_rows(self):
+        # Warm-up: the per-process reference data may be left over from
+        # another test whose catalog version was rolled back
+        self.post_custom_medicines(["Warm-up Drug"])
+        few = self.post_custom_medicines([f"Drug {i}" for i in range(3)])
+        many = self.post_custom_medicines([f"Other Drug {i}" for i in range(15)])
+
+        self.assertEqual(few, many)
+        self.assertEqual(PrescriptionMedicine.objects.count(), 19)
+
+
+class PrescriptionDuplicateTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testdoctor", password="testpass123")
+        self.client.force_login(self.user)
+        self.patient = Patient.objects.create(name="Test Patient", gender="M")
+        self.lab_test = LabTest.objects.create(name="Complete Blood Count", abbreviation="CBC")
+        self.original = Prescription.objects.create(
+            patient=self.patient,
+            date=date(2025, 1, 1),
+            diagnosis="COPD, Asthma",
+            hep_b=True,
+            hep_c=True,
+            obesity=True,
+            other_instructions="Walk daily",
+        )
+        self.original.tests_ordered.add(self.lab_test)
+
+    def add_medicines(self, count):
+        medicine, _ = Medicine.objects.get_or_create(name="Salbutamol", form="Inhaler")
+        PrescriptionMedicine.objects.bulk_create([
+            PrescriptionMedicine(
+                prescription=self.original,
+                medicine=medicine,
+                duration_choice="custom",
+                custom_duration="3 weeks",
+                morning=1,
+            )
+            for _ in range(count)
+        ])
+
+    def test_duplicate_copies_every_field(self):
+        self.add_medicines(2)
+
+        response = self.client.get(reverse("prescription_duplicate", args=[self.original.pk]))
+
+        clone = Prescription.objects.exclude(pk=self.original.pk).get()
+        self.assertRedirects(response, reverse("prescription_edit", args=[clone.pk]))
+        self.assertEqual(clone.diagnosis, "COPD, Asthma")
+        self.assertTrue(clone.hep_b and clone.hep_c and clone.obesity)
+        self.assertEqual(clone.other_instructions, "Walk daily")
+        self.assertFalse(clone.is_first_visit)
+        self.assertNotEqual(clone.date, self.original.date)
+        self.assertEqual(list(clone.tests_ordered.all()), [self.lab_test])
+        rows = list(clone.medicines.all())
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0].duration_choice, "custom")
+        self.assertEqual(rows[0].custom_duration, "3 weeks")
+
+    def test_clone_query_count_is_bounded(self):
+        self.add_medicines(2)
+        with CaptureQueriesContext(connection) as few:
+            clone_prescription(self.original)
+
+        self.add_medicines(12)
+        with CaptureQueriesContext(connection) as many:
+            clone_prescription(self.original)
+
+        self.assertEqual(len(few), len(many))
+
+
+class PrescriptionPrintCacheTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testdoctor", password="testpass123")
+        self.client.force_login(self.user)
+        self.patient = Patient.objects.create(name="Test Patient", gender="M")
+        self.prescription = Prescription.objects.create(patient=self.patient, diagnosis="Asthma")
+        self.medicine = Medicine.objects.create(name="Salbutamol", form="Inhaler")
+        self.cache = get_print_cache()
+        self.cache.backend.clear()
+        self.url = reverse("prescription_print", args=[self.prescription.pk])
+
+    def test_reprint_is_served_from_cache(self):
+        first = self.client.get(self.url)
+        hits = self.cache.hits
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get(self.url)
+
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(self.cache.hits, hits + 1)
+        self.assertEqual(len([q for q in queries if "clinic_" in q["sql"]]), 1)
+
+    def test_writes_invalidate_cached_slip(self):
+        self.client.get(self.url)
+
+        PrescriptionMedicine.objects.create(prescription=self.prescription, medicine=self.medicine)
+        self.assertContains(self.client.get(self.url), "Salbutamol")
+
+        self.patient.name = "Renamed Patient"
+        self.patient.save()
+        self.assertContains(self.client.get(self.url), "Renamed Patient")
+
+        self.prescription.tests_ordered.add(LabTest.objects.create(name="Chest X-Ray"))
+        self.assertContains(self.client.get(self.url), "Chest X-Ray")
+
+    def test_missing_prescription_is_404(self):
+        response = self.client.get(reverse("prescription_print", args=[self.prescription.pk + 1]))
+        self.assertEqual(response.status_code, 404)
+
+
+class PrescriptionPdfTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testdoctor", password="testpass123")
+        self.client.force_login(self.user)
+        self.patient = Patient.objects.create(name="Test Patient", gender="M")
+        self.prescription = Prescription.objects.create(patient=self.patient)
+        self.url = reverse("prescription_pdf", args=[self.prescription.pk])
+        get_print_cache().backend.clear()
+        self.pdf_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.pdf_dir.cleanup)
+
+    def test_cached_pdf_is_served_from_disk(self):
+        with override_settings(PRESCRIPTION_PDF_DIR=self.pdf_dir.name):
+            html = self.client.get(reverse("prescription_print", args=[self.prescription.pk])).content.decode()
+            path = pdf_cache_path(html)
+            path.parent.mkdir(parents=True)
+            path.write_bytes(b"%PDF-1.7 cached")
+
+            response = self.client.get(self.url)
+
+        self.assertEqual(response["Content-Type"], "application/pdf")
+        self.assertEqual(b"".join(response.streaming_content), b"%PDF-1.7 cached")
+
+    def test_edit_changes_content_address(self):
+        with override_settings(PRESCRIPTION_PDF_DIR=self.pdf_dir.name):
+            print_url = reverse("prescription_print", args=[self.prescription.pk])
+            before = pdf_cache_path(self.client.get(print_url).content.decode())
+            self.prescription.diagnosis = "Pneumonia"
+            self.prescription.save()
+            after = pdf_cache_path(self.client.get(print_url).content.decode())
+
+        self.assertNotEqual(before, after)
+
+    def render_with_pool(self, pool, **settings):
+        with override_settings(PRESCRIPTION_PDF_DIR=self.pdf_dir.name, **settings), \
+                mock.patch.object(pdf, "_load_weasyprint"), \
+                mock.patch.object(pdf, "_pool", pool), mock.patch.object(pdf, "_pool_pid", os.getpid()):
+            response = self.client.get(self.url)
+            return response, pdf._pool
+
+    def test_crashed_renderer_answers_503_and_is_replaced(self):
+        pool = FakePdfPool(BrokenProcessPool("worker died"))
+
+        response, current_pool = self.render_with_pool(pool)
+
+        self.assertEqual(response.status_code, 503)
+        self.assertIsNone(current_pool)
+        self.assertTrue(pool.shut_down)
+
+    def test_slow_render_answers_504_and_recycles_the_pool(self):
+        pool = FakePdfPool()
+
+        response, current_pool = self.render_with_pool(pool, PRESCRIPTION_PDF_TIMEOUT=0.01)
+
+        self.assertEqual(response.status_code, 504)
+        self.assertIsNone(current_pool)
+        self.assertTrue(pool.shut_down)
+        self.assertTrue(all(worker.killed for worker in pool._processes.values()))
+
+
+class FakePdfPool:
+    """Stands in for the renderer pool: every render fails with `error`, or never finishes."""
+
+    def __init__(self, error=None):
+        self.error = error
+        self.shut_down = False
+        self._processes = {pid: FakePdfWorker() for pid in (101, 102)}
+
+    def submit(self, *args):
+        future = Future()
+        if self.error:
+            future.set_exception(self.error)
+        return future
+
+    def shutdown(self, **kwargs):
+        self.shut_down = True
+
+
+class FakePdfWorker:
+    killed = False
+
+    def kill(self):
+        self.killed = True
+
+
+class PrescriptionBatchPrintTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testdoctor", password="testpass123")
+        self.client.force_login(self.user)
+        self.medicine = Medicine.objects.create(name="Salbutamol", form="Inhaler")
+        self.lab_test = LabTest.objects.create(name="Chest X-Ray")
+        self.url = reverse("prescription_batch_print")
+
+    def add_prescriptions(self, count, day=date(2025, 3, 1)):
+        created = []
+        for i in range(count):
+            patient = Patient.objects.create(name=f"Batch Patient {i}", gender="F")
+            prescription = Prescription.objects.create(patient=patient, date=day)
+            PrescriptionMedicine.objects.create(prescription=prescription, medicine=self.medicine)
+            prescription.tests_ordered.add(self.lab_test)
+            created.append(prescription)
+        return created
+
+    def fetch(self, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, params)
+            content = b"".join(response.streaming_content).decode()
+        return content, len([q for q in queries if "clinic_" in q["sql"]])
+
+    def test_streams_one_slip_per_prescription_in_fixed_queries(self):
+        self.add_prescriptions(2)
+        _, few_queries = self.fetch(date_from="2025-03-01")
+        self.add_prescriptions(6)
+        self.add_prescriptions(1, day=date(2025, 3, 2))
+
+        content, many_queries = self.fetch(date_from="2025-03-01")
+
+        self.assertEqual(content.count('class="page-wrap"'), 8)
+        self.assertEqual(content.count("Salbutamol"), 8)
+        self.assertTrue(content.rstrip().endswith("</html>"))
+        self.assertEqual(few_queries, many_queries)
+
+    def test_selects_by_ids(self):
+        first, _, third = self.add_prescriptions(3)
+
+        content, _ = self.fetch(ids=f"{first.pk},{third.pk}")
+
+        self.assertIn("Batch Patient 0", content)
+        self.assertNotIn("Batch Patient 1", content)
+        self.assertIn("Batch Patient 2", content)
+
+    def test_requires_a_selection(self):
+        self.assertEqual(self.client.get(self.url).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {"date_from": "yesterday"}).status_code, 400)
+
+    def test_pdf_batches_are_capped_and_time_out_cleanly(self):
+        self.add_prescriptions(3)
+        pdf_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(pdf_dir.cleanup)
+
+        with mock.patch.object(views, "BATCH_PRINT_PDF_LIMIT", 2):
+            too_many = self.client.get(self.url, {"date_from": "2025-03-01", "format": "pdf"})
+        with override_settings(PRESCRIPTION_PDF_DIR=pdf_dir.name, PRESCRIPTION_PDF_TIMEOUT=0.01), \
+                mock.patch.object(pdf, "_load_weasyprint"), mock.patch.object(pdf, "get_pdf_pool", FakePdfPool):
+            slow = self.client.get(self.url, {"date_from": "2025-03-01", "format": "pdf"})
+
+        self.assertEqual(too_many.status_code, 400)
+        self.assertEqual(slow.status_code, 504)
+
+
+class PrescriptionMedicineFormSetChoicesTests(TestCase):
+    def setUp(self):
+        self.medicines = [
+            Medicine.objects.create(name=f"Medicine {i:02d}", form="Tab") for i in range(12)
+        ]
+
+    def validate(self, medicine_ids):
+        data = prescription_post_data([{"medicine": str(pk)} for pk in medicine_ids])
+        formset = PrescriptionMedicineFormSet(data)
+        with CaptureQueriesContext(connection) as queries:
+            valid = formset.is_valid()
+        return formset, valid, len(queries)
+
+    def test_submitted_medicines_are_validated_in_one_query(self):
+        _, few_valid, few = self.validate([m.pk for m in self.medicines[:2]])
+        formset, many_valid, many = self.validate([m.pk for m in self.medicines])
+
+        self.assertTrue(few_valid and many_valid)
+        self.assertEqual(few, 1)
+        self.assertEqual(many, 1)
+        self.assertEqual(formset.forms[3].cleaned_data["medicine"], self.medicines[3])
+
+    def test_unknown_medicine_is_rejected(self):
+        formset, valid, _ = self.validate([self.medicines[0].pk, 999999])
+
+        self.assertFalse(valid)
+        self.assertIn("medicine", formset.forms[1].errors)
+
+    def test_rows_render_only_their_selected_medicine(self):
+        patient = Patient.objects.create(name="Test Patient", gender="M")
+        prescription = Prescription.objects.create(patient=patient)
+        PrescriptionMedicine.objects.bulk_create([
+            PrescriptionMedicine(prescription=prescription, medicine=medicine)
+            for medicine in self.medicines[:3]
+        ])
+
+        formset = PrescriptionMedicineEditFormSet(instance=prescription)
+        with CaptureQueriesContext(connection) as queries:
+            html = "".join(str(form["medicine"]) for form in formset) + str(formset.empty_form["medicine"])
+
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(html.count(" selected>"), 3)
+        self.assertIn(">Tab Medicine 02<", html)
+        self.assertNotIn("Medicine 05", html)
+
+
+class DiagnosisStatTests(TestCase):
+    def setUp(self):
+        self.patient = Patient.objects.create(name="Test Patient", gender="M")
+
+    def stats(self):
+        return dict(DiagnosisStat.objects.values_list("key", "use_count"))
+
+    def test_stats_follow_prescription_writes(self):
+        first = Prescription.objects.create(patient=self.patient, diagnosis="COPD, Asthma")
+        Prescription.objects.create(patient=self.patient, diagnosis="copd ,  Pneumonia")
+        self.assertEqual(self.stats(), {"copd": 2, "asthma": 1, "pneumonia": 1})
+
+        first.diagnosis = "Asthma, Bronchiectasis"
+        first.save()
+        self.assertEqual(self.stats(), {"copd": 1, "asthma": 1, "pneumonia": 1, "bronchiectasis": 1})
+
+        first.delete()
+        self.assertEqual(self.stats()["asthma"], 0)
+        self.assertEqual(DiagnosisStat.objects.get(key="copd").text, "COPD")
+
+    def test_recent_diagnoses_follow_the_whole_common_list(self):
+        start = date(2025, 3, 1)
+        DiagnosisStat.objects.bulk_create([
+            DiagnosisStat(key=text.lower(), text=text, use_count=1, last_used=f"{start + timedelta(days=day)}T09:00Z")
+            for day, text in enumerate(["Silicosis", "COPD", "Berylliosis", "Byssinosis"])
+        ])
+
+        diagnoses = views.get_recent_diagnoses(limit=3)
+
+        self.assertEqual(diagnoses[-2:], ["Byssinosis", "Berylliosis"])
+        self.assertIn("OSA/OHS", diagnoses)
+        self.assertNotIn("", diagnoses)
+        self.assertEqual(len(diagnoses), len({d.lower() for d in diagnoses}))
+
+    def test_options_list_recent_diagnoses_with_one_query(self):
+        Prescription.objects.create(patient=self.patient, diagnosis="Sarcoidosis, COPD")
+        Prescription.objects.create(patient=self.patient, diagnosis="Silicosis")
+
+        with CaptureQueriesContext(connection) as queries:
+            options = views.get_diagnosis_options()
+
+        self.assertEqual(len(queries), 1)
+        self.assertIn("Sarcoidosis", options)
+        self.assertIn("Silicosis", options)
+        self.assertEqual(len(options), len(set(o.lower() for o in options)))
+
+    def test_backfill_command_rebuilds_from_prescriptions(self):
+        Prescription.objects.create(patient=self.patient, diagnosis="COPD, Asthma")
+        Prescription.objects.create(patient=self.patient, diagnosis="COPD")
+        DiagnosisStat.objects.all().delete()
+        PrescriptionDiagnosis.objects.all().delete()
+
+        call_command("backfill_diagnoses", stdout=StringIO())
+
+        self.assertEqual(self.stats(), {"copd": 2, "asthma": 1})
+        self.assertEqual(prescriptions_with_diagnosis("copd").count(), 2)
+
+    def test_migration_counts_existing_diagnoses(self):
+        Prescription.objects.create(patient=self.patient, diagnosis="COPD, Asthma")
+        Prescription.objects.create(patient=self.patient, diagnosis="copd")
+        DiagnosisStat.objects.all().delete()
+
+        import_module("clinic.migrations.0020_diagnosisstat").backfill_diagnosis_stats(django_apps, None)
+
+        self.assertEqual(self.stats(), {"copd": 2, "asthma": 1})
+        self.assertCountEqual(recent_diagnoses(), ["COPD", "Asthma"])
+
+    def test_migration_indexes_existing_diagnoses(self):
+        visit = Prescription.objects.create(patient=self.patient, date=date(2025, 1, 10), diagnosis="COPD, Asthma")
+        Prescription.objects.create(patient=self.patient, date=date(2024, 6, 1), diagnosis="copd")
+        PrescriptionDiagnosis.objects.all().delete()
+
+        import_module("clinic.migrations.0021_diagnosis_index").backfill_diagnosis_index(django_apps, None)
+
+        self.assertEqual(prescriptions_with_diagnosis("copd").count(), 2)
+        self.assertEqual(list(prescriptions_with_diagnosis("COPD", date_from=date(2025, 1, 1))), [visit])
+        self.assertEqual(list(prescriptions_with_diagnosis("asthma")), [visit])
+
+    def test_diagnosis_index_follows_text_and_date(self):
+        visit = Prescription.objects.create(patient=self.patient, date=date(2025, 1, 10), diagnosis="COPD, Asthma")
+        Prescription.objects.create(patient=self.patient, date=date(2024, 6, 1), diagnosis="copd")
+
+        self.assertEqual(list(prescriptions_with_diagnosis("COPD", date_from=date(2025, 1, 1))), [visit])
+
+        visit.diagnosis = "Asthma"
+        visit.date = date(2024, 12, 31)
+        visit.save()
+
+        self.assertEqual(prescriptions_with_diagnosis("copd").count(), 1)
+        self.assertEqual(
+            list(PrescriptionDiagnosis.objects.filter(prescription=visit).values_list("diagnosis__name", "date")),
+            [("Asthma", date(2024, 12, 31))],
+        )
+
+
+class MedicineUsageTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username="testdoctor", password="testpass123")
+        self.doctor = Doctor.objects.create(user=user, name="Test Doctor")
+        self.patient = Patient.objects.create(name="Test Patient", gender="M")
+        self.salbutamol = Medicine.objects.create(name="Salbutamol", form="Inh")
+        self.prednisolone = Medicine.objects.create(name="Prednisolone", form="Tab")
+        self.today = date(2025, 3, 1)
+
+    def top(self, doctor=None):
+        return [(m["medicine__name"], m["count"]) for m in top_medicines(days=30, doctor=doctor, today=self.today)]
+
+    def test_buckets_follow_prescription_writes(self):
+        visit = Prescription.objects.create(patient=self.patient, doctor=self.doctor, date=self.today)
+        row = PrescriptionMedicine.objects.create(prescription=visit, medicine=self.salbutamol)
+        PrescriptionMedicine.objects.create(prescription=visit, medicine=self.prednisolone)
+        clone_prescription(visit, date=self.today - timedelta(days=1), doctor_id=None)
+        self.assertEqual(self.top(), [("Prednisolone", 2), ("Salbutamol", 2)])
+        self.assertEqual(self.top(self.doctor), [("Prednisolone", 1), ("Salbutamol", 1)])
+
+        row.medicine = self.prednisolone
+        row.save()
+        visit.date = self.today - timedelta(days=60)
+        visit.save()
+        self.assertEqual(self.top(), [("Prednisolone", 1), ("Salbutamol", 1)])
+        self.assertEqual(self.top(self.doctor), [])
+
+        visit.delete()
+        self.assertEqual(reconcile_medicine_usage(), 0)
+
+    def test_reconcile_command_repairs_drift(self):
+        visit = Prescription.objects.create(patient=self.patient, doctor=self.doctor, date=self.today)
+        PrescriptionMedicine.objects.create(prescription=visit, medicine=self.salbutamol)
+        MedicineUsage.objects.filter(doctor__isnull=True).delete()
+        MedicineUsage.objects.filter(doctor=self.doctor).update(count=5)
+
+        out = StringIO()
+        call_command("reconcile_medicine_usage", stdout=out)
+
+        self.assertIn("Corrected 2", out.getvalue())
+        self.assertEqual(self.top(), [("Salbutamol", 1)])
+        self.assertEqual(self.top(self.doctor), [("Salbutamol", 1)])
+
+    def test_migration_backfills_existing_prescriptions(self):
+        visit = Prescription.objects.create(patient=self.patient, doctor=self.doctor, date=self.today)
+        PrescriptionMedicine.objects.create(prescription=visit, medicine=self.salbutamol)
+        MedicineUsage.objects.all().delete()
+
+        import_module("clinic.migrations.0023_medicine_usage").backfill_medicine_usage(django_apps, None)
+
+        self.assertEqual(self.top(), [("Salbutamol", 1)])
+        self.assertEqual(self.top(self.doctor), [("Salbutamol", 1)])
+
+
+class DailyStatsTests(TestCase):
+    def setUp(self):
+        self.today = date(2025, 3, 10)
+        self.alice = Patient.objects.create(name="Alice", gender="F")
+        self.bob = Patient.objects.create(name="Bob", gender="M")
+
+    def figures(self):
+        stats = dashboard_stats(self.today)
+        return (stats["today_prescriptions"], stats["today_patients"], stats["week_prescriptions"],
+                stats["month_prescriptions"], stats["total_prescriptions"])
+
+    def test_stats_follow_prescription_writes(self):
+        Prescription.objects.create(patient=self.alice, date=self.today)
+        Prescription.objects.create(patient=self.alice, date=self.today)
+        moved = Prescription.objects.create(patient=self.bob, date=self.today)
+        Prescription.objects.create(patient=self.bob, date=self.today - timedelta(days=20))
+        self.assertEqual(self.figures(), (3, 2, 3, 4, 4))
+        self.assertEqual(dashboard_stats(self.today)["total_patients"], 2)
+
+        moved.date = self.today - timedelta(days=3)
+        moved.save()
+        self.assertEqual(self.figures(), (2, 1, 3, 4, 4))
+
+        self.alice.delete()
+        self.assertEqual(self.figures(), (0, 0, 1, 2, 2))
+        self.assertEqual(dashboard_stats(self.today)["total_patients"], 1)
+
+    def test_rebuild_command_and_single_query_read(self):
+        Prescription.objects.create(patient=self.alice, date=self.today)
+        Prescription.objects.create(patient=self.bob, date=self.today - timedelta(days=40))
+        DailyStats.objects.all().delete()
+
+        call_command("rebuild_daily_stats", stdout=StringIO())
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.figures(), (1, 1, 1, 1, 2))
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(dashboard_stats(self.today)["total_patients"], 2)
+
+    def test_migration_backfills_existing_data(self):
+        Prescription.objects.create(patient=self.alice, date=self.today)
+        Prescription.objects.create(patient=self.bob, date=self.today)
+        DailyStats.objects.all().delete()
+
+        import_module("clinic.migrations.0024_daily_stats").backfill_daily_stats(django_apps, None)
+
+        self.assertEqual(self.figures(), (2, 2, 2, 2, 2))
+        self.assertEqual(dashboard_stats(self.today)["total_patients"], 2)
+
+    def test_dashboard_renders_summary(self):
+        user = User.objects.create_user(username="testdoctor", password="testpass123")
+        self.client.force_login(user)
+        Prescription.objects.create(patient=self.alice)
+
+        response = self.client.get(reverse("dashboard"))
+
+        self.assertEqual(response.context["stats"]["today_prescriptions"], 1)
+        self.assertEqual(response.context["stats"]["total_patients"], 2)
+
+
+class DoctorRollupTests(TestCase):
+    def setUp(self):
+        self.today = date(2025, 3, 10)
+        self.doctor = Doctor.objects.create(
+            user=User.objects.create_user(username="testdoctor", password="testpass123"), name="Test Doctor"
+        )
+        self.alice = Patient.objects.create(name="Alice", gender="F")
+        self.bob = Patient.objects.create(name="Bob", gender="M")
+        self.cbc = LabTest.objects.create(name="CBC")
+        self.xray = LabTest.objects.create(name="Chest X-Ray")
+
+    def rollup(self, day=None):
+        return DoctorDailyRollup.objects.filter(doctor=self.doctor, day=day or self.today).values_list(
+            "prescriptions", "patients", "first_visits", "follow_ups"
+        ).first()
+
+    def lab_counts(self, doctor=None):
+        buckets = LabTestUsage.objects.filter(doctor=doctor) if doctor else LabTestUsage.objects.filter(doctor__isnull=True)
+        totals = buckets.values("lab_test__name").annotate(total=Sum("count")).filter(total__gt=0)
+        return dict(totals.values_list("lab_test__name", "total"))
+
+    def test_rollups_follow_prescription_writes(self):
+        Prescription.objects.create(patient=self.alice, doctor=self.doctor, date=self.today)
+        follow_up = Prescription.objects.create(patient=self.alice, doctor=self.doctor, date=self.today, is_first_visit=False)
+        moved = Prescription.objects.create(patient=self.bob, doctor=self.doctor, date=self.today)
+        self.assertEqual(self.rollup(), (3, 2, 2, 1))
+
+        moved.date = self.today - timedelta(days=1)
+        moved.save()
+        self.assertEqual(self.rollup(), (2, 1, 1, 1))
+        self.assertEqual(self.rollup(moved.date), (1, 1, 1, 0))
+
+        follow_up.delete()
+        self.assertEqual(self.rollup(), (1, 1, 1, 0))
+        moved.delete()
+        self.assertIsNone(self.rollup(moved.date))
+
+    def test_lab_test_usage_follows_orders(self):
+        prescription = Prescription.objects.create(patient=self.alice, doctor=self.doctor, date=self.today)
+        prescription.tests_ordered.add(self.cbc, self.xray)
+        self.assertEqual(self.lab_counts(self.doctor), {"CBC": 1, "Chest X-Ray": 1})
+
+        prescription.tests_ordered.remove(self.xray)
+        clone_prescription(prescription)
+        self.assertEqual(self.lab_counts(), {"CBC": 2})
+
+        prescription.tests_ordered.clear()
+        self.assertEqual(self.lab_counts(), {"CBC": 1})
+        self.cbc.prescription_set.clear()
+        self.assertEqual(self.lab_counts(), {})
+
+    def test_rebuild_command_restores_rollups(self):
+        prescription = Prescription.objects.create(patient=self.alice, doctor=self.doctor, date=self.today)
+        prescription.tests_ordered.add(self.cbc)
+        Prescription.objects.create(patient=self.bob, doctor=self.doctor, date=self.today - timedelta(days=40))
+        DoctorDailyRollup.objects.all().delete()
+        LabTestUsage.objects.all().delete()
+
+        call_command("rebuild_rollups", "--since", str(self.today), "--chunk-size", "1", stdout=StringIO())
+        self.assertEqual(self.rollup(), (1, 1, 1, 0))
+        self.assertIsNone(self.rollup(self.today - timedelta(days=40)))
+        self.assertEqual(self.lab_counts(self.doctor), {"CBC": 1})
+
+        call_command("rebuild_rollups", stdout=StringIO())
+        self.assertEqual(self.rollup(self.today - timedelta(days=40)), (1, 1, 1, 0))
+
+    def test_migration_backfills_existing_prescriptions(self):
+        prescription = Prescription.objects.create(patient=self.alice, doctor=self.doctor, date=self.today)
+        prescription.tests_ordered.add(self.cbc)
+        Prescription.objects.create(patient=self.alice, doctor=self.doctor, date=self.today, is_first_visit=False)
+        DoctorDailyRollup.objects.all().delete()
+        LabTestUsage.objects.all().delete()
+
+        import_module("clinic.migrations.0025_doctor_rollups").backfill_rollups(django_apps, None)
+
+        self.assertEqual(self.rollup(), (2, 1, 1, 1))
+        self.assertEqual(self.lab_counts(self.doctor), {"CBC": 1})
+        self.assertEqual(self.lab_counts(), {"CBC": 1})
+
+
+class AnalyticsTimeseriesTests(TestCase):
+    def setUp(self):
+        caches["default"].clear()
+        self.user = User.objects.create_user(username="testdoctor", password="testpass123")
+        self.doctor = Doctor.objects.create(user=self.user, name="Test Doctor")
+        self.client.force_login(self.user)
+        self.alice = Patient.objects.create(name="Alice", gender="F")
+        self.bob = Patient.objects.create(name="Bob", gender="M")
+        self.amoxil = Medicine.objects.create(name="Amoxil", form="Cap")
+        self.url = reverse("api_analytics_timeseries")
+        # Alice was seen before the range, Bob is new in its second week
+        Prescription.objects.create(patient=self.alice, doctor=self.doctor, date=date(2025, 2, 20))
+        self.visit(self.alice, date(2025, 3, 3), medicines=2)
+        self.visit(self.alice, date(2025, 3, 5))
+        self.visit(self.bob, date(2025, 3, 11), medicines=1)
+        self.visit(self.bob, date(2025, 3, 12), doctor=None)
+
+    def visit(self, patient, day, medicines=0, doctor=True):
+        prescription = Prescription.objects.create(
+            patient=patient, doctor=self.doctor if doctor else None, date=day
+        )
+        for _ in range(medicines):
+            PrescriptionMedicine.objects.create(prescription=prescription, medicine=self.amoxil)
+
+    def get(self, **params):
+        params = {"start": "2025-03-03", "end": "2025-03-16", "bucket": "week", **params}
+        return self.client.get(self.url, params)
+
+    def test_weekly_series(self):
+        data = self.get().json()
+
+        self.assertEqual(data["buckets"], ["2025-03-03", "2025-03-10"])
+        self.assertEqual(data["prescriptions"], [2, 2])
+        self.assertEqual(data["new_patients"], [0, 1])
+        self.assertEqual(data["returning_patients"], [1, 0])
+        self.assertEqual(data["medicines"], [{"id": self.amoxil.pk, "name": str(self.amoxil), "total": 3, "counts": [2, 1]}])
+
+        by_day = self.get(bucket="day", doctor=self.doctor.pk, start="2025-03-11", end="2025-03-12").json()
+        self.assertEqual(by_day["prescriptions"], [1, 0])
+        self.assertEqual(self.get(bucket="month").json()["prescriptions"], [4])
+
+    def test_cached_until_prescriptions_change(self):
+        self.get()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.get().json()["prescriptions"], [2, 2])
+        self.assertFalse(any("clinic_prescription" in query["sql"] for query in queries))
+
+        self.visit(self.bob, date(2025, 3, 4))
+        self.assertEqual(self.get().json()["prescriptions"], [3, 2])
+
+    def test_only_writes_inside_the_range_expire_it(self):
+        self.get()
+        self.visit(self.bob, date(2025, 4, 1), medicines=1)
+        with CaptureQueriesContext(connection) as queries:
+            self.get()
+        self.assertFalse(any("clinic_prescription" in query["sql"] for query in queries))
+
+        visit = Prescription.objects.get(date=date(2025, 3, 5))
+        PrescriptionMedicine.objects.create(prescription=visit, medicine=self.amoxil)
+        self.assertEqual(self.get().json()["medicines"][0]["counts"], [3, 1])
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.get(bucket="year").status_code, 400)
+        self.assertEqual(self.get(start="2025-03-20").status_code, 400)
+        self.assertEqual(self.get(start="2000-01-01", bucket="day").status_code, 400)
+        self.assertEqual(self.get(doctor="me").status_code, 400)
+
+
+class MedicineSearchApiTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testdoctor", password="testpass123")
+        self.doctor = Doctor.objects.create(user=self.user, name="Test Doctor")
+        self.client.force_login(self.user)
+        self.amoxil = Medicine.objects.create(name="Amoxil", form="Cap", strength="500mg")
+        self.amoxil_syrup = Medicine.objects.create(name="Amoxil", form="Syp", strength="250mg")
+        self.amlodipine = Medicine.objects.create(name="Amlodipine", form="Tab", strength="5mg")
+        Medicine.objects.create(name="Azithromycin", form="Tab")
+        Medicine.objects.create(name="Amikacin", form="Inj", is_active=False)
+        self.url = reverse("api_medicine_search")
+
+    def search(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_prefix_matches_name_then_form_and_strength(self):
+        self.assertEqual(
+            [r["text"] for r in self.search(q="am")["results"]],
+            ["Tab Amlodipine 5mg", "Cap Amoxil 500mg", "Syp Amoxil 250mg"],
+        )
+        self.assertEqual([r["id"] for r in self.search(q="amox 250")["results"]], [self.amoxil_syrup.pk])
+        self.assertEqual([r["id"] for r in self.search(q="syrup amox")["results"]], [self.amoxil_syrup.pk])
+
+    def test_doctors_own_prescribing_ranks_first(self):
+        patient = Patient.objects.create(name="Test Patient", gender="M")
+        for _ in range(2):
+            prescription = Prescription.objects.create(patient=patient, doctor=self.doctor)
+            PrescriptionMedicine.objects.create(prescription=prescription, medicine=self.amoxil_syrup)
+
+        self.assertEqual(self.search(q="am")["results"][0]["id"], self.amoxil_syrup.pk)
+        self.assertEqual([r["id"] for r in self.search()["results"]], [self.amoxil_syrup.pk])
+
+    def test_results_are_paged(self):
+        first = self.search(q="am", page_size=2)
+        second = self.search(q="am", page_size=2, cursor=first["pagination"]["cursor"])
+
+        self.assertTrue(first["pagination"]["more"])
+        self.assertFalse(second["pagination"]["more"])
+        self.assertEqual(len(first["results"]) + len(second["results"]), 3)
+
+    def test_most_used_match_leads_however_many_match(self):
+        Medicine.objects.bulk_create([Medicine(name=f"Amb {i:03d}", form="Tab") for i in range(250)])
+        favourite = Medicine.objects.get(name="Amb 249")
+        prescription = Prescription.objects.create(
+            patient=Patient.objects.create(name="Test Patient", gender="M"), doctor=self.doctor
+        )
+        PrescriptionMedicine.objects.create(prescription=prescription, medicine=favourite)
+
+        pages = [self.search(q="am", page_size=50)]
+        while pages[-1]["pagination"]["more"]:
+            pages.append(self.search(q="am", page_size=50, cursor=pages[-1]["pagination"]["cursor"]))
+        ids = [r["id"] for page in pages for r in page["results"]]
+
+        self.assertEqual(ids[0], favourite.pk)
+        self.assertEqual(len(ids), 253)
+        self.assertEqual(len(set(ids)), 253)
+
+
+class MedicineFuzzyMatchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testdoctor", password="testpass123")
+        self.client.force_login(self.user)
+        self.azithromycin = Medicine.objects.create(name="Azithromycin", form="Tab", strength="500mg")
+        Medicine.objects.create(name="Azithromycin", form="Syp", strength="200mg/5ml")
+        Medicine.objects.create(name="Clarithromycin", form="Tab")
+
+    def test_only_spelling_variants_link_to_the_catalog(self):
+        Medicine.objects.create(name="Co-Amoxiclav", form="Tab")
+
+        resolved = resolve_medicines_by_name(["Azithromicin", "azithromycin ", "co amoxiclav"])
+
+        self.assertEqual(resolved["azithromycin"], self.azithromycin)
+        self.assertEqual(resolved["co amoxiclav"].name, "Co-Amoxiclav")
+        self.assertEqual(resolved["azithromicin"].name, "Azithromicin")
+
+    def test_look_alike_drug_is_never_linked(self):
+        Medicine.objects.create(name="Prednisolone", form="Tab", strength="5mg")
+
+        resolved = resolve_medicines_by_name(["Prednisone"])
+
+        self.assertEqual(resolved["prednisone"].name, "Prednisone")
+
+    def test_look_alike_drug_must_be_confirmed_in_the_form(self):
+        prednisolone = Medicine.objects.create(name="Prednisolone", form="Tab", strength="5mg")
+        patient = Patient.objects.create(name="Test Patient", gender="M")
+        url = reverse("prescription_create", args=[patient.pk])
+
+        response = self.client.post(url, prescription_post_data([{"custom_medicine": "Prednisone"}]))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "Did you mean Tab Prednisolone 5mg?")
+        self.assertFalse(Prescription.objects.exists())
+
+        self.client.post(url, prescription_post_data([{"custom_medicine": "Prednisone", "keep_typed_name": "on"}]))
+
+        row = PrescriptionMedicine.objects.get()
+        self.assertNotEqual(row.medicine, prednisolone)
+        self.assertEqual(row.medicine.name, "Prednisone")
+
+    def test_untouched_saved_rows_are_not_rechecked_on_edit(self):
+        Medicine.objects.create(name="Prednisolone", form="Tab", strength="5mg")
+        prescription = Prescription.objects.create(patient=Patient.objects.create(name="Test Patient", gender="M"))
+        row = PrescriptionMedicine.objects.create(prescription=prescription, custom_medicine="Prednisone", days=5)
+
+        def edit(custom_medicine):
+            data = prescription_post_data([{"id": str(row.pk), "custom_medicine": custom_medicine}])
+            data["medicines-INITIAL_FORMS"] = "1"
+            return PrescriptionMedicineEditFormSet(data, instance=prescription)
+
+        self.assertTrue(edit("Prednisone").is_valid())
+        edited = edit("Prednizolone")
+        self.assertFalse(edited.is_valid())
+        self.assertEqual(edited.forms[0].errors.as_data()["custom_medicine"][0].code, "unconfirmed_medicine")
+
+    def test_search_suggests_close_spellings_when_nothing_matches(self):
+        response = self.client.get(reverse("api_medicine_search"), {"q": "azitromycin"})
+
+        self.assertEqual(
+            [r["text"] for r in response.json()["results"]],
+            ["Tab Azithromycin 500mg", "Syp Azithromycin 200mg/5ml"],
+        )
+
+
+class CatalogConditionalGetTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testdoctor", password="testpass123")
+        self.client.force_login(self.user)
+        self.medicine = Medicine.objects.create(name="Montelukast", form="Tab", strength="10mg")
+        self.url = reverse("api_medicines")
+
+    def test_unchanged_catalog_answers_304_without_catalog_query(self):
+        first = self.client.get(self.url)
+        self.assertEqual(first.json()[0]["name"], "Montelukast")
+
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get(self.url, HTTP_IF_NONE_MATCH=first["ETag"])
+
+        self.assertEqual(second.status_code, 304)
+        self.assertFalse([q for q in queries if "clinic_medicine" in q["sql"]])
+
+    def test_catalog_writes_change_the_etag(self):
+        etag = self.client.get(self.url)["ETag"]
+        self.medicine.strength = "5mg"
+        self.medicine.save()
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(response.json()[0]["strength"], "5mg")
+
+    def test_template_data_is_cached_per_version(self):
+        template = PrescriptionTemplate.objects.create(name="Asthma", clinical_record="Wheeze")
+        TemplateMedicine.objects.create(template=template, medicine=self.medicine, days=7)
+        url = reverse("api_template_data", args=[template.pk])
+
+        self.assertEqual(self.client.get(url).json()["medicines"][0]["medicine_id"], self.medicine.pk)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).json()["clinical_record"], "Wheeze")
+        self.assertFalse([q for q in queries if "clinic_templatemedicine" in q["sql"]])
+
+    def test_deleted_template_is_not_found_even_with_a_current_etag(self):
+        template = PrescriptionTemplate.objects.create(name="Asthma")
+        url = reverse("api_template_data", args=[template.pk])
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=self.client.get(url)["ETag"]).status_code, 304)
+
+        template.delete()
+        etag = self.client.get(self.url)["ETag"]
+
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 404)
+
+
+class ReferenceDataCacheTests(TestCase):
+    def setUp(self):
+        self.medicine = Medicine.objects.create(name="Cetirizine", form="Tab", strength="10mg")
+        LabTest.objects.create(name="CBC")
+
+    def test_unchanged_catalog_costs_one_version_query(self):
+        self.assertEqual([m.name for m in get_reference_data().medicines], ["Cetirizine"])
+
+        with CaptureQueriesContext(connection) as queries:
+            reference_data = get_reference_data()
+            self.assertEqual([m.name for m in reference_data.medicines], ["Cetirizine"])
+
+        self.assertEqual(len(queries), 1)
+        self.assertIn("clinic_counter", queries[0]["sql"])
+
+    def test_lab_test_writes_refresh_the_snapshot(self):
+        self.assertEqual([t.name for t in get_reference_data().active_lab_tests], ["CBC"])
+        LabTest.objects.create(name="LFT")
+
+        self.assertEqual(sorted(t.name for t in get_reference_data().active_lab_tests), ["CBC", "LFT"])
+        self.assertEqual(len(PrescriptionForm(reference_data=get_reference_data()).fields["tests_ordered"].choices), 2)
+
+
+class TemplateQueryCountTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testdoctor", password="testpass123")
+        self.client.force_login(self.user)
+        self.medicines = [Medicine.objects.create(name=f"Medicine {i}", form="Tab") for i in range(6)]
+
+    def make_template(self, name, medicine_count):
+        template = PrescriptionTemplate.objects.create(name=name)
+        TemplateMedicine.objects.bulk_create([
+            TemplateMedicine(template=template, medicine=medicine) for medicine in self.medicines[:medicine_count]
+        ])
+        return template
+
+    def count_queries(self, method, url, data=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url, data)
+        self.assertIn(response.status_code, (200, 302))
+        return len(queries)
+
+    def test_template_list_and_data_do_not_query_per_row(self):
+        small = self.make_template("Small", 1)
+        self.client.get(reverse("template_list"))  # warm the session and reference data
+        baseline = self.count_queries("get", reverse("template_list"))
+        data_baseline = self.count_queries("get", reverse("api_template_data", args=[small.pk]))
+
+        big = self.make_template("Big", 6)
+        self.make_template("Other", 3)
+        self.client.get(reverse("template_list"))
+        response = self.client.get(reverse("template_list"))
+
+        self.assertContains(response, "Tab Medicine 5")
+        self.assertEqual(self.count_queries("get", reverse("template_list")), baseline)
+        self.assertEqual(self.count_queries("get", reverse("api_template_data", args=[big.pk])), data_baseline)
+
+    def test_template_create_inserts_rows_in_bulk(self):
+        def post(name, count):
+            return self.count_queries("post", reverse("template_create"), {
+                "name": name,
+                "medicine_ids[]": [m.pk for m in self.medicines[:count]],
+                "mornings[]": ["0"],
+                "nights[]": [str(count - 1)],
+                "duration_choices[]": ["7"] * count,
+            })
+
+        self.assertEqual(post("One", 1), post("Six", 6))
+        rows = list(PrescriptionTemplate.objects.get(name="Six").medicines.all())
+        self.assertEqual([(r.morning, r.night, r.days) for r in rows[::5]], [(True, False, 7), (False, True, 7)])
+
+
+class PrescriptionFromTemplateTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testdoctor", password="testpass123")
+        self.doctor = Doctor.objects.create(user=self.user, name="Test Doctor")
+        self.client.force_login(self.user)
+        self.patient = Patient.objects.create(name="Test Patient", gender="M")
+        self.medicine = Medicine.objects.create(name="Montelukast", form="Tab", strength="10mg")
+
+    def make_template(self, name, rows):
+        template = PrescriptionTemplate.objects.create(
+            name=name, clinical_record="Allergic rhinitis", special_instructions="Avoid dust",
+        )
+        medicines = [self.medicine] + [
+            Medicine.objects.get_or_create(name=f"Montelukast {i}", form="Tab")[0] for i in range(1, rows)
+        ]
+        TemplateMedicine.objects.bulk_create([
+            TemplateMedicine(template=template, medicine=medicine, night=True, days=30)
+            for medicine in medicines
+        ] + [TemplateMedicine(template=template, custom_medicine="Saline spray", custom_duration="As needed")])
+        return template
+
+    def test_creates_prescription_and_redirects_to_edit(self):
+        template = self.make_template("Rhinitis", 1)
+
+        response = self.client.post(reverse("prescription_from_template", args=[self.patient.pk]), {"template": template.pk})
+
+        prescription = Prescription.objects.get(patient=self.patient)
+        self.assertRedirects(response, reverse("prescription_edit", args=[prescription.pk]))
+        self.assertEqual((prescription.doctor, prescription.clinical_record), (self.doctor, "Allergic rhinitis"))
+        self.assertEqual(prescription.other_instructions, "Avoid dust")
+        saline = Medicine.objects.get(name="Saline spray")
+        self.assertEqual(
+            [(m.medicine_id, m.custom_medicine, m.night, m.days, m.duration_choice) for m in prescription.medicines.all()],
+            [(self.medicine.pk, "", 1, 30, ""), (saline.pk, "", 0, 1, "custom")],
+        )
+        self.assertEqual(self.client.get(reverse("prescription_from_template", args=[self.patient.pk])).status_code, 405)
+
+    def test_query_count_does_not_grow_with_template_rows(self):
+        small, large = self.make_template("Small", 1), self.make_template("Large", 8)
+        url = reverse("prescription_from_template", args=[self.patient.pk])
+        self.client.post(url, {"template": small.pk})  # first visit, warm the session
+
+        counts = []
+        for template in (small, large):
+            with CaptureQueriesContext(connection) as queries:
+                self.client.post(url, {"template": template.pk})
+            counts.append(len(queries))
+
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(Prescription.objects.filter(patient=self.patient).latest("pk").medicines.count(), 9)
+
+    def test_typed_look_alike_names_can_be_saved_on_the_edit_page(self):
+        Medicine.objects.create(name="Prednisolone", form="Tab", strength="5mg")
+        template = PrescriptionTemplate.objects.create(name="Steroid taper")
+        TemplateMedicine.objects.create(template=template, custom_medicine="Prednisone", days=5)
+
+        self.client.post(reverse("prescription_from_template", args=[self.patient.pk]), {"template": template.pk})
+
+        prescription = Prescription.objects.get(patient=self.patient)
+        row = prescription.medicines.get()
+        self.assertEqual((row.medicine.name, row.custom_medicine), ("Prednisone", ""))
+
+
 class MedicineFormChoicesTests(TestCase):
     def test_medicine_form_includes_new_form_choices(self):
         form = MedicineForm()
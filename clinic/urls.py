@@ -33,8 +33,11 @@ urlpatterns = [
     path('prescriptions/<int:pk>/', views.prescription_detail, name='prescription_detail'),
     path('prescriptions/<int:pk>/edit/', views.prescription_edit, name='prescription_edit'),
     path('prescriptions/<int:pk>/print/', views.prescription_print, name='prescription_print'),
+    path('prescriptions/print/', views.prescription_batch_print, name='prescription_batch_print'),
+    path('prescriptions/<int:pk>/pdf/', views.prescription_pdf, name='prescription_pdf'),
     path('prescriptions/<int:pk>/delete/', views.prescription_delete, name='prescription_delete'),
     path('prescriptions/<int:pk>/duplicate/', views.prescription_duplicate, name='prescription_duplicate'),
+    path('prescriptions/<int:patient_id>/from-template/', views.prescription_from_template, name='prescription_from_template'),
     
     # Template URLs
     path('templates/', views.template_list, name='template_list'),
@@ -43,6 +46,9 @@ urlpatterns = [
     
     # API URLs
     path('api/medicines/', views.api_medicines, name='api_medicines'),
+    path('api/medicines/search/', views.api_medicine_search, name='api_medicine_search'),
+    path('api/patients/', views.api_patient_list, name='api_patient_list'),
     path('api/patients/search/', views.api_patient_search, name='api_patient_search'),
     path('api/templates/<int:pk>/', views.api_template_data, name='api_template_data'),
+    path('api/analytics/timeseries/', views.api_analytics_timeseries, name='api_analytics_timeseries'),
 ]
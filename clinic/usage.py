@@ -0,0 +1,183 @@
+"""
+Medicine and lab test usage counters by day.
+
+Ranking medicines by popularity used to be a GROUP BY over every
+PrescriptionMedicine row in the window. MedicineUsage keeps that answer
+pre-aggregated: one bucket per (medicine, doctor, day) holding how often
+the doctor prescribed it that day, plus one per (medicine, day) with no
+doctor for the whole clinic. A top-N over any window reads at most one
+bucket per medicine per day through the bucket's unique index.
+LabTestUsage does the same for ordered lab tests.
+
+The buckets are moved incrementally by clinic/signals.py (medicine rows
+saved or deleted one at a time, lab tests added or removed, prescriptions
+whose doctor or date changes, prescription deletes) and by the bulk
+writers in clinic/services.py, which send no signals and call
+record_medicine_usage() / record_lab_test_usage() themselves. Other bulk
+writes leave the counters behind; run `python manage.py
+reconcile_medicine_usage` or `rebuild_rollups` to recompute them.
+"""
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, F, Sum
+
+from .models import (
+    LabTestUsage, MedicineUsage, Prescription, PrescriptionMedicine, get_current_local_date,
+)
+
+
+# Column holding the counted item in each usage table
+USAGE_ITEM_FIELDS = {MedicineUsage: 'medicine_id', LabTestUsage: 'lab_test_id'}
+
+
+def usage_delta(rows, sign=1):
+    """
+    Bucket changes for (item_id, doctor_id, day) uses, each counted in the
+    doctor's bucket and the clinic-wide one. Rows without an item (typed
+    medicines not in the catalog) are skipped.
+    """
+    delta = Counter()
+    for item_id, doctor_id, day in rows:
+        if item_id is None:
+            continue
+        delta[(item_id, None, day)] += sign
+        if doctor_id is not None:
+            delta[(item_id, doctor_id, day)] += sign
+    return delta
+
+
+def apply_usage_delta(delta, model=MedicineUsage):
+    """
+    Add `delta` ({(item_id, doctor_id, day): n}) to the buckets of `model`
+    (MedicineUsage or LabTestUsage): one insert for missing buckets plus
+    one UPDATE per (doctor, day, n) group.
+    """
+    item = USAGE_ITEM_FIELDS[model]
+    groups = defaultdict(list)
+    for (item_id, doctor_id, day), n in delta.items():
+        if n:
+            groups[(doctor_id, day, n)].append(item_id)
+    if not groups:
+        return
+
+    with transaction.atomic():
+        new_buckets = [
+            model(**{item: item_id}, doctor_id=doctor_id, day=day, count=0)
+            for (doctor_id, day, n), item_ids in groups.items() if n > 0
+            for item_id in item_ids
+        ]
+        if new_buckets:
+            model.objects.bulk_create(new_buckets, ignore_conflicts=True)
+        for (doctor_id, day, n), item_ids in groups.items():
+            buckets = model.objects.filter(**{f'{item}__in': item_ids}, doctor_id=doctor_id, day=day)
+            if n < 0:
+                buckets = buckets.filter(count__gte=-n)
+            buckets.update(count=F('count') + n)
+
+
+def record_medicine_usage(prescription, rows, sign=1):
+    """Count (or with sign=-1 uncount) medicine `rows` written for `prescription`."""
+    apply_usage_delta(usage_delta(
+        ((row.medicine_id, prescription.doctor_id, prescription.date) for row in rows), sign,
+    ))
+
+
+def record_lab_test_usage(rows, sign=1):
+    """Count (or with sign=-1 uncount) lab test orders given as (lab_test_id, doctor_id, day)."""
+    apply_usage_delta(usage_delta(rows, sign), LabTestUsage)
+
+
+def ordered_lab_tests(prescription_ids):
+    """(lab_test_id, doctor_id, day) for every lab test ordered on the given prescriptions."""
+    return Prescription.tests_ordered.through.objects.filter(prescription_id__in=prescription_ids).values_list(
+        'labtest_id', 'prescription__doctor_id', 'prescription__date'
+    )
+
+
+def move_prescription_usage(prescription_pk, old_key, new_key):
+    """
+    Move a prescription's medicines and lab tests from the (doctor_id, day)
+    buckets `old_key` to `new_key`.
+    """
+    if old_key == new_key:
+        return
+    items = {
+        MedicineUsage: PrescriptionMedicine.objects.filter(
+            prescription_id=prescription_pk, medicine__isnull=False
+        ).values_list('medicine_id', flat=True),
+        LabTestUsage: Prescription.tests_ordered.through.objects.filter(
+            prescription_id=prescription_pk
+        ).values_list('labtest_id', flat=True),
+    }
+    for model, item_ids in items.items():
+        item_ids = list(item_ids)
+        delta = usage_delta(((item_id, *old_key) for item_id in item_ids), -1)
+        delta.update(usage_delta((item_id, *new_key) for item_id in item_ids))
+        apply_usage_delta(delta, model)
+
+
+def top_medicines(days=30, doctor=None, limit=5, today=None):
+    """
+    The `limit` most prescribed medicines over the last `days` days, by
+    `doctor` or clinic-wide, as dicts with medicine__name, medicine__form
+    and count.
+    """
+    since = (today or get_current_local_date()) - timedelta(days=days)
+    buckets = MedicineUsage.objects.filter(day__gte=since)
+    buckets = buckets.filter(doctor=doctor) if doctor is not None else buckets.filter(doctor__isnull=True)
+    return list(
+        buckets.values('medicine_id', 'medicine__name', 'medicine__form')
+        .annotate(count=Sum('count'))
+        .filter(count__gt=0)
+        .order_by('-count', 'medicine__name')[:limit]
+    )
+
+
+def reconcile_medicine_usage(since=None):
+    """
+    Recompute the buckets (from day `since` on, or all of them) from the
+    prescriptions and fix the ones that drifted. Returns how many buckets
+    were corrected.
+    """
+    rows = PrescriptionMedicine.objects.filter(medicine__isnull=False)
+    stored = MedicineUsage.objects.all()
+    if since:
+        rows = rows.filter(prescription__date__gte=since)
+        stored = stored.filter(day__gte=since)
+
+    expected = Counter()
+    grouped = (
+        rows.values('medicine_id', 'prescription__doctor_id', 'prescription__date')
+        .annotate(uses=Count('id'))
+        .values_list('medicine_id', 'prescription__doctor_id', 'prescription__date', 'uses')
+        .order_by()
+    )
+    for medicine_id, doctor_id, day, uses in grouped:
+        expected[(medicine_id, None, day)] += uses
+        if doctor_id is not None:
+            expected[(medicine_id, doctor_id, day)] += uses
+
+    with transaction.atomic():
+        wrong = []
+        seen = set()
+        for pk, medicine_id, doctor_id, day, count in stored.values_list(
+            'pk', 'medicine_id', 'doctor_id', 'day', 'count'
+        ).iterator(chunk_size=2000):
+            key = (medicine_id, doctor_id, day)
+            seen.add(key)
+            if count != expected.get(key, 0):
+                wrong.append((pk, key))
+
+        missing = [key for key in expected if key not in seen]
+        MedicineUsage.objects.filter(pk__in=[pk for pk, _ in wrong]).delete()
+        rewrite = [key for _, key in wrong if expected.get(key)] + missing
+        MedicineUsage.objects.bulk_create(
+            [
+                MedicineUsage(medicine_id=key[0], doctor_id=key[1], day=key[2], count=expected[key])
+                for key in rewrite
+            ],
+            batch_size=1000,
+        )
+    return len(wrong) + len(missing)
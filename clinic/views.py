@@ -1,12 +1,36 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.db.models import Q, Count, ProtectedError
+from django.urls import reverse
+from django.db import DatabaseError, transaction
+from django.db.models import Q, Count, Prefetch, ProtectedError
 from django.contrib import messages
-from django.http import JsonResponse, HttpResponseNotAllowed
+from django.http import (
+    FileResponse, Http404, HttpResponse, HttpResponseBadRequest, HttpResponseNotAllowed, JsonResponse,
+    StreamingHttpResponse,
+)
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
+from django.template.loader import get_template, render_to_string
 from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_POST
 from datetime import timedelta
-from .models import Patient, Medicine, Prescription, PrescriptionMedicine, LabTest, Doctor, PrescriptionTemplate, TemplateMedicine
+from .models import (
+    Patient, Medicine, Prescription, PrescriptionMedicine, LabTest, Doctor, PrescriptionTemplate, TemplateMedicine,
+    get_current_local_date,
+)
+from .analytics import BUCKETS, DEFAULT_MEDICINES, MAX_BUCKETS, MAX_MEDICINES, bucket_starts, cached_timeseries
+from .catalog import cached_catalog_json, get_catalog_version, search_medicines
+from .diagnoses import recent_diagnoses
+from .duplicates import find_duplicate_candidates
+from .pagination import keyset_paginate, parse_page_size
+from .pdf import PdfTimeout, PdfUnavailable, render_pdf, render_prescription_pdf
+from .refdata import get_reference_data, template_medicines
+from .print_cache import PRINT_SLIP_TEMPLATE, render_prescription_print
+from .search import search_patients
+from .stats import dashboard_stats
+from .services import clone_prescription, create_prescription_from_template, save_medicine_formset
+from .usage import top_medicines as get_top_medicines
 from .forms import (
     PatientForm,
     MedicineForm,
@@ -69,7 +93,14 @@ COMMON_DIAGNOSES = [
 
 
 def get_recent_diagnoses(limit=20):
-    """Return up to `limit` recent unique diagnoses plus common diagnoses for quick selection."""
+    """
+    Return the common diagnoses followed by up to `limit` recently used
+    ones not already listed, without duplicates or blanks.
+
+    `limit` only caps the recent diagnoses. (It used to cap the combined
+    list, which stopped after the first 20 common diagnoses and never
+    reached the recent ones.)
+    """
     # Common diagnoses list
     common_diagnoses = [
         'Acute Respiratory Infection',
@@ -179,14 +210,13 @@ def get_recent_diagnoses(limit=20):
     # Add common diagnoses first
     for diag in common_diagnoses:
         key = diag.lower()
+        if not key or key in seen:
+            continue
         seen.add(key)
         unique_diagnoses.append(diag)
     
-    # Then add recent diagnoses from database
-    diagnoses = Prescription.objects.exclude(diagnosis__isnull=True).exclude(diagnosis__exact='')\
-        .order_by('-updated_at').values_list('diagnosis', flat=True)
-
-    for diag in diagnoses:
+    # Then add recent diagnoses from the usage table (indexed top-N query)
+    for diag in recent_diagnoses(limit):
         normalized = diag.strip()
         if not normalized:
             continue
@@ -198,10 +228,7 @@ def get_recent_diagnoses(limit=20):
         seen.add(key)
         unique_diagnoses.append(normalized)
 
-        if len(unique_diagnoses) >= limit:
-            break
-
-    return unique_diagnoses[:limit]
+    return unique_diagnoses
 
 
 def get_diagnosis_options():
@@ -406,27 +433,15 @@ def profile_view(request):
 @login_required
 def dashboard(request):
     """Dashboard with statistics and quick actions"""
-    today = timezone.now().date()
-    week_ago = today - timedelta(days=7)
-    month_ago = today - timedelta(days=30)
-    
-    # Basic stats
-    stats = {
-        'total_patients': Patient.objects.count(),
-        'total_prescriptions': Prescription.objects.count(),
-        'total_medicines': Medicine.objects.filter(is_active=True).count(),
-        'today_patients': Prescription.objects.filter(date=today).values('patient').distinct().count(),
-        'today_prescriptions': Prescription.objects.filter(date=today).count(),
-        'week_prescriptions': Prescription.objects.filter(date__gte=week_ago).count(),
-        'month_prescriptions': Prescription.objects.filter(date__gte=month_ago).count(),
-    }
+    today = get_current_local_date()  # prescription dates are local
+    reference_data = get_reference_data()
+    
+    # Basic stats from the DailyStats summary rows, in one query
+    stats = dashboard_stats(today)
+    stats['total_medicines'] = len(reference_data.medicines)
     
     # Top prescribed medicines (last 30 days)
-    top_medicines = PrescriptionMedicine.objects.filter(
-        prescription__date__gte=month_ago
-    ).exclude(medicine__isnull=True).values(
-        'medicine__name', 'medicine__form'
-    ).annotate(count=Count('id')).order_by('-count')[:5]
+    top_medicines = get_top_medicines(days=30, limit=5, today=today)
     
     # Recent patients
     recent_patients = Patient.objects.all()[:5]
@@ -435,7 +450,7 @@ def dashboard(request):
     recent_prescriptions = Prescription.objects.select_related('patient').all()[:5]
     
     # Get templates for quick access
-    templates = PrescriptionTemplate.objects.filter(is_active=True)[:5]
+    templates = reference_data.templates[:5]
     
     return render(request, 'clinic/dashboard.html', {
         'stats': stats,
@@ -455,18 +470,34 @@ def home(request):
 
 # ============ Patient Views ============
 
+# Only the columns the patient card renders (plus the keyset columns)
+PATIENT_CARD_FIELDS = ('id', 'patient_id', 'name', 'gender', 'age', 'created_at')
+
+
+def get_patient_page(request):
+    """Return one keyset page of patients, newest first, for the list views."""
+    patients = Patient.objects.only(*PATIENT_CARD_FIELDS)
+    return keyset_paginate(
+        patients,
+        ('created_at', 'id'),
+        cursor=request.GET.get('cursor'),
+        page_size=parse_page_size(request.GET.get('page_size')),
+    )
+
+
 @login_required
 def patient_list(request):
-    """List all patients"""
-    patients = Patient.objects.all()
-    return render(request, 'clinic/patient_list.html', {'patients': patients})
+    """List patients one keyset page at a time (more pages load on scroll)"""
+    page = get_patient_page(request)
+    return render(request, 'clinic/patient_list.html', {
+        'patients': page.items,
+        'next_cursor': page.next_cursor,
+    })
 
 
 @login_required
 def patient_create(request):
     """Create a new patient with duplicate detection"""
-    existing_patients = []
-    
     if request.method == 'POST':
         form = PatientForm(request.POST)
         
@@ -477,23 +508,15 @@ def patient_create(request):
             name = form.cleaned_data.get('name', '')
             phone = form.cleaned_data.get('phone', '')
             
-            # Check for potential duplicates (by name or phone)
-            if name or phone:
-                query = Q()
-                if name:
-                    # Check for similar names (case-insensitive)
-                    query |= Q(name__iexact=name) | Q(name__icontains=name)
-                if phone:
-                    query |= Q(phone=phone)
-                
-                existing_patients = Patient.objects.filter(query).distinct()[:5]
+            # Check for potential duplicates (phonetic name key or phone)
+            duplicate_candidates = find_duplicate_candidates(name, phone)
             
             # If duplicates found and user hasn't confirmed, show warning
-            if existing_patients.exists() and not confirm_new:
+            if duplicate_candidates and not confirm_new:
                 return render(request, 'clinic/patient_form.html', {
                     'form': form,
                     'title': 'Add New Patient',
-                    'existing_patients': existing_patients,
+                    'duplicate_candidates': duplicate_candidates,
                     'show_duplicate_warning': True,
                 })
             
@@ -522,28 +545,43 @@ def patient_edit(request, pk):
     return render(request, 'clinic/patient_form.html', {'form': form, 'title': 'Edit Patient', 'patient': patient})
 
 
+VISIT_HISTORY_PAGE_SIZE = 20
+
+
 @login_required
 def patient_detail(request, pk):
     """View patient details with prescription history"""
     patient = get_object_or_404(Patient, pk=pk)
-    prescriptions = patient.prescriptions.all()
+    prescriptions = patient.prescriptions.only(
+        'id', 'patient_id', 'date', 'created_at', 'is_first_visit', 'clinical_record'
+    ).annotate(medicine_count=Count('medicines'))
+    page = keyset_paginate(
+        prescriptions,
+        ('date', 'created_at', 'id'),
+        cursor=request.GET.get('cursor'),
+        page_size=parse_page_size(request.GET.get('page_size'), default=VISIT_HISTORY_PAGE_SIZE),
+    )
     return render(request, 'clinic/patient_detail.html', {
         'patient': patient,
-        'prescriptions': prescriptions,
+        'prescriptions': page.items,
+        'next_cursor': page.next_cursor,
+        'is_first_page': not request.GET.get('cursor'),
+        'total_visits': patient.prescriptions.count(),
+        'templates': get_reference_data().templates,
     })
 
 
+# The search page shows more matches than the AJAX dropdown
+PATIENT_SEARCH_PAGE_LIMIT = 50
+
+
 @login_required
 def patient_search(request):
     """Search for patients"""
     query = request.GET.get('q', '')
     patients = []
     if query:
-        patients = Patient.objects.filter(
-            Q(patient_id__icontains=query) |
-            Q(name__icontains=query) |
-            Q(phone__icontains=query)
-        )
+        patients = search_patients(query, limit=PATIENT_SEARCH_PAGE_LIMIT)
     return render(request, 'clinic/patient_search.html', {'patients': patients, 'query': query})
 
 
@@ -614,66 +652,39 @@ def medicine_delete(request, pk):
 def prescription_create(request, patient_id):
     """Create a prescription for a patient"""
     patient = get_object_or_404(Patient, pk=patient_id)
-    lab_tests = LabTest.objects.filter(is_active=True)
-    templates = PrescriptionTemplate.objects.filter(is_active=True)
+    reference_data = get_reference_data()
     
     if request.method == 'POST':
-        form = PrescriptionForm(request.POST)
+        form = PrescriptionForm(request.POST, reference_data=reference_data)
         formset = PrescriptionMedicineFormSet(request.POST)
         
         if form.is_valid() and formset.is_valid():
-            prescription = form.save(commit=False)
-            prescription.patient = patient
-            
-            # Link to doctor if logged in and has doctor profile
-            if request.user.is_authenticated:
-                try:
-                    prescription.doctor = request.user.doctor
-                except Doctor.DoesNotExist:
-                    pass
-            
-            # Check if this is not the first visit
-            if patient.prescriptions.exists():
-                prescription.is_first_visit = False
-            
-            prescription.save()
-            form.save_m2m()  # Save many-to-many relationships (tests_ordered)
-            
-            # Link the formset to the prescription and process medicines
-            formset.instance = prescription
-            
             try:
-                # Auto-save custom medicines to database for future use
-                for medicine_form in formset:
-                    if medicine_form.cleaned_data and not medicine_form.cleaned_data.get('DELETE', False):
-                        custom_med_name = medicine_form.cleaned_data.get('custom_medicine', '').strip()
-                        selected_medicine = medicine_form.cleaned_data.get('medicine')
-                        
-                        # If custom medicine is provided and no dropdown selection
-                        if custom_med_name and not selected_medicine:
-                            # Try to find existing medicine with this name
-                            existing_med = Medicine.objects.filter(name__iexact=custom_med_name).first()
-                            
-                            if not existing_med:
-                                # Create new medicine in database
-                                existing_med = Medicine.objects.create(
-                                    name=custom_med_name,
-                                    form='Tab',  # Default form
-                                    is_active=True
-                                )
-                            
-                            # Update the form instance to link to this medicine
-                            medicine_form.instance.medicine = existing_med
-                            medicine_form.instance.custom_medicine = ''  # Clear custom field since we linked it
-                
-                formset.save()
-                
+                with transaction.atomic():
+                    prescription = form.save(commit=False)
+                    prescription.patient = patient
+                    
+                    # Link to doctor if logged in and has doctor profile
+                    if request.user.is_authenticated:
+                        try:
+                            prescription.doctor = request.user.doctor
+                        except Doctor.DoesNotExist:
+                            pass
+                    
+                    # Check if this is not the first visit
+                    if patient.prescriptions.exists():
+                        prescription.is_first_visit = False
+                    
+                    prescription.save()
+                    form.save_m2m()  # Save many-to-many relationships (tests_ordered)
+                    
+                    # Link typed custom medicines to the catalog and bulk insert all rows
+                    save_medicine_formset(formset, prescription)
+            except DatabaseError as e:
+                messages.error(request, f'Error saving prescription: {str(e)}')
+            else:
                 messages.success(request, 'Prescription created successfully.')
                 return redirect('prescription_detail', pk=prescription.pk)
-            except Exception as e:
-                messages.error(request, f'Error saving medicines: {str(e)}')
-                # Delete the prescription if medicine saving failed
-                prescription.delete()
         else:
             # Form or formset has errors - don't save anything
             formset = PrescriptionMedicineFormSet(request.POST)
@@ -687,18 +698,15 @@ def prescription_create(request, patient_id):
         else:
             initial['is_first_visit'] = False
         
-        form = PrescriptionForm(initial=initial)
+        form = PrescriptionForm(initial=initial, reference_data=reference_data)
         formset = PrescriptionMedicineFormSet()
     
-    medicines = Medicine.objects.filter(is_active=True)
-    
     return render(request, 'clinic/prescription_form.html', {
         'form': form,
         'formset': formset if 'formset' in dir() else PrescriptionMedicineFormSet(),
         'patient': patient,
-        'medicines': medicines,
-        'lab_tests': lab_tests,
-        'templates': templates,
+        'lab_tests': reference_data.active_lab_tests,
+        'templates': reference_data.templates,
         'diagnosis_options': get_diagnosis_options(),
         'title': 'New Prescription',
     })
@@ -714,8 +722,103 @@ def prescription_detail(request, pk):
 @login_required
 def prescription_print(request, pk):
     """Print-friendly prescription view"""
-    prescription = get_object_or_404(Prescription, pk=pk)
-    return render(request, 'clinic/prescription_print.html', {'prescription': prescription})
+    try:
+        html = render_prescription_print(pk)
+    except Prescription.DoesNotExist:
+        raise Http404('No Prescription matches the given query.')
+    return HttpResponse(html)
+
+
+@login_required
+def prescription_pdf(request, pk):
+    """Download a prescription as a server-rendered PDF"""
+    try:
+        path = render_prescription_pdf(pk)
+    except Prescription.DoesNotExist:
+        raise Http404('No Prescription matches the given query.')
+    except PdfUnavailable as e:
+        return HttpResponse(str(e), status=503, content_type='text/plain')
+    except PdfTimeout as e:
+        return HttpResponse(str(e), status=504, content_type='text/plain')
+    return FileResponse(
+        open(path, 'rb'),
+        content_type='application/pdf',
+        filename=f'prescription-{pk}.pdf',
+    )
+
+
+BATCH_PRINT_CHUNK_SIZE = 100
+# A batch PDF is rendered in one piece under PRESCRIPTION_PDF_TIMEOUT;
+# bigger selections are refused (the streamed HTML has no limit)
+BATCH_PRINT_PDF_LIMIT = 40
+BATCH_PRINT_END = '</body>\n\n</html>\n'
+
+
+def get_batch_print_queryset(request):
+    """
+    Prescriptions selected by ?ids=1,2,3 or ?date_from=&date_to= (either
+    date alone means that single day), in visit order. Raises ValueError
+    for a missing or malformed selection.
+    """
+    queryset = Prescription.objects.all()
+    if request.GET.get('ids'):
+        ids = [int(pk) for pk in request.GET['ids'].split(',') if pk.strip()]
+        queryset = queryset.filter(pk__in=ids)
+    else:
+        date_from = parse_date(request.GET.get('date_from') or request.GET.get('date_to') or '')
+        date_to = parse_date(request.GET.get('date_to') or request.GET.get('date_from') or '')
+        if date_from is None or date_to is None:
+            raise ValueError('Pass ?ids=1,2,3 or ?date_from=YYYY-MM-DD&date_to=YYYY-MM-DD.')
+        queryset = queryset.filter(date__range=(date_from, date_to))
+    return queryset.order_by('date', 'time', 'created_at', 'id')
+
+
+def stream_batch_print(queryset):
+    """
+    Yield one print document for every prescription in `queryset`, one slip
+    at a time. Rows are read in chunks of BATCH_PRINT_CHUNK_SIZE with three
+    queries per chunk, so memory stays flat however many slips there are.
+    """
+    count = queryset.count()
+    yield render_to_string('clinic/prescription_batch_print.html', {
+        'title': f'{count} Prescriptions',
+        'count': count,
+    })
+    slip = get_template(PRINT_SLIP_TEMPLATE)
+    prescriptions = queryset.select_related('patient').prefetch_related(
+        Prefetch('medicines', queryset=PrescriptionMedicine.objects.select_related('medicine')),
+        'tests_ordered',
+    )
+    for prescription in prescriptions.iterator(chunk_size=BATCH_PRINT_CHUNK_SIZE):
+        yield slip.render({'prescription': prescription})
+    yield BATCH_PRINT_END
+
+
+@login_required
+def prescription_batch_print(request):
+    """Print many prescriptions as one document, streamed (?format=pdf for a PDF of up to BATCH_PRINT_PDF_LIMIT)"""
+    try:
+        queryset = get_batch_print_queryset(request)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+
+    if request.GET.get('format') == 'pdf':
+        # The PDF renderer needs the whole document, so this one isn't streamed
+        count = queryset.count()
+        if count > BATCH_PRINT_PDF_LIMIT:
+            return HttpResponseBadRequest(
+                f'{count} prescriptions selected; a PDF can hold at most {BATCH_PRINT_PDF_LIMIT}. '
+                'Narrow the selection or print the HTML version.'
+            )
+        try:
+            path = render_pdf(''.join(stream_batch_print(queryset)))
+        except PdfUnavailable as e:
+            return HttpResponse(str(e), status=503, content_type='text/plain')
+        except PdfTimeout as e:
+            return HttpResponse(str(e), status=504, content_type='text/plain')
+        return FileResponse(open(path, 'rb'), content_type='application/pdf', filename='prescriptions.pdf')
+
+    return StreamingHttpResponse(stream_batch_print(queryset), content_type='text/html; charset=utf-8')
 
 
 @login_required
@@ -723,11 +826,10 @@ def prescription_edit(request, pk):
     """Edit an existing prescription"""
     prescription = get_object_or_404(Prescription, pk=pk)
     patient = prescription.patient
-    lab_tests = LabTest.objects.filter(is_active=True)
-    templates = PrescriptionTemplate.objects.filter(is_active=True)
+    reference_data = get_reference_data()
     
     if request.method == 'POST':
-        form = PrescriptionForm(request.POST, instance=prescription)
+        form = PrescriptionForm(request.POST, instance=prescription, reference_data=reference_data)
         formset = PrescriptionMedicineEditFormSet(request.POST, instance=prescription)
         
         if form.is_valid() and formset.is_valid():
@@ -736,19 +838,16 @@ def prescription_edit(request, pk):
             messages.success(request, 'Prescription updated successfully.')
             return redirect('prescription_detail', pk=prescription.pk)
     else:
-        form = PrescriptionForm(instance=prescription)
+        form = PrescriptionForm(instance=prescription, reference_data=reference_data)
         formset = PrescriptionMedicineEditFormSet(instance=prescription)
     
-    medicines = Medicine.objects.filter(is_active=True)
-    
     return render(request, 'clinic/prescription_form.html', {
         'form': form,
         'formset': formset,
         'patient': patient,
         'prescription': prescription,
-        'medicines': medicines,
-        'lab_tests': lab_tests,
-        'templates': templates,
+        'lab_tests': reference_data.active_lab_tests,
+        'templates': reference_data.templates,
         'diagnosis_options': get_diagnosis_options(),
         'title': 'Edit Prescription',
     })
@@ -773,58 +872,38 @@ def prescription_duplicate(request, pk):
     """Duplicate an existing prescription"""
     original = get_object_or_404(Prescription, pk=pk)
     
-    # Create new prescription with same data
-    new_prescription = Prescription.objects.create(
-        patient=original.patient,
-        doctor=original.doctor,
-        date=timezone.now().date(),
-        clinical_record=original.clinical_record,
-        dm=original.dm,
-        htn=original.htn,
-        ihd=original.ihd,
-        tb=original.tb,
-        smoking=original.smoking,
-        is_first_visit=False,
-        pulse=original.pulse,
-        spo2=original.spo2,
-        blood_pressure=original.blood_pressure,
-        sugar=original.sugar,
-        temperature=original.temperature,
-        respiratory_rate=original.respiratory_rate,
-        other_vitals=original.other_vitals,
-        chest_notes=original.chest_notes,
-        special_instructions=original.special_instructions,
-        follow_up=original.follow_up,
-    )
-    
-    # Copy tests ordered
-    new_prescription.tests_ordered.set(original.tests_ordered.all())
-    
-    # Copy medicines
-    for med in original.medicines.all():
-        PrescriptionMedicine.objects.create(
-            prescription=new_prescription,
-            medicine=med.medicine,
-            custom_medicine=med.custom_medicine,
-            dosage=med.dosage,
-            morning=med.morning,
-            afternoon=med.afternoon,
-            evening=med.evening,
-            night=med.night,
-            days=med.days,
-            instructions=med.instructions,
-        )
+    # Copy every field, lab test and medicine row in one transaction
+    new_prescription = clone_prescription(original)
     
     messages.success(request, 'Prescription duplicated successfully. You can now edit it.')
     return redirect('prescription_edit', pk=new_prescription.pk)
 
 
+@login_required
+@require_POST
+def prescription_from_template(request, patient_id):
+    """Create a prescription straight from the POSTed template and open it for editing"""
+    patient = get_object_or_404(Patient, pk=patient_id)
+    template_pk = request.POST.get('template', '')
+    if not template_pk.isdigit():
+        messages.error(request, 'Select a template to prescribe from.')
+        return redirect('patient_detail', pk=patient.pk)
+    template = get_object_or_404(PrescriptionTemplate, pk=template_pk, is_active=True)
+    
+    prescription = create_prescription_from_template(
+        template, patient, doctor=getattr(request.user, 'doctor', None),
+    )
+    
+    messages.success(request, f'Prescription started from "{template.name}". Review and save it.')
+    return redirect('prescription_edit', pk=prescription.pk)
+
+
 # ============ Template Views ============
 
 @login_required
 def template_list(request):
     """List all prescription templates"""
-    templates = PrescriptionTemplate.objects.filter(is_active=True)
+    templates = get_reference_data().templates
     return render(request, 'clinic/template_list.html', {'templates': templates})
 
 
@@ -845,59 +924,65 @@ def template_create(request):
             except Doctor.DoesNotExist:
                 pass
         
-        template = PrescriptionTemplate.objects.create(
-            name=name,
-            description=description,
-            doctor=doctor,
-            clinical_record=clinical_record,
-            special_instructions=special_instructions,
-        )
-        
-        # Add medicines from POST data
-        medicine_ids = request.POST.getlist('medicine_ids[]')
-        dosages = request.POST.getlist('dosages[]')
-        mornings = request.POST.getlist('mornings[]')
-        afternoons = request.POST.getlist('afternoons[]')
-        evenings = request.POST.getlist('evenings[]')
-        nights = request.POST.getlist('nights[]')
-        duration_choices = request.POST.getlist('duration_choices[]')
-        custom_durations = request.POST.getlist('custom_durations[]')
-        days_list = request.POST.getlist('days[]')
-        
-        for i, med_id in enumerate(medicine_ids):
-            if med_id:
-                duration_choice = duration_choices[i] if i < len(duration_choices) else ''
-                custom_duration = custom_durations[i].strip() if i < len(custom_durations) else ''
-                
-                # Determine days based on selection; fall back to numeric days input
-                days_value = 1
-                if duration_choice and duration_choice != 'custom':
-                    try:
-                        days_value = int(duration_choice)
-                    except ValueError:
-                        days_value = 1
-                else:
-                    try:
-                        days_value = int(days_list[i]) if i < len(days_list) and days_list[i] else 1
-                    except (ValueError, IndexError):
-                        days_value = 1
-                
-                TemplateMedicine.objects.create(
-                    template=template,
-                    medicine_id=int(med_id) if med_id else None,
-                    dosage=dosages[i] if i < len(dosages) else '',
-                    morning=str(i) in mornings,
-                    afternoon=str(i) in afternoons,
-                    evening=str(i) in evenings,
-                    night=str(i) in nights,
-                    days=days_value,
-                    custom_duration=custom_duration if duration_choice == 'custom' else '',
-                )
+        with transaction.atomic():
+            template = PrescriptionTemplate.objects.create(
+                name=name,
+                description=description,
+                doctor=doctor,
+                clinical_record=clinical_record,
+                special_instructions=special_instructions,
+            )
+            
+            # Add medicines from POST data
+            medicine_ids = request.POST.getlist('medicine_ids[]')
+            dosages = request.POST.getlist('dosages[]')
+            mornings = set(request.POST.getlist('mornings[]'))
+            afternoons = set(request.POST.getlist('afternoons[]'))
+            evenings = set(request.POST.getlist('evenings[]'))
+            nights = set(request.POST.getlist('nights[]'))
+            duration_choices = request.POST.getlist('duration_choices[]')
+            custom_durations = request.POST.getlist('custom_durations[]')
+            days_list = request.POST.getlist('days[]')
+            
+            rows = []
+            for i, med_id in enumerate(medicine_ids):
+                if med_id:
+                    duration_choice = duration_choices[i] if i < len(duration_choices) else ''
+                    custom_duration = custom_durations[i].strip() if i < len(custom_durations) else ''
+                    
+                    # Determine days based on selection; fall back to numeric days input
+                    days_value = 1
+                    if duration_choice and duration_choice != 'custom':
+                        try:
+                            days_value = int(duration_choice)
+                        except ValueError:
+                            days_value = 1
+                    else:
+                        try:
+                            days_value = int(days_list[i]) if i < len(days_list) and days_list[i] else 1
+                        except (ValueError, IndexError):
+                            days_value = 1
+                    
+                    rows.append(TemplateMedicine(
+                        template=template,
+                        medicine_id=int(med_id) if med_id else None,
+                        dosage=dosages[i] if i < len(dosages) else '',
+                        morning=str(i) in mornings,
+                        afternoon=str(i) in afternoons,
+                        evening=str(i) in evenings,
+                        night=str(i) in nights,
+                        days=days_value,
+                        custom_duration=custom_duration if duration_choice == 'custom' else '',
+                    ))
+            
+            # One insert for all rows; the template's own save already bumped the
+            # catalog version inside this transaction (bulk_create sends no signals)
+            TemplateMedicine.objects.bulk_create(rows)
         
         messages.success(request, f'Template "{template.name}" created successfully.')
         return redirect('template_list')
     
-    medicines = Medicine.objects.filter(is_active=True)
+    medicines = get_reference_data().medicines
     return render(request, 'clinic/template_form.html', {
         'title': 'Create Template',
         'medicines': medicines,
@@ -916,27 +1001,99 @@ def template_delete(request, pk):
 
 # ============ API Views ============
 
+def request_catalog_version(request):
+    """Catalog (version, last modified), read once per request."""
+    if not hasattr(request, '_catalog_version'):
+        request._catalog_version = get_catalog_version()
+    return request._catalog_version
+
+
+def catalog_etag(request, *args, **kwargs):
+    return f'catalog-{request_catalog_version(request)[0]}'
+
+
+def catalog_last_modified(request, *args, **kwargs):
+    return request_catalog_version(request)[1]
+
+
+# Unchanged catalog: 304 Not Modified after a single Counter read
+catalog_conditional = condition(etag_func=catalog_etag, last_modified_func=catalog_last_modified)
+
+
+@cache_control(no_cache=True)
+@catalog_conditional
 def api_medicines(request):
     """API endpoint for medicine list (for AJAX)"""
-    medicines = Medicine.objects.filter(is_active=True).values('id', 'name', 'form', 'strength')
-    return JsonResponse(list(medicines), safe=False)
+    body = cached_catalog_json('medicines', request_catalog_version(request)[0], lambda: list(
+        Medicine.objects.filter(is_active=True).values('id', 'name', 'form', 'strength')
+    ))
+    return HttpResponse(body, content_type='application/json')
+
+
+MEDICINE_SEARCH_PAGE_SIZE = 20
+
+
+@login_required
+def api_medicine_search(request):
+    """Medicine typeahead for Select2 remote data mode (?q=&cursor=&page_size=)"""
+    query = request.GET.get('q', '')
+    cursor = request.GET.get('cursor') or None
+    page_size = parse_page_size(request.GET.get('page_size'), default=MEDICINE_SEARCH_PAGE_SIZE)
+    medicines, next_cursor = search_medicines(
+        query,
+        doctor=getattr(request.user, 'doctor', None),
+        cursor=cursor,
+        page_size=page_size,
+    )
+    if not medicines and not cursor and query.strip():
+        # Nothing starts with that: offer close spellings instead ("azithromicin")
+        matches = get_reference_data().medicine_matcher.suggest(query, limit=page_size)
+        medicines = [medicine for match in matches for medicine in match.medicines][:page_size]
+    return JsonResponse({
+        'results': [{'id': medicine.pk, 'text': str(medicine)} for medicine in medicines],
+        'pagination': {'more': next_cursor is not None, 'cursor': next_cursor},
+    })
+
+
+@login_required
+def api_patient_list(request):
+    """API endpoint for infinite scrolling of the patient list (for AJAX)"""
+    page = get_patient_page(request)
+    return JsonResponse({
+        'results': [
+            {
+                'id': patient.id,
+                'patient_id': patient.patient_id,
+                'name': patient.name,
+                'gender': patient.get_gender_display(),
+                'age': patient.age,
+                'url': reverse('patient_detail', args=[patient.pk]),
+            }
+            for patient in page.items
+        ],
+        'next_cursor': page.next_cursor,
+    })
 
 
 def api_patient_search(request):
     """API endpoint for patient search (for AJAX)"""
     query = request.GET.get('q', '')
-    if query:
-        patients = Patient.objects.filter(
-            Q(patient_id__icontains=query) |
-            Q(name__icontains=query)
-        ).values('id', 'patient_id', 'name', 'gender', 'age')[:10]
-        return JsonResponse(list(patients), safe=False)
-    return JsonResponse([], safe=False)
+    patients = [
+        {
+            'id': patient.id,
+            'patient_id': patient.patient_id,
+            'name': patient.name,
+            'gender': patient.gender,
+            'age': patient.age,
+        }
+        for patient in search_patients(query)
+    ]
+    return JsonResponse(patients, safe=False)
 
 
-def api_template_data(request, pk):
-    """API endpoint to get template data for applying to prescription"""
-    template = get_object_or_404(PrescriptionTemplate, pk=pk)
+def build_template_data(pk):
+    """Template fields and medicine rows as applied to a new prescription"""
+    template = get_object_or_404(PrescriptionTemplate.objects.prefetch_related(template_medicines()), pk=pk)
     
     data = {
         'clinical_record': template.clinical_record,
@@ -946,7 +1103,7 @@ def api_template_data(request, pk):
     
     for med in template.medicines.all():
         data['medicines'].append({
-            'medicine_id': med.medicine.id if med.medicine else None,
+            'medicine_id': med.medicine_id,
             'medicine_name': med.get_medicine_name(),
             'custom_medicine': med.custom_medicine,
             'dosage': med.dosage,
@@ -959,4 +1116,51 @@ def api_template_data(request, pk):
             'instructions': med.instructions,
         })
     
-    return JsonResponse(data)
+    return data
+
+
+@catalog_conditional
+def template_data_response(request, pk):
+    body = cached_catalog_json(
+        f'template-{pk}', request_catalog_version(request)[0], lambda: build_template_data(pk)
+    )
+    return HttpResponse(body, content_type='application/json')
+
+
+@cache_control(no_cache=True)
+def api_template_data(request, pk):
+    """API endpoint to get template data for applying to prescription"""
+    # A deleted template is a 404 even to a client holding a current ETag
+    get_object_or_404(PrescriptionTemplate.objects.only('pk'), pk=pk)
+    return template_data_response(request, pk)
+
+
+ANALYTICS_DEFAULT_DAYS = 30
+
+
+@login_required
+def api_analytics_timeseries(request):
+    """
+    Chart series for the dashboard
+    (?start=YYYY-MM-DD&end=YYYY-MM-DD&bucket=day|week|month&doctor=<id>&medicines=N)
+    """
+    try:
+        end = parse_date(request.GET.get('end') or '') or get_current_local_date()
+        start = parse_date(request.GET.get('start') or '') or end - timedelta(days=ANALYTICS_DEFAULT_DAYS - 1)
+    except ValueError:
+        return HttpResponseBadRequest('start and end must be real dates')
+    bucket = request.GET.get('bucket') or 'day'
+    if start > end:
+        return HttpResponseBadRequest('start must not be after end')
+    if bucket not in BUCKETS:
+        return HttpResponseBadRequest(f"bucket must be one of {', '.join(BUCKETS)}")
+    if len(bucket_starts(start, end, bucket)) > MAX_BUCKETS:
+        return HttpResponseBadRequest(f'Too many {bucket}s in that range, use a coarser bucket')
+    try:
+        doctor_id = int(request.GET['doctor']) if request.GET.get('doctor') else None
+        medicines = int(request.GET.get('medicines') or DEFAULT_MEDICINES)
+    except ValueError:
+        return HttpResponseBadRequest('doctor and medicines must be numbers')
+    medicines = max(0, min(medicines, MAX_MEDICINES))
+    body = cached_timeseries(start, end, bucket, doctor_id, medicines)
+    return HttpResponse(body, content_type='application/json')
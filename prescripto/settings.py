@@ -100,3 +100,26 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Authentication settings
 LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = 'dashboard'
+
+# Patient ID allocation (see clinic/ids.py)
+PATIENT_ID_PREFIX = 'PT-'
+PATIENT_ID_WIDTH = 5
+PATIENT_ID_BLOCK_SIZE = 20
+
+# Rendered print slip cache (see clinic/print_cache.py)
+PRINT_CACHE_ALIAS = 'default'
+PRINT_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Serialized catalog API bodies, cached per catalog version (see clinic/catalog.py)
+CATALOG_CACHE_ALIAS = 'default'
+CATALOG_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Dashboard chart series, cached per range, bucket, doctor and range revision (see clinic/analytics.py)
+ANALYTICS_CACHE_ALIAS = 'default'
+ANALYTICS_CACHE_TIMEOUT = 60 * 60
+
+# Server-side PDF slips (see clinic/pdf.py)
+PRESCRIPTION_PDF_DIR = BASE_DIR / 'pdf_cache'
+PRESCRIPTION_PDF_WORKERS = 2
+PRESCRIPTION_PDF_TIMEOUT = 30
+PRESCRIPTION_PDF_URDU_FONT = None